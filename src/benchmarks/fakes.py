@@ -0,0 +1,192 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeRedis:
+    """
+    In-process stand-in of the StrictRedis client (decode_responses=True) for the calls made by dpam:
+    strings with expiry, hashes, pipelines and a pub/sub that accepts subscriptions but never delivers.
+    """
+
+    def __init__(self):
+        self._data = {}         # key -> (value, expire_at)
+        self._lock = threading.RLock()
+        self.calls = 0
+
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None: return None
+        if item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item[0]
+
+
+    def get(self, key):
+        with self._lock:
+            self.calls += 1
+            value = self._get(key)
+            return value if not isinstance(value, dict) else None
+
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self.calls += 1
+            self._data[key] = (str(value), time.monotonic() + ex if ex else None)
+        return True
+
+
+    def delete(self, *keys):
+        with self._lock:
+            self.calls += 1
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+
+    def expire(self, key, seconds):
+        with self._lock:
+            value = self._get(key)
+            if value is None: return False
+            self._data[key] = (value, time.monotonic() + seconds)
+            return True
+
+
+    def ttl(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._get(key) is None: return -2
+            return -1 if item[1] is None else int(item[1] - time.monotonic())
+
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            self.calls += 1
+            fields = self._get(key) or {}
+            if field is not None: fields[field] = str(value)
+            fields.update({k: str(v) for k, v in (mapping or {}).items()})
+            item = self._data.get(key)
+            self._data[key] = (fields, item[1] if item else None)
+            return len(fields)
+
+
+    def hgetall(self, key):
+        with self._lock:
+            self.calls += 1
+            return dict(self._get(key) or {})
+
+
+    def hmget(self, key, fields):
+        with self._lock:
+            self.calls += 1
+            values = self._get(key) or {}
+            return [values.get(field) for field in fields]
+
+
+    def publish(self, channel, message):
+        return 0
+
+
+    def pubsub(self, **kwargs):
+        return _FakePubSub()
+
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        with self._redis._lock:
+            return [getattr(self._redis, name)(*args, **kwargs) for name, args, kwargs in self._commands]
+
+
+class _FakePubSub:
+    def subscribe(self, *args, **kwargs): pass
+
+    def psubscribe(self, *args, **kwargs): pass
+
+    def run_in_thread(self, **kwargs):
+        return None
+
+
+class FakeRedisDb:
+    """
+    Same interface as dsbase RedisDb (get, set with expiry_hours, .redis), all instances share one FakeRedis
+    """
+    _host = "fake"
+    _port = 0
+    _expiry_hours = 360
+    shared = FakeRedis()
+
+    def __init__(self):
+        self.redis = FakeRedisDb.shared
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def set(self, key, value, expiry_hours=None):
+        if expiry_hours is None: expiry_hours = self._expiry_hours
+        self.redis.set(key, value, ex=int(expiry_hours * 3600) if expiry_hours > 0 else None)
+
+
+def install_fake_redis():
+    """
+    RedisDb.default() returns a FakeRedisDb, to be called before the dpam modules are imported
+    """
+    from dsbase.tools.redis_db import RedisDb
+    RedisDb.default = classmethod(lambda clz: FakeRedisDb())
+    RedisDb._expiry_hours = FakeRedisDb._expiry_hours
+
+
+class StubSsoServer:
+    """
+    Local http server answering the sso VerifyToken call, any token "<user>-..." is the user's ticket
+    """
+
+    def __init__(self, latency=0.0):
+        latency_ = latency
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                token = body.get("Token", "")
+                if latency_: time.sleep(latency_)
+                if "-" in token:
+                    payload, status = {"AD": token.split("-")[0], "MemID": "M" + token.split("-")[0]}, 200
+                else:
+                    payload, status = {"Message": "invalid token"}, 401
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/SSO/VerifyToken"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,240 @@
+"""
+Benchmarks of the account, permission and event hot paths.
+
+    cd src
+    python -m benchmarks.run --rows 100000 --out bench_$(git rev-parse --short HEAD).json
+    python -m benchmarks.run --rows 100000 --compare bench_<old>.json
+
+A synthetic account table (--rows) and event table (--events) are seeded in a temporary working directory with its
+own config/config.json and instance/flask.cfg. Redis is replaced by an in-process fake and sso by a local stub
+server, so the numbers only depend on this tree. Every benchmark is run --repeat times of --number calls, the
+per-call median/min/mean (seconds) are written as JSON.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.fakes import StubSsoServer, install_fake_redis
+from benchmarks.seed import PASSWORD, build_events, seed_account_db
+
+_benchmarks = {}
+
+
+def benchmark(name):
+    """
+    register a setup function, setup(context) returns the function called once per timed iteration
+    """
+    def decorator(setup):
+        _benchmarks[name] = setup
+        return setup
+    return decorator
+
+
+#region benchmarks
+@benchmark("get_client_info")
+def _get_client_info(ctx):
+    from dpam.tools.account import get_client_info
+    users = itertools.cycle(ctx["sample"]["users"])
+    return lambda: get_client_info(next(users))
+
+
+@benchmark("account_init")
+def _account_init(ctx):
+    from dpam.tools.account import Account
+    users = itertools.cycle(ctx["sample"]["users"])
+    return lambda: Account(next(users))
+
+
+@benchmark("account_init_uncached")
+def _account_init_uncached(ctx):
+    from dpam.tools.account import Account
+    from dpam.tools.account_cache import AccountCache
+    users = itertools.cycle(ctx["sample"]["users"])
+    def run():
+        AccountCache._cache.clear()
+        Account(next(users))
+    return run
+
+
+@benchmark("check_client_id_password")
+def _check_client_id_password(ctx):
+    from dpam.tools.account import check_client_id_password
+    users = itertools.cycle(ctx["sample"]["users"])
+    return lambda: check_client_id_password(next(users), PASSWORD)
+
+
+@benchmark("check_and_log")
+def _check_and_log(ctx):
+    from dpam.tools.account import check_and_log, check_client_id_password
+    tokens = itertools.cycle([check_client_id_password(user, PASSWORD)["apikey"] for user in ctx["sample"]["users"][:50]])
+    return lambda: check_and_log(next(tokens))
+
+
+@benchmark("validate_ds_permission")
+def _validate_ds_permission(ctx):
+    from dpam.tools.request_handler import validate_ds_permission
+    pairs = itertools.cycle(list(itertools.product(ctx["sample"]["registries"][:10], ctx["sample"]["urls"][:20])))
+    return lambda: validate_ds_permission(*next(pairs))
+
+
+@benchmark("find_best_match_res")
+def _find_best_match_res(ctx):
+    from dpam.tools.account import Account
+    paths = itertools.cycle(url.removeprefix("http://host") for url in ctx["sample"]["urls"])
+    return lambda: Account._find_best_match_res(next(paths))
+
+
+@benchmark("sso_verify_token")
+def _sso_verify_token(ctx):
+    from dpam.tools import validate_user
+    from dpam.tools.get_env import env
+    validate_user._api[f"v4_{env}_vtt"] = ctx["sso_url"]
+    tokens = itertools.cycle([f"{user}-token" for user in ctx["sample"]["users"][:50]])
+    return lambda: validate_user.SsoTokenCache.verify(next(tokens))
+
+
+@benchmark("save_event")
+def _save_event(ctx):
+    from dpem.event_api import app, save_event
+    events = itertools.cycle(list(build_events(100, ctx["sample"]["users"], ctx["seed"])))
+    def run():
+        with app.app_context():
+            save_event(json_event(next(events)), "log")
+    return run
+
+
+@benchmark("query_events")
+def _query_events(ctx):
+    from dpem.events.carux_user_trace import query_events
+    users = itertools.cycle(ctx["sample"]["users"][:20])
+    return lambda: query_events(next(users), event_type="log")
+#endregion
+
+
+def json_event(event):
+    #seed的actor/target等欄位是json字串，save_event收到的是dict
+    return {key: json.loads(value) if key in ("actor", "target", "context", "_metadata") else value
+            for key, value in event.items()}
+
+
+def prepare_workdir(workdir, args):
+    os.makedirs(os.path.join(workdir, "config"), exist_ok=True)
+    os.makedirs(os.path.join(workdir, "instance"), exist_ok=True)
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+    db_path = os.path.join(workdir, "account.sqlite")
+    config = {
+        "database": {"database_list": [{"type": "sqlite", "connection_string": db_path, "driver_path": ""}], "default": 0},
+        "log": {"folder_path": [workdir, "logs"], "level": "WARNING"},
+        "cache": {"type": "AUTO", "connection": {"host": "localhost", "port": 6379}, "expiry_hours": 24},
+        "grpc": {"clientapival": {"server": "localhost", "port": 50051}},
+        "metrics": {"enabled": False},
+    }
+    with open(os.path.join(workdir, "config", "config.json"), "w") as f: json.dump(config, f, indent=2)
+    with open(os.path.join(workdir, "instance", "flask.cfg"), "w") as f: f.write("DEBUG = False\n")
+    return seed_account_db(db_path, args.rows, args.seed)
+
+
+def seed_events(count, users, seed):
+    from dpem.event_api import app, db, migrate_db, UnifiedEvent
+    with app.app_context():
+        db.create_all()
+        events = build_events(count, users, seed)
+        while True:
+            chunk = list(itertools.islice(events, 5000))
+            if len(chunk) == 0: break
+            db.session.execute(UnifiedEvent.__table__.insert(), chunk)
+        db.session.commit()
+    migrate_db(backfill=True)
+
+
+def measure(func, number, repeat, warmup=3):
+    for _ in range(warmup): func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number): func()
+        timings.append((time.perf_counter() - start) / number)
+    median = statistics.median(timings)
+    return {"median": median, "min": min(timings), "mean": statistics.mean(timings),
+            "ops_per_sec": 1 / median if median > 0 else None, "number": number, "repeat": repeat}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path, threshold=0.1):
+    with open(baseline_path) as f: baseline = json.load(f)["results"]
+    print(f"{'benchmark':<28}{'baseline':>14}{'current':>14}{'ratio':>9}")
+    for name, result in results.items():
+        if name not in baseline or "median" not in result or "median" not in baseline[name]: continue
+        ratio = result["median"] / baseline[name]["median"]
+        flag = " slower" if ratio > 1 + threshold else " faster" if ratio < 1 - threshold else ""
+        print(f"{name:<28}{baseline[name]['median']:>14.6f}{result['median']:>14.6f}{ratio:>9.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="rows of the account table (10k - 1M)")
+    parser.add_argument("--events", type=int, default=10000, help="rows of the event table")
+    parser.add_argument("--number", type=int, default=200, help="calls per repeat")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help=f"benchmarks to run: {', '.join(_benchmarks)}")
+    parser.add_argument("--out", help="JSON result file")
+    parser.add_argument("--compare", help="JSON result file of a previous run")
+    parser.add_argument("--workdir", help="working directory to seed (default: a temporary directory)")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="dpam_bench_"))
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    seed_start = time.perf_counter()
+    sample = prepare_workdir(workdir, args)
+    #dpam/dsbase讀取cwd下的config，dpem讀取PYTHONPATH(或cwd)下的instance
+    os.chdir(workdir)
+    os.environ["config_path"] = os.path.join(workdir, "config")
+    os.environ["configpath"] = os.path.join(workdir, "config")
+    os.environ["PYTHONPATH"] = workdir
+    install_fake_redis()
+
+    names = args.only or list(_benchmarks)
+    if any(name in ("save_event", "query_events") for name in names): seed_events(args.events, sample["users"], args.seed)
+    seed_seconds = time.perf_counter() - seed_start
+    print(f"seeded {args.rows} accounts and {args.events} events in {seed_seconds:.1f}s at {workdir}", file=sys.stderr)
+
+    results = {}
+    with StubSsoServer() as sso:
+        ctx = {"sample": sample, "seed": args.seed, "sso_url": sso.url}
+        for name in names:
+            try:
+                results[name] = measure(_benchmarks[name](ctx), args.number, args.repeat)
+                print(f"{name:<28}{results[name]['median'] * 1e6:>12.1f} us", file=sys.stderr)
+            except Exception as err:
+                results[name] = {"error": f"{type(err).__name__}: {err}"}
+                print(f"{name:<28} failed: {results[name]['error']}", file=sys.stderr)
+
+    report = {"meta": {"revision": git_revision(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "rows": args.rows,
+                       "events": args.events, "seed": args.seed, "python": platform.python_version(),
+                       "platform": platform.platform(), "seed_seconds": seed_seconds},
+              "results": results}
+    if out:
+        with open(out, "w") as f: json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if baseline: compare(results, baseline)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import json
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+ACCOUNT_DDL = """
+    CREATE TABLE ACCOUNT (
+        CLIENT_ID TEXT,
+        PASSWORD TEXT,
+        TYPE INTEGER,
+        EXPIRY TEXT,
+        PERMISSION TEXT,
+        OBSOLETE INTEGER,
+        OWNER_USER_ID TEXT,
+        CREATE_DTTM TEXT,
+        REGISTRY VARCHAR,
+        BIND_ROLE TEXT,
+        BIND_GROUP TEXT,
+        PRIMARY KEY (CLIENT_ID, OWNER_USER_ID, TYPE))"""
+
+SERVICES = ["ds", "mfg", "eng", "retrain", "ml", "apds", "class", "qa"]
+PASSWORD = "benchmark"
+
+
+def build_accounts(rows, seed=0):
+    """
+    Synthetic account rows: about 5% resources (TYPE 1) in a /service/area/item hierarchy, 1% groups (TYPE 3),
+    1% roles (TYPE 4) and users (TYPE 2) bound to some groups and roles. Returns (rows, sample) where sample has
+    client ids and urls to be used by the benchmarks.
+    """
+    rnd = random.Random(seed)
+    expiry = (datetime.today() + timedelta(365)).strftime("%Y-%m-%d")
+    dttm = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+    n_res = max(10, rows // 20)
+    n_grp = max(2, rows // 100)
+    n_role = max(2, rows // 100)
+    n_user = max(1, rows - n_res - n_grp - n_role)
+
+    resources = []
+    for ix in range(n_res):
+        service = SERVICES[ix % len(SERVICES)]
+        depth = 1 + ix % 3
+        path = f"/{service}" + "".join(f"/a{(ix // (n + 1)) % 50}" for n in range(depth - 1))
+        resources.append(f"{path}/*" if ix % 7 == 0 else path)
+    resources = list(dict.fromkeys(resources))
+
+    def registry(n):
+        regs = rnd.sample(resources, min(n, len(resources)))
+        if rnd.random() < 0.2: regs.append("-" + rnd.choice(resources).rstrip("/*") + "/hidden")
+        return ",".join(regs)
+
+    accounts = [(res, None, 1, expiry, "QUERY", 0, "system", dttm, "*" if ix % 3 else "/*,-/secret", "None", "None")
+                for ix, res in enumerate(resources)]
+    groups = [f"grp{ix}" for ix in range(n_grp)]
+    roles = [f"role{ix}" for ix in range(n_role)]
+    accounts += [(grp, None, 3, expiry, "QUERY", 0, "system", dttm, registry(5), "None", "None") for grp in groups]
+    accounts += [(role, None, 4, expiry, "QUERY", 0, "system", dttm, registry(5), "None", "None") for role in roles]
+
+    from dpam.tools.crypto import crypto_password
+    password = crypto_password(2, PASSWORD)
+    users = [f"user{ix}" for ix in range(n_user)]
+    for user in users:
+        accounts.append((user, password, 2, expiry, "QUERY", 0, user, dttm, registry(3),
+                         ",".join(rnd.sample(roles, 1)), ",".join(rnd.sample(groups, 2))))
+
+    urls = [f"http://host/{res.strip('/*')}/item{rnd.randint(0, 9)}" for res in rnd.sample(resources, min(200, len(resources)))]
+    sample = {"users": rnd.sample(users, min(200, len(users))), "resources": resources[:200], "urls": urls,
+              "registries": [registry(8) for _ in range(50)]}
+    return accounts, sample
+
+
+def seed_account_db(path, rows, seed=0):
+    accounts, sample = build_accounts(rows, seed)
+    cn = sqlite3.connect(path)
+    cn.execute("DROP TABLE IF EXISTS ACCOUNT")
+    cn.execute(ACCOUNT_DDL)
+    cn.executemany("INSERT INTO ACCOUNT VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", accounts)
+    cn.commit()
+    cn.close()
+    return sample
+
+
+def build_events(count, users, seed=0):
+    """
+    Event dicts as posted to dpem, spread over the last 30 days
+    """
+    rnd = random.Random(seed)
+    start = datetime.now() - timedelta(days=30)
+    for ix in range(count):
+        yield {"event_type": rnd.choice(["log", "log", "log", "issue", "alert"]),
+               "timestamp": (start + timedelta(seconds=ix * 2592000 // max(1, count))).isoformat(),
+               "actor": json.dumps({"clientid": "eng", "user_ad": rnd.choice(users), "ip": ""}),
+               "target": json.dumps({"service": rnd.choice(SERVICES), "resource": f"/item{rnd.randint(0, 99)}"}),
+               "action": rnd.choice(["login", "logout", "query", "export"]),
+               "outcome": rnd.choice(["success", "success", "failure"]),
+               "context": json.dumps({"user_agent": "bench", "location": "TN"}),
+               "_metadata": json.dumps({}), "log_level": "INFO"}
@@ -15,7 +15,7 @@ else:  cfg_path = os.path.join(os.environ["PYTHONPATH"], "instance", "flask.cfg"
 app=create_app(cfg_path)
 CORS(app)
 dbc = db.DbConnection
-dbc.default()
+dbc.check_db_config()
 print(f"Default DB location: {dbc._db_list[dbc._default_db_id]['connection_string']}")
 
 if __name__ == '__main__':
@@ -1,11 +1,12 @@
-from flask import Flask, render_template, request, json, make_response, redirect
+from flask import Flask, render_template, request, json, make_response, redirect, Response, stream_with_context
 import dpam.db_access as db
+import dpam.tools.account_bulk as account_bulk
 import dpam.tools.validate_user as validate_user
 from dpam.tools.account import check_client_id_password, verify_token_clientid
 from flask import Blueprint
 from flask_restx import Api, Resource, fields
 from dpam.tools.logger import Logger
-from dpam.tools.request_handler import validate_ds_permission
+from dpam.tools.permission_matcher import compile_registries
 from dpam.tools.crypto import get_account_token
 
 # app = Flask(__name__)
@@ -136,11 +137,9 @@ class UserPermitsClient(Resource):
     
     def get_client_with_permit(self,user_id, request_permits):
             accounts_ = db.select_accounts_registry_for_owner(user_id, resp_type="records")
-            _clients = []
-            for account in accounts_:
-                if account['REGISTRY'] is not None:
-                    if validate_ds_permission(account['REGISTRY'], request_permits)=="Permit": _clients.append(account['CLIENT_ID'])
-            return _clients
+            # all the owned clients are checked in one walk of their compiled registries
+            index = compile_registries(tuple((account['CLIENT_ID'], account['REGISTRY']) for account in accounts_))
+            return index.permitted(request_permits)
 
 @account_api.route('/user/permits/client/apikey')
 class UserPermitClientApikey(UserPermitsClient):
@@ -189,6 +188,49 @@ class UserClients(Resource):
 
 
 
+bulk_parser = account_api.parser()
+bulk_parser.add_argument('format', type=str, help='ndjson (default) or csv')
+bulk_parser.add_argument('type', type=int, action='append', help='Optional account types to export')
+bulk_parser.add_argument('upsert', type=str, help='Import: true to update the existing client ids instead of reporting them')
+@account_api.route('/accounts/bulk')
+class AccountsBulk(Resource):
+    """
+        Admin only. Export streams the accounts as NDJSON/CSV, import reads an NDJSON/CSV body in chunks and returns
+        the counts and the per-row errors.
+    """
+    @account_api.doc(security='ssotoken', description="export accounts as ndjson or csv")
+    @account_api.expect(bulk_parser)
+    def get(self):
+        user_id = self._admin_user()
+        if user_id is None: return {"message": "Given token is not correct or the user is not admin"}, 401
+        fmt = request.args.get('format', 'ndjson')
+        rows = account_bulk.export_accounts(types=request.args.getlist('type', type=int) or None)
+        Logger.log(f"{user_id} exports accounts as {fmt}")
+        if fmt == 'csv': return Response(stream_with_context(account_bulk.to_csv(rows)), mimetype='text/csv')
+        return Response(stream_with_context(account_bulk.to_ndjson(rows)), mimetype='application/x-ndjson')
+
+    @account_api.doc(security='ssotoken', description="import accounts from a ndjson or csv body")
+    @account_api.expect(bulk_parser)
+    def post(self):
+        user_id = self._admin_user()
+        if user_id is None: return {"message": "Given token is not correct or the user is not admin"}, 401
+        fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+        parse = account_bulk.parse_csv if fmt == 'csv' else account_bulk.parse_ndjson
+        upsert = request.args.get('upsert', 'false').lower() in ('1', 'true')
+        # the body is read line by line from the request stream
+        result = account_bulk.import_accounts(parse(request.stream), user_id=user_id, upsert=upsert)
+        Logger.log(f"{user_id} imports accounts: total {result['total']}, inserted {result['inserted']}, "
+                   f"updated {result['updated']}, errors {len(result['errors'])}")
+        return result, 200
+
+    def _admin_user(self):
+        auth_header = request.headers.get("Authorization")
+        if not (auth_header and auth_header.startswith('Bearer ')): return None
+        (user_id, sess_key) = validate_user.validate_user(token_required=True, token=auth_header.split(" ")[1])
+        if user_id is None or not validate_user.is_admin(user_id): return None
+        return user_id
+
+
 def get_index_page():
     (user_id, sess_key) = validate_user.validate_user(token_required=True)
     if user_id is None: return validate_user.redirect_to_login()
@@ -231,8 +273,7 @@ def browse_accounts():
     (user_id, sess_key) = validate_user.validate_user()
     if user_id is None: return validate_user.redirect_to_login()
 
-    sess = validate_user.UserSessions.get_session(sess_key)
-    sess["list_page"] = "/account/accounts_for_admin"
+    validate_user.set_list_page(sess_key, "/account/accounts_for_admin")
     
     msg_type = request.args["msg_type"] if "msg_type" in request.args else ""
     message = db.DBResult[request.args["db_result"]].value if "db_result" in request.args else ""
@@ -249,8 +290,7 @@ def browse_owner_accounts():
     (user_id, sess_key) = validate_user.validate_user()
     if user_id is None: return validate_user.redirect_to_login()
 
-    sess = validate_user.UserSessions.get_session(sess_key)
-    sess["list_page"] = "/account/accounts_for_owner"
+    validate_user.set_list_page(sess_key, "/account/accounts_for_owner")
 
     msg_type = request.args["msg_type"] if "msg_type" in request.args else ""
     message = db.DBResult[request.args["db_result"]].value if "db_result" in request.args else ""
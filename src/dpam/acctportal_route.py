@@ -52,8 +52,7 @@ def browse_accounts():
     (user_id, sess_key) = validate_user.validate_user()
     if user_id is None: return validate_user.redirect_to_login()
 
-    sess = validate_user.UserSessions.get_session(sess_key)
-    sess["list_page"] = url_for('acct_bp.browse_accounts') #"/account/accounts_for_admin"
+    validate_user.set_list_page(sess_key, url_for('acct_bp.browse_accounts')) #"/account/accounts_for_admin"
     
     msg_type = request.args["msg_type"] if "msg_type" in request.args else ""
     message = db.DBResult[request.args["db_result"]].value if "db_result" in request.args else ""
@@ -70,8 +69,7 @@ def browse_owner_accounts():
     (user_id, sess_key) = validate_user.validate_user()
     if user_id is None: return validate_user.redirect_to_login()
 
-    sess = validate_user.UserSessions.get_session(sess_key)
-    sess["list_page"] = url_for('acct_bp.browse_owner_accounts') #"/account/accounts_for_owner"
+    validate_user.set_list_page(sess_key, url_for('acct_bp.browse_owner_accounts')) #"/account/accounts_for_owner"
 
     msg_type = request.args["msg_type"] if "msg_type" in request.args else ""
     message = db.DBResult[request.args["db_result"]].value if "db_result" in request.args else ""
@@ -405,8 +403,7 @@ def browse_group_role():
     (user_id, sess_key) = validate_user.validate_user()
     if user_id is None: return validate_user.redirect_to_login()
 
-    sess = validate_user.UserSessions.get_session(sess_key)
-    sess["list_page"] = url_for('acct_bp.browse_group_role') #"/account/group_role_for_admin"
+    validate_user.set_list_page(sess_key, url_for('acct_bp.browse_group_role')) #"/account/group_role_for_admin"
 
     msg_type = request.args["msg_type"] if "msg_type" in request.args else ""
     message = db.DBResult[request.args["db_result"]].value if "db_result" in request.args else ""
@@ -425,8 +422,7 @@ def browse_resource():
     (user_id, sess_key) = validate_user.validate_user()
     if user_id is None: return validate_user.redirect_to_login()
 
-    sess = validate_user.UserSessions.get_session(sess_key)
-    sess["list_page"] = url_for('acct_bp.browse_resource') #"/account/resource_for_admin"
+    validate_user.set_list_page(sess_key, url_for('acct_bp.browse_resource')) #"/account/resource_for_admin"
 
     msg_type = request.args["msg_type"] if "msg_type" in request.args else ""
     message = db.DBResult[request.args["db_result"]].value if "db_result" in request.args else ""
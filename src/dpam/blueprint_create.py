@@ -2,14 +2,42 @@ from flask import Flask
 from flask import Blueprint
 from dpam.acctportal_route import account_bp as acct_bp
 from dpam.acctapi import acctapi_bp
+from dpam.tools.metrics import Metrics
 
 def create_app(config_filename=None):
   app = Flask(__name__, instance_relative_config=True)
   app.config.from_pyfile(config_filename)
   app = register_blueprint(app)
+  app = register_metrics(app)
   return app
 
 def register_blueprint(app):
   app.register_blueprint(acct_bp, url_prefix='/account')
   app.register_blueprint(acctapi_bp, url_prefix='/api')
-  return app
\ No newline at end of file
+  return app
+
+def register_metrics(app):
+  """
+  Request latency by endpoint, dependency spans and cache/pool gauges on /metrics (prometheus text format),
+  only when the "metrics" config has enabled: true
+  """
+  if not Metrics.enabled(): return app
+  Metrics.instrument()
+  Metrics.register_collector(_cache_gauges)
+  Metrics.init_app(app)
+  return app
+
+def _cache_gauges():
+  from dpam.dbtools.db_connection import DbConnection
+  from dpam.tools.account_cache import AccountCache
+  from dpam.tools.token_cache import TokenCache
+  from dpam.tools.validate_user import UserSessions, SsoTokenCache
+  gauges = []
+  for cache_name, stats in [("account", AccountCache.stats()), ("token", TokenCache.stats()),
+                            ("user_sessions", UserSessions.stats()), ("sso_token", SsoTokenCache.stats())]:
+    for key in ("size", "hits", "misses", "evictions", "expirations"):
+      gauges.append((f"dpam_cache_{key}", {"cache": cache_name}, stats[key]))
+  for db_id, stats in DbConnection.pool_stats().items():
+    for key in ("size", "idle", "hits", "misses", "waits", "timeouts"):
+      gauges.append((f"dpam_db_pool_{key}", {"db_id": db_id}, stats[key]))
+  return gauges
@@ -26,8 +26,7 @@ def browse_accounts():
     (user_id, sess_key) = validate_user.validate_user()
     if user_id is None: return validate_user.redirect_to_login()
 
-    sess = validate_user.UserSessions.get_session(sess_key)
-    sess["list_page"] = "/accounts_for_admin"
+    validate_user.set_list_page(sess_key, "/accounts_for_admin")
     
     msg_type = request.args["msg_type"] if "msg_type" in request.args else ""
     message = db.DBResult[request.args["db_result"]].value if "db_result" in request.args else ""
@@ -44,8 +43,7 @@ def browse_owner_accounts():
     (user_id, sess_key) = validate_user.validate_user()
     if user_id is None: return validate_user.redirect_to_login()
 
-    sess = validate_user.UserSessions.get_session(sess_key)
-    sess["list_page"] = "/accounts_for_owner"
+    validate_user.set_list_page(sess_key, "/accounts_for_owner")
 
     msg_type = request.args["msg_type"] if "msg_type" in request.args else ""
     message = db.DBResult[request.args["db_result"]].value if "db_result" in request.args else ""
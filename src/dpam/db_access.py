@@ -1,6 +1,8 @@
 from dpam.dbtools.db_connection import DbConnection
 import dpam.tools.crypto as crypto
 from dpam.dbtools.sql_buffer import SqlBuffer
+from dpam.dbtools.row_access import fetch_one, fetch_all
+from dpam.tools.account_cache import AccountCache
 import pandas as pd
 from datetime import datetime, timedelta
 import enum
@@ -34,44 +36,38 @@ def insert_account(client_id, password, user_id, type=2, valid_days=365.25*10, b
     dttm = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
     crypted_password = crypto.crypto_password(type, password)
     expiry = (datetime.today() + timedelta(valid_days)).strftime("%Y-%m-%d")
-    sql = f'''
+    sql = '''
         INSERT INTO ACCOUNT (CLIENT_ID, PASSWORD, TYPE, EXPIRY, PERMISSION, OWNER_USER_ID, OBSOLETE, CREATE_DTTM, BIND_GROUP, BIND_ROLE) 
-        VALUES('{client_id}', '{crypted_password}', '{type}', '{expiry}', 'QUERY', '{user_id}', 0, '{dttm}', '{bind_group}', '{bind_role}')'''
+        VALUES(?, ?, ?, ?, 'QUERY', ?, 0, ?, ?, ?)'''
+    # bind_group/bind_role are stored as text, None is kept as 'None' the same as before
+    buf = SqlBuffer(sql, params=[client_id, crypted_password, type, expiry, user_id, dttm, str(bind_group), str(bind_role)])
 
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
 
     #return "Create Client ID successfully!"
     return DBResult.CreateAccountOK
 
 def update_account(client_id, expiry, permission, obsolete, registry="", bind_group="", bind_role=""):
-    sql = f"UPDATE ACCOUNT SET EXPIRY = '{expiry}', PERMISSION = '{permission}', OBSOLETE = {1 if obsolete else 0}, REGISTRY = '{registry}', BIND_ROLE = '{bind_role}', BIND_GROUP = '{bind_group}'"
-    buf = SqlBuffer(sql).add("CLIENT_ID", client_id)
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(buf.sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    sql = "UPDATE ACCOUNT SET EXPIRY = ?, PERMISSION = ?, OBSOLETE = ?, REGISTRY = ?, BIND_ROLE = ?, BIND_GROUP = ?"
+    buf = SqlBuffer(sql, params=[expiry, permission, 1 if obsolete else 0, registry, bind_role, bind_group])
+    buf.add("CLIENT_ID", client_id)
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id)
 
     #return "Update Client ID successfully!"
     return DBResult.UpdateAccountOK
 
 def update_account_registry(client_id, registry="", type=2, consolidate=True):
     if consolidate: registry = consolidate_registry_value(registry)
-    sql = f"UPDATE ACCOUNT SET REGISTRY = '{registry}'"
-    buf = SqlBuffer(sql).add("CLIENT_ID", client_id)
+    sql = "UPDATE ACCOUNT SET REGISTRY = ?"
+    buf = SqlBuffer(sql, params=[registry]).add("CLIENT_ID", client_id)
     buf.add("TYPE", type)
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(buf.sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
 
     #return "Update Client ID successfully!"
     return DBResult.UpdateAccountOK
@@ -89,65 +85,78 @@ def consolidate_registry_value(_registry:str):
             seen.add(item)
     return ",".join(result)
 
+def apply_registry_corrections(inserts, updates, user_id="system", valid_days=365.25*10):
+    """
+        Bulk write of a registry validation in one transaction
+        inserts: [(client_id, type, registry)] clients to be created with the registry value
+        updates: [(client_id, type, registry)] registry values to be replaced
+    """
+    dttm = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+    expiry = (datetime.today() + timedelta(valid_days)).strftime("%Y-%m-%d")
+    insert_sql = '''
+        INSERT INTO ACCOUNT (CLIENT_ID, PASSWORD, TYPE, EXPIRY, PERMISSION, OWNER_USER_ID, OBSOLETE, CREATE_DTTM, BIND_GROUP, BIND_ROLE, REGISTRY) 
+        VALUES(?, ?, ?, ?, 'QUERY', ?, 0, ?, 'None', 'None', ?)'''
+    update_sql = "UPDATE ACCOUNT SET REGISTRY = ? WHERE CLIENT_ID = ? AND TYPE = ?"
+
+    with DbConnection.connect() as cn:
+        cn.executemany(insert_sql, [(client_id, crypto.crypto_password(type, ""), type, expiry, user_id, dttm, registry)
+                                    for client_id, type, registry in inserts])
+        cn.executemany(update_sql, [(registry, client_id, type) for client_id, type, registry in updates])
+    AccountCache.invalidate()
+
+    return DBResult.UpdateAccountOK
+
 def delete_account(client_id,type=2):
     sql = 'DELETE FROM ACCOUNT'
     buf = SqlBuffer(sql).add("CLIENT_ID", client_id)
     buf.add("TYPE", type)
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(buf.sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
 
     return DBResult.DeleteAccountOK
 
 def change_password(client_id, password):
     type = 2
     crypted_password = crypto.crypto_password(type, password)
-    sql = f"UPDATE ACCOUNT SET PASSWORD = '{crypted_password}', TYPE = {type}"
-    buf = SqlBuffer(sql).add("CLIENT_ID", client_id)
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(buf.sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    sql = "UPDATE ACCOUNT SET PASSWORD = ?, TYPE = ?"
+    buf = SqlBuffer(sql, params=[crypted_password, type]).add("CLIENT_ID", client_id)
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id)
 
     return DBResult.UpdatePasswordOK
 
 def select_account_for_admin(client_id):
     sql = 'SELECT CLIENT_ID, EXPIRY, PERMISSION, OBSOLETE, REGISTRY, BIND_GROUP, BIND_ROLE FROM ACCOUNT'
     buf = SqlBuffer(sql).add("CLIENT_ID", client_id)
-    cn = DbConnection.default()
-    df = pd.read_sql_query(buf.sql, cn)
-    dict_list =  df.to_dict('records')
 
-    return dict_list[0] if len(dict_list) > 0 else None
+    return fetch_one(buf)
 
 def select_accounts_for_admin():
     sql = 'SELECT CLIENT_ID, OWNER_USER_ID, CREATE_DTTM, EXPIRY, PERMISSION, OBSOLETE, BIND_GROUP, BIND_ROLE FROM ACCOUNT WHERE TYPE = 2'
-    cn = DbConnection.default()
-    df = pd.read_sql_query(sql, cn)
+    with DbConnection.connect() as cn:
+        df = pd.read_sql_query(sql, cn)
     dict_list =  df.to_dict('records')
 
     return dict_list
 
 def select_accounts_for_owner(user_id,resp_type="records"):
     sql = 'SELECT CLIENT_ID, CREATE_DTTM FROM ACCOUNT'
-    buf = SqlBuffer(sql).add("OWNER_USER_ID", user_id).add("TYPE", "2")
-    cn = DbConnection.default()
-    df = pd.read_sql_query(buf.sql, cn)
-    dict_list =  df.to_dict('records')
+    buf = SqlBuffer(sql).add("OWNER_USER_ID", user_id).add("TYPE", 2)
+    dict_list = fetch_all(buf)
 
     return dict_list if len(dict_list) > 0 else None
 
 def select_accounts_registry_for_owner(user_id, resp_type="records"):
     sql = 'SELECT CLIENT_ID,REGISTRY, CREATE_DTTM FROM ACCOUNT'
     buf = SqlBuffer(sql).add("OWNER_USER_ID", user_id)
-    cn = DbConnection.default()
-    df = pd.read_sql_query(buf.sql, cn)
-    dict_list =  df.to_dict(resp_type)
+    if resp_type == "records":
+        dict_list = fetch_all(buf)
+    else:
+        with DbConnection.connect() as cn:
+            df = pd.read_sql_query(buf.sql, cn, params=buf.params)
+        dict_list =  df.to_dict(resp_type)
 
     return dict_list if len(dict_list) > 0 else None
 
@@ -155,16 +164,14 @@ def select_accounts_registry_for_owner(user_id, resp_type="records"):
 # 新增角色或群組
 def insert_group_role(client_id, type, register):
     dttm = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
-    sql = f'''
+    sql = '''
         INSERT INTO ACCOUNT (CLIENT_ID, TYPE, REGISTRY, CREATE_DTTM) 
-        VALUES('{client_id}', {type}, '{register}', '{dttm}')'''
-
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+        VALUES(?, ?, ?, ?)'''
+    buf = SqlBuffer(sql, params=[client_id, type, register, dttm])
+
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
     
     if type == 4:
         return DBResult.CreateRoleOK
@@ -173,14 +180,11 @@ def insert_group_role(client_id, type, register):
     
 # 更新registry & expiry 
 def update_group_role(client_id, type, registry):
-    sql = f"UPDATE ACCOUNT SET REGISTRY = '{registry}' WHERE CLIENT_ID = '{client_id}' AND TYPE = {type}"
-    buf = SqlBuffer(sql)
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(buf.sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    sql = "UPDATE ACCOUNT SET REGISTRY = ?"
+    buf = SqlBuffer(sql, params=[registry]).add_eq("CLIENT_ID", client_id).add_eq("TYPE", type)
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
 
     if type == 4:
         return DBResult.UpdateRoleOK
@@ -191,32 +195,26 @@ def update_group_role(client_id, type, registry):
     
 # 查詢角色或群組
 def select_group_role_for_admin(client_id, type):
-    sql = f"SELECT CLIENT_ID, CREATE_DTTM, REGISTRY, TYPE FROM ACCOUNT WHERE CLIENT_ID = '{client_id}' AND TYPE = {type}"
-    buf = SqlBuffer(sql)
-    cn = DbConnection.default()
-    df = pd.read_sql_query(buf.sql, cn)
-    dict_list =  df.to_dict('records')
+    sql = "SELECT CLIENT_ID, CREATE_DTTM, REGISTRY, TYPE FROM ACCOUNT"
+    buf = SqlBuffer(sql).add_eq("CLIENT_ID", client_id).add_eq("TYPE", type)
 
-    return dict_list[0] if len(dict_list) > 0 else None
+    return fetch_one(buf)
 
 def select_groups_roles_for_admin():
     sql = 'SELECT CLIENT_ID, CREATE_DTTM, REGISTRY, TYPE FROM ACCOUNT WHERE TYPE IN (3, 4)'
-    cn = DbConnection.default()
-    df = pd.read_sql_query(sql, cn)
+    with DbConnection.connect() as cn:
+        df = pd.read_sql_query(sql, cn)
     dict_list =  df.to_dict('records')
 
     return dict_list
 
 # 刪除角色或群組 
 def delete_group_role(client_id, type):
-    sql = f"DELETE FROM ACCOUNT WHERE CLIENT_ID = '{client_id}' AND TYPE = {type}"
-    buf = SqlBuffer(sql)
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(buf.sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    sql = "DELETE FROM ACCOUNT"
+    buf = SqlBuffer(sql).add_eq("CLIENT_ID", client_id).add_eq("TYPE", type)
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
 
     if type == 4:
         return DBResult.DeleteRoleOK
@@ -230,59 +228,48 @@ def delete_group_role(client_id, type):
 # 查詢資源
 def select_resources_for_admin():
     sql = 'SELECT CLIENT_ID, TYPE, OWNER_USER_ID, CREATE_DTTM, REGISTRY FROM ACCOUNT WHERE TYPE = 1'
-    cn = DbConnection.default()
-    df = pd.read_sql_query(sql, cn)
+    with DbConnection.connect() as cn:
+        df = pd.read_sql_query(sql, cn)
     dict_list =  df.to_dict('records')
 
     return dict_list
 
 def select_resource_for_admin(client_id, type):
-    sql = f"SELECT CLIENT_ID, TYPE, OWNER_USER_ID, CREATE_DTTM, REGISTRY FROM ACCOUNT WHERE CLIENT_ID = '{client_id}' AND TYPE = {type}"
-    buf = SqlBuffer(sql)
-    cn = DbConnection.default()
-    df = pd.read_sql_query(buf.sql, cn)
-    dict_list =  df.to_dict('records')
+    sql = "SELECT CLIENT_ID, TYPE, OWNER_USER_ID, CREATE_DTTM, REGISTRY FROM ACCOUNT"
+    buf = SqlBuffer(sql).add_eq("CLIENT_ID", client_id).add_eq("TYPE", type)
 
-    return dict_list[0] if len(dict_list) > 0 else None
+    return fetch_one(buf)
 
 # 新增資源
 def insert_resource(client_id, type, register, user_id):
     dttm = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
-    sql = f'''
+    sql = '''
         INSERT INTO ACCOUNT (CLIENT_ID, TYPE, REGISTRY, OWNER_USER_ID, CREATE_DTTM) 
-        VALUES('{client_id}', {type}, '{register}', '{user_id}', '{dttm}')'''
-
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+        VALUES(?, ?, ?, ?, ?)'''
+    buf = SqlBuffer(sql, params=[client_id, type, register, user_id, dttm])
+
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
     
     return DBResult.CreateResourceOK
     
 # 更新registry & expiry 
 def update_resource(client_id, type, registry, user_id):
-    sql = f"UPDATE ACCOUNT SET REGISTRY = '{registry}', OWNER_USER_ID = '{user_id}' WHERE CLIENT_ID = '{client_id}' AND TYPE = {type}"
-    buf = SqlBuffer(sql)
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(buf.sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    sql = "UPDATE ACCOUNT SET REGISTRY = ?, OWNER_USER_ID = ?"
+    buf = SqlBuffer(sql, params=[registry, user_id]).add_eq("CLIENT_ID", client_id).add_eq("TYPE", type)
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
 
     return DBResult.UpdateResourceOK
 
 # 刪除資源
 def delete_resource(client_id, type):
-    sql = f"DELETE FROM ACCOUNT WHERE CLIENT_ID = '{client_id}' AND TYPE = {type}"
-    buf = SqlBuffer(sql)
-    cn = DbConnection.default()
-    curs = cn.cursor()
-    curs.execute(buf.sql)
-    curs.close()
-    cn.commit()
-    cn.close()
+    sql = "DELETE FROM ACCOUNT"
+    buf = SqlBuffer(sql).add_eq("CLIENT_ID", client_id).add_eq("TYPE", type)
+    with DbConnection.connect() as cn:
+        cn.execute(buf.sql, buf.params)
+    AccountCache.invalidate(client_id, type)
 
     return DBResult.DeleteResourceOK
@@ -0,0 +1,164 @@
+import gc
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that goes back to its pool on close().
+    It is still a real sqlite3.Connection, so pd.read_sql_query and the existing
+    cursor/commit/close pattern keep working unchanged.
+    """
+    _pool = None
+    _checked_out = False
+    _finalizer = None
+
+    def close(self):
+        if self._pool is None: return self.dispose()
+        if self._checked_out: self._pool.checkin(self)
+
+    def dispose(self):
+        if self._finalizer is not None: self._finalizer.detach()
+        self._pool = None
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    """
+    checkout/checkin pool of connections for one db_id.
+    - max_size: the number of open connections (idle + checked out) never exceeds it
+    - idle_timeout: idle connections older than it (seconds) are closed on the next checkout/checkin
+    - wait_timeout: seconds a checkout waits for a free connection before raising TimeoutError
+    - on_create: called once with each new connection (pragmas etc.)
+    hit/miss/wait counters are kept for sizing, see stats()
+    """
+
+    def __init__(self, factory, max_size=8, idle_timeout=300, wait_timeout=30, on_create=None):
+        self._factory = factory
+        self._on_create = on_create
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+
+        self._idle = deque()          # (connection, last_used)
+        self._size = 0
+        self._cond = threading.Condition()
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.evictions = 0
+        self.leaks = 0
+
+
+    def checkout(self):
+        with self._cond:
+            self._evict_idle()
+            if len(self._idle) == 0 and self._size >= self.max_size:
+                self._wait_for_idle()
+
+            if len(self._idle) > 0:
+                cn, _ = self._idle.pop()
+                self.hits += 1
+            else:
+                cn = None
+                self._size += 1
+                self.misses += 1
+
+        if cn is None:
+            try:
+                cn = self._create()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        cn._checked_out = True
+        return cn
+
+
+    def checkin(self, cn):
+        cn._checked_out = False
+        try:
+            if cn.in_transaction: cn.rollback()
+        except sqlite3.Error:
+            self._discard(cn)
+            return
+
+        with self._cond:
+            self._idle.append((cn, time.monotonic()))
+            self._evict_idle()
+            self._cond.notify()
+
+
+    def close_all(self):
+        with self._cond:
+            while len(self._idle) > 0:
+                cn, _ = self._idle.popleft()
+                cn.dispose()
+                self._size -= 1
+
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses, "waits": self.waits,
+                    "wait_time": round(self.wait_time, 6), "timeouts": self.timeouts,
+                    "evictions": self.evictions, "leaks": self.leaks}
+
+
+    def _create(self):
+        cn = self._factory()
+        cn._pool = self
+        #checkout之後沒有close就被回收的connection，釋放它佔用的名額，避免pool被漏掉的connection耗盡
+        cn._finalizer = weakref.finalize(cn, self._release_slot)
+        if self._on_create: self._on_create(cn)
+        return cn
+
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self.leaks += 1
+            self._cond.notify()
+
+
+    def _wait_for_idle(self):
+        #must be called while holding self._cond
+        self.waits += 1
+        start = time.monotonic()
+        #sqlite3 connection本身有reference cycle，漏掉的connection要等gc才會回收，pool用盡時先回收一次
+        gc.collect()
+        deadline = start + self.wait_timeout
+        while len(self._idle) == 0 and self._size >= self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.wait_time += time.monotonic() - start
+                self.timeouts += 1
+                raise TimeoutError(f"No connection available within {self.wait_timeout}s (max_size={self.max_size})")
+            self._cond.wait(remaining)
+        self.wait_time += time.monotonic() - start
+
+
+    def _evict_idle(self):
+        #must be called while holding self._cond, the oldest idle connections are on the left
+        if self.idle_timeout is None or self.idle_timeout <= 0: return
+        now = time.monotonic()
+        while len(self._idle) > 0 and now - self._idle[0][1] > self.idle_timeout:
+            cn, _ = self._idle.popleft()
+            cn.dispose()
+            self._size -= 1
+            self.evictions += 1
+
+
+    def _discard(self, cn):
+        cn.dispose()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
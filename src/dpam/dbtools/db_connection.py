@@ -1,10 +1,26 @@
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from dpam.tools.config_loader import ConfigLoader
+from dpam.dbtools.connection_pool import ConnectionPool, PooledConnection
 
 class DbConnection:
     _db_list = []
     _default_db_id = 0
+    _pool_config = {}
+    _pools = {}
+    _pools_pid = None
+    _pools_lock = threading.Lock()
+
+    #WAL與調整過的pragma，每條connection建立時套用一次
+    default_sqlite_pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+        "cache_size": -8000,
+    }
 
     #取得預設的DB連線
     @classmethod
@@ -13,11 +29,61 @@ class DbConnection:
         return clz.connection(clz._default_db_id)
 
 
-    #以DB id，產生DB connection instance
+    #以DB id，從pool取出DB connection instance，close()會還回pool
     @classmethod
     def connection(clz, db_id):
         clz.check_db_config()
+        return clz.pool(db_id).checkout()
+
+
+    #with DbConnection.connect() as cn: ...，正常結束commit，例外則rollback，最後還回pool
+    @classmethod
+    @contextmanager
+    def connect(clz, db_id=None):
+        clz.check_db_config()
+        if db_id is None: db_id = clz._default_db_id
+        cn = clz.connection(db_id)
+        try:
+            yield cn
+            cn.commit()
+        except Exception:
+            cn.rollback()
+            raise
+        finally:
+            cn.close()
+
+
+    #以DB id取得(或建立)該DB的connection pool
+    @classmethod
+    def pool(clz, db_id):
+        pool = clz._pools.get(db_id)
+        if pool is not None and clz._pools_pid == os.getpid(): return pool
+
+        with clz._pools_lock:
+            #gunicorn fork之後不沿用parent的connection，每個worker各自建立pool
+            if clz._pools_pid != os.getpid():
+                clz._pools = {}
+                clz._pools_pid = os.getpid()
+            if db_id not in clz._pools:
+                db_info = clz._db_list[db_id]
+                clz._pools[db_id] = ConnectionPool(
+                    factory=lambda: clz.open_connection(db_id),
+                    max_size=int(clz._pool_config.get("max_size", 8)),
+                    idle_timeout=float(clz._pool_config.get("idle_timeout", 300)),
+                    wait_timeout=float(clz._pool_config.get("wait_timeout", 30)),
+                    on_create=lambda cn: clz.apply_pragmas(db_info["type"], cn))
+            return clz._pools[db_id]
+
 
+    #各pool的hit/miss/wait統計，用來調整max_size
+    @classmethod
+    def pool_stats(clz):
+        return {db_id: pool.stats() for db_id, pool in list(clz._pools.items())}
+
+
+    #以DB id，直接產生DB connection instance (不經過pool)
+    @classmethod
+    def open_connection(clz, db_id):
         db_info = clz._db_list[db_id]
         func_name = f'get_{db_info["type"]}_connection'
         func = getattr(clz, func_name)
@@ -25,23 +91,40 @@ class DbConnection:
         return connection
 
 
+    @classmethod
+    def apply_pragmas(clz, db_type, cn):
+        if db_type != "sqlite": return
+        pragmas = dict(clz.default_sqlite_pragmas)
+        pragmas.update(clz._pool_config.get("pragmas", {}))
+        for name, value in pragmas.items():
+            cn.execute(f"PRAGMA {name} = {value}")
+
+
     @classmethod
     def check_db_config(clz):
         if len(clz._db_list) == 0:
             db_config = ConfigLoader.config("database")
             clz._db_list = db_config["database_list"]
             clz._default_db_id = db_config["default"]
+            clz._pool_config = db_config.get("pool", {})
 
 
     @classmethod
     def reset_db_config(clz):
+        with clz._pools_lock:
+            for pool in clz._pools.values(): pool.close_all()
+            clz._pools = {}
         clz._db_list = []
         clz._default_db_id = 0
+        clz._pool_config = {}
 
 
     #以connection string, driver path，直接產生DB connection instance
-    @staticmethod
-    def get_sqlite_connection(connection_string, driver_path):
+    #pool會跨thread借出connection，因此關閉check_same_thread，由checkout/checkin保證同時只有一個thread使用
+    #cached_statements是每條connection的prepared statement cache大小，SqlBuffer參數化後相同查詢可重複使用
+    @classmethod
+    def get_sqlite_connection(clz, connection_string, driver_path):
         # print(f"connectoin String: {connection_string} / driver_path: {driver_path}")
-        return sqlite3.connect(connection_string)
-
+        cached_statements = int(clz._pool_config.get("cached_statements", 256))
+        return sqlite3.connect(connection_string, factory=PooledConnection, check_same_thread=False,
+                               cached_statements=cached_statements)
@@ -0,0 +1,38 @@
+from dpam.dbtools.db_connection import DbConnection
+
+#單筆/少量資料的查詢直接由cursor取值，不經過pandas DataFrame
+#buf為SqlBuffer，報表類的大量查詢仍可使用pd.read_sql_query
+
+
+#回傳(欄位名稱list, row tuple list)
+def fetch_rows(buf, db_id=None):
+    with DbConnection.connect(db_id) as cn:
+        curs = cn.execute(buf.sql, buf.params)
+        columns = [d[0] for d in curs.description]
+        rows = curs.fetchall()
+        curs.close()
+
+    return columns, rows
+
+
+#第一筆資料的dict，沒有資料回傳None
+def fetch_one(buf, db_id=None):
+    with DbConnection.connect(db_id) as cn:
+        curs = cn.execute(buf.sql, buf.params)
+        columns = [d[0] for d in curs.description]
+        row = curs.fetchone()
+        curs.close()
+
+    return dict(zip(columns, row)) if row is not None else None
+
+
+#與DataFrame.to_dict('records')相同的格式: [{欄位: 值}, ...]
+def fetch_all(buf, db_id=None):
+    columns, rows = fetch_rows(buf, db_id)
+    return [dict(zip(columns, row)) for row in rows]
+
+
+#與DataFrame.to_dict()相同的格式: {欄位: {row index: 值}}，沒有資料時每個欄位都是{}
+def fetch_columns(buf, db_id=None):
+    columns, rows = fetch_rows(buf, db_id)
+    return {col: {ix: row[i] for ix, row in enumerate(rows)} for i, col in enumerate(columns)}
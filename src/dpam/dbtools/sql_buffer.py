@@ -1,7 +1,14 @@
+#組SQL並收集參數，值一律以placeholder帶入，不直接串進SQL字串
+#同一種查詢不論值為何都產生相同的SQL，connection的statement cache才能重複使用已編譯的statement
+#執行時: curs.execute(buf.sql, buf.params) 或 pd.read_sql_query(buf.sql, cn, params=buf.params)
 class SqlBuffer:
-    def __init__(self, sql, conj='WHERE', alias=''):
+    #sqlite3的qmark paramstyle
+    placeholder = '?'
+
+    def __init__(self, sql, conj='WHERE', alias='', params=None):
         self._sql = sql
         self._conj = conj
+        self._params = list(params) if params else []
 
         if alias and not alias.endswith('.'): alias += '.'
         self._alias = alias
@@ -19,9 +26,10 @@ class SqlBuffer:
         self._sql += f'\n\t{appended}'
 
 
-    def append_where(self, appended):
+    def append_where(self, appended, *params):
         self._sql += f'\n\t{self._conj:>6} {appended}'
         if self._conj == "WHERE": self._conj = "AND"
+        self._params.extend(params)
 
 
     def add_date(self, column, date_start, date_end, ignore_time=False):
@@ -31,35 +39,47 @@ class SqlBuffer:
         time_start = "" if ignore_time else "00:00:00"
         time_end = "" if ignore_time else "23:59:59"
         
-        self.append_where(f"{self._alias}{column} BETWEEN TO_TIMESTAMP('{date_start} {time_start}', 'yyyy-MM-dd HH:mm:ss', 'GMT+8') AND TO_TIMESTAMP('{date_end} {time_end}', 'yyyy-MM-dd HH:mm:ss', 'GMT+8')")
+        ph = self.placeholder
+        self.append_where(f"{self._alias}{column} BETWEEN TO_TIMESTAMP({ph}, 'yyyy-MM-dd HH:mm:ss', 'GMT+8') AND TO_TIMESTAMP({ph}, 'yyyy-MM-dd HH:mm:ss', 'GMT+8')",
+                          f"{date_start} {time_start}", f"{date_end} {time_end}")
 
         return self
 
 
     def add(self, column, value):
-        if value != "*": self.append_where(f"{self._alias}{column} = '{value}'")
+        if value != "*": self.append_where(f"{self._alias}{column} = {self.placeholder}", value)
+
+        return self
+
+
+    #與add相同，但'*'也視為一般的值，不會略過條件
+    def add_eq(self, column, value):
+        self.append_where(f"{self._alias}{column} = {self.placeholder}", value)
 
         return self
 
 
     def add_in(self, column, values):
         if values and len(values) > 0 and '*' not in values:
-            quoted = ','.join(f"'{v}'" for v in values)
-            self.append_where(f"{self._alias}{column} IN ({quoted})")
+            phs = ','.join(self.placeholder for _ in values)
+            self.append_where(f"{self._alias}{column} IN ({phs})", *values)
         
         return self
 
 
+    #sql可以是字串或另一個SqlBuffer(一併帶入它的參數)
     def add_in_sub(self, column, sql):
+        params = ()
+        if isinstance(sql, SqlBuffer): sql, params = sql.sql, sql.params
         sql = sql.replace("\n", "\n\t\t")
-        self.append_where(f"{self._alias}{column} IN ({sql}\n\t\t   )")
+        self.append_where(f"{self._alias}{column} IN ({sql}\n\t\t   )", *params)
 
         return self
 
 
     def add_like(self, column, value, add_percent=True):
         percent_sign = '%' if add_percent else ''
-        self.append_where(f"{self._alias}{column} LIKE '{value}{percent_sign}'")
+        self.append_where(f"{self._alias}{column} LIKE {self.placeholder}", f"{value}{percent_sign}")
         
         return self
 
@@ -71,7 +91,7 @@ class SqlBuffer:
 
 
     def add_between_str(self, column, start, end):
-        self.append_where(f"{self._alias}{column} BETWEEN '{start}' AND '{end}'")
+        self.append_where(f"{self._alias}{column} BETWEEN {self.placeholder} AND {self.placeholder}", start, end)
 
         return self
 
@@ -87,4 +107,15 @@ class SqlBuffer:
 
     @property
     def sql(self):
-        return self._sql
\ No newline at end of file
+        return self._sql
+
+
+    @property
+    def params(self):
+        return tuple(self._params)
+
+
+    #(sql, params)，方便 curs.execute(*buf.query)
+    @property
+    def query(self):
+        return (self._sql, self.params)
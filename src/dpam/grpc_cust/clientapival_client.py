@@ -1,4 +1,7 @@
 import grpc
+import json
+import os
+import threading
 import dpam.grpc_cust.clientapival_pb2 as clientapival_pb2
 import dpam.grpc_cust.clientapival_pb2_grpc as clientapival_pb2_grpc
 from dpam.tools.config_loader import ConfigLoader
@@ -14,12 +17,108 @@ clientapival_port = ConfigLoader.config("grpc")["clientapival"]["port"]
 SERVER_ADDRESS = "%s:%s" %(clientapival_server,clientapival_port)
 
 
-def clientinfo(stub,clientid):
+class ClientAPIValChannel:
+  """
+  Channels to SERVER_ADDRESS shared by all the calls of the process, created lazily on first use (and again after a
+  fork) instead of one channel and one HTTP/2 handshake per call.
+  The optional keys of the grpc.clientapival config:
+  - pool_size: number of channels, the calls are spread over them round robin (default 2)
+  - timeout_seconds: deadline of each call (default 5)
+  - keepalive_seconds: keepalive ping interval of an idle connection (default 30)
+  - max_attempts: attempts of a call failed with UNAVAILABLE, retried by the channel with backoff (default 3)
+  interceptors are applied to the channels created afterwards (ex: the timing interceptor of Metrics.instrument)
+  """
+  _config = None
+  _channels = None
+  _stubs = None
+  _next = 0
+  _pid = None
+  _lock = threading.Lock()
+  interceptors = []
+
+  default_config = {"pool_size": 2, "timeout_seconds": 5, "keepalive_seconds": 30, "max_attempts": 3}
+
+  @classmethod
+  def config(clz):
+    if clz._config is None:
+      config = dict(clz.default_config)
+      config.update({k: v for k, v in ConfigLoader.config("grpc")["clientapival"].items() if k in clz.default_config})
+      clz._config = config
+    return clz._config
+
+  @classmethod
+  def timeout(clz):
+    return float(clz.config()["timeout_seconds"])
+
+  @classmethod
+  def options(clz):
+    config = clz.config()
+    service_config = {
+      "loadBalancingConfig": [{"round_robin": {}}],
+      # 伺服器沒有實作grpc.health.v1時，gRPC會視為healthy
+      "healthCheckConfig": {"serviceName": ""},
+      "methodConfig": [{
+        "name": [{"service": "clientapival.ClientAPIVal"}],
+        "retryPolicy": {
+          "maxAttempts": int(config["max_attempts"]),
+          "initialBackoff": "0.1s",
+          "maxBackoff": "1s",
+          "backoffMultiplier": 2,
+          "retryableStatusCodes": ["UNAVAILABLE"],
+        },
+      }],
+    }
+    return [("grpc.keepalive_time_ms", int(config["keepalive_seconds"] * 1000)),
+            ("grpc.keepalive_timeout_ms", 10000),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+            ("grpc.enable_retries", 1),
+            ("grpc.service_config", json.dumps(service_config))]
+
+  @classmethod
+  def stub(clz):
+    if clz._stubs is None or clz._pid != os.getpid():
+      with clz._lock:
+        if clz._stubs is None or clz._pid != os.getpid():
+          # 父行程的channel不能在fork後使用，不關閉直接捨棄
+          size = max(1, int(clz.config()["pool_size"]))
+          clz._channels = [grpc.insecure_channel(SERVER_ADDRESS, options=clz.options()) for _ in range(size)]
+          clz._stubs = [clientapival_pb2_grpc.ClientAPIValStub(grpc.intercept_channel(channel, *clz.interceptors) if clz.interceptors else channel)
+                        for channel in clz._channels]
+          clz._pid = os.getpid()
+    with clz._lock:
+      clz._next = (clz._next + 1) % len(clz._stubs)
+      return clz._stubs[clz._next]
+
+  @classmethod
+  def check_health(clz, timeout=1):
+    """
+    True if every channel can connect to the server within timeout seconds
+    """
+    clz.stub()
+    try:
+      for channel in clz._channels: grpc.channel_ready_future(channel).result(timeout=timeout)
+      return True
+    except grpc.FutureTimeoutError:
+      Logger.log(f"gRPC server {SERVER_ADDRESS} is not ready in {timeout}s")
+      return False
+
+  @classmethod
+  def close(clz):
+    with clz._lock:
+      if clz._channels is not None and clz._pid == os.getpid():
+        for channel in clz._channels: channel.close()
+      clz._channels = None
+      clz._stubs = None
+      clz._config = None
+
+
+def clientinfo(stub,clientid,timeout=None):
   # print("------------------Enquiry Client Info Begin-----------------")
   request = clientapival_pb2.ClientId(clientid=clientid)
   # print("request clientid %s to server(%s)" %(request, SERVER_ADDRESS))
   Logger.log(f"Begin Enquiry Client Info from clientid {clientid}")
-  response = stub.clientinfo(request)
+  response = stub.clientinfo(request, timeout=timeout)
   # print("response from server(%s)" %SERVER_ADDRESS)
   # print("response info(%s)" %response)
   Logger.log(f"response {response} from server{SERVER_ADDRESS} End")
@@ -27,12 +126,12 @@ def clientinfo(stub,clientid):
   return response
 
 
-def clientapikey(stub,clientid, password):
+def clientapikey(stub,clientid, password,timeout=None):
   # print("------------------Enquiry Client Info Begin-----------------")
   Logger.log(f"Begin Request APIKey from clientid {clientid}")
   request = clientapival_pb2.ClientCred(clientid=clientid, password=password)
   # print("request client api key %s to server(%s)" %(request, SERVER_ADDRESS))
-  response = stub.clientapikey(request)
+  response = stub.clientapikey(request, timeout=timeout)
   # print("response from server(%s)" %SERVER_ADDRESS)
   # print("response info(%s)" %response)
   # print("-----------------Call  over ------------------")
@@ -40,12 +139,12 @@ def clientapikey(stub,clientid, password):
   return response
 
 
-def verifiedapikey(stub,token):
+def verifiedapikey(stub,token,timeout=None):
   #print("------------------Verify API Key Begin-----------------")
   request = clientapival_pb2.APIKey(apikey=token)
   # print("request verified client api key %s to server(%s)" %(request, SERVER_ADDRESS))
   Logger.log(f"Begin verified API Key by token {token}")
-  response = stub.verifiedapikey(request)
+  response = stub.verifiedapikey(request, timeout=timeout)
   # print("response from server(%s)" %SERVER_ADDRESS)
   # print("response info(%s)" %response)
   # print("-----------------Call  over ------------------")
@@ -53,23 +152,29 @@ def verifiedapikey(stub,token):
   return response
 
 
+def clientinfos(stub, clientids, timeout=None):
+  """
+  ClientInfo of each clientid in the same order, the unary calls are sent together and multiplexed on the channel
+  """
+  requests = [clientapival_pb2.ClientId(clientid=clientid) for clientid in clientids]
+  Logger.log(f"Begin Enquiry Client Info of {len(requests)} clientids")
+  futures = [stub.clientinfo.future(request, timeout=timeout) for request in requests]
+  responses = [future.result() for future in futures]
+  Logger.log(f"Response {len(responses)} client info from server {SERVER_ADDRESS} End")
+  return responses
+
+
 def get_clientinfo(clientid):
-  with grpc.insecure_channel(SERVER_ADDRESS) as channel:
-    stub = clientapival_pb2_grpc.ClientAPIValStub(channel)
+  return clientinfo(ClientAPIValChannel.stub(), clientid, ClientAPIValChannel.timeout())
 
-    return clientinfo(stub,clientid)
 
-  
 def get_clientapikey(clientid, password):
-  with grpc.insecure_channel(SERVER_ADDRESS) as channel:
-    stub = clientapival_pb2_grpc.ClientAPIValStub(channel)
+  return clientapikey(ClientAPIValChannel.stub(), clientid, password, ClientAPIValChannel.timeout())
 
-    return clientapikey(stub,clientid,password)
 
-  
 def get_verified_apikey(token):
-  with grpc.insecure_channel(SERVER_ADDRESS) as channel:
-    stub = clientapival_pb2_grpc.ClientAPIValStub(channel)
+  return verifiedapikey(ClientAPIValChannel.stub(), token, ClientAPIValChannel.timeout())
 
-    return verifiedapikey(stub,token)
 
+def get_clientinfos(clientids):
+  return clientinfos(ClientAPIValChannel.stub(), clientids, ClientAPIValChannel.timeout())
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: valclient_batch.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+import dpam.grpc_cust.valclient_pb2 as valclient__pb2
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x15valclient_batch.proto\x12\x0fvalclient_batch\x1a\x0fvalclient.proto2R\n\x0eValclientBatch\x12@\n\x11\x45laborDetailBatch\x12\x12.valclient.Request\x1a\x13.valclient.Response(\x01\x30\x01\x62\x06proto3')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'valclient_batch_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _VALCLIENTBATCH._serialized_start=59
+  _VALCLIENTBATCH._serialized_end=141
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,69 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+
+import dpam.grpc_cust.valclient_pb2 as valclient__pb2
+
+
+class ValclientBatchStub(object):
+    """ElaborDetailBatch is kept out of valclient.proto, dsbase registers that file with the single ElaborDetail rpc
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.ElaborDetailBatch = channel.stream_stream(
+                '/valclient_batch.ValclientBatch/ElaborDetailBatch',
+                request_serializer=valclient__pb2.Request.SerializeToString,
+                response_deserializer=valclient__pb2.Response.FromString,
+                )
+
+
+class ValclientBatchServicer(object):
+    """ElaborDetailBatch is kept out of valclient.proto, dsbase registers that file with the single ElaborDetail rpc
+    """
+
+    def ElaborDetailBatch(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_ValclientBatchServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'ElaborDetailBatch': grpc.stream_stream_rpc_method_handler(
+                    servicer.ElaborDetailBatch,
+                    request_deserializer=valclient__pb2.Request.FromString,
+                    response_serializer=valclient__pb2.Response.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'valclient_batch.ValclientBatch', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+
+
+ # This class is part of an EXPERIMENTAL API.
+class ValclientBatch(object):
+    """ElaborDetailBatch is kept out of valclient.proto, dsbase registers that file with the single ElaborDetail rpc
+    """
+
+    @staticmethod
+    def ElaborDetailBatch(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/valclient_batch.ValclientBatch/ElaborDetailBatch',
+            valclient__pb2.Request.SerializeToString,
+            valclient__pb2.Response.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
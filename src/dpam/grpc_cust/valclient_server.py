@@ -1,50 +1,90 @@
+import asyncio
+import sys
 from concurrent import futures
-from threading import Thread
-from urllib import response
-from tools.account import get_client_info
+from dpam.tools.account import get_client_info
 import grpc
-import grpc_cust.valclient_pb2 as valclient_pb2
-import grpc_cust.valclient_pb2_grpc as valclient_pb2_grpc
-from tools.config_loader import ConfigLoader
+import dpam.grpc_cust.valclient_pb2 as valclient_pb2
+import dpam.grpc_cust.valclient_pb2_grpc as valclient_pb2_grpc
+import dpam.grpc_cust.valclient_batch_pb2_grpc as valclient_batch_pb2_grpc
+from dpam.tools.config_loader import ConfigLoader
+from dpam.tools.account_cache import AccountCache
 
 
 __all__ = 'ValClient'
 
-valclient_server = ConfigLoader.config("grpc")["valclient"]["server"]
-valclient_port = ConfigLoader.config("grpc")["valclient"]["port"]
+valclient_config = ConfigLoader.config("grpc")["valclient"]
+valclient_server = valclient_config["server"]
+valclient_port = valclient_config["port"]
 
 SERVER_ADDRESS = "%s:%s" %(valclient_server,valclient_port)
 
-class ValClient(valclient_pb2_grpc.ValclientServicer):
+#選用的設定: mode "thread"(預設)或"aio"，max_concurrent_rpcs 同時處理的RPC上限，max_workers thread模式的worker數
+SERVER_MODE = valclient_config.get("mode", "thread")
+MAX_CONCURRENT_RPCS = valclient_config.get("max_concurrent_rpcs", 1000)
+MAX_WORKERS = valclient_config.get("max_workers", 16)
+
+
+def load_client_row(client_id):
+    """
+    The registered columns of a user client, None if it is not registered.
+    Read through AccountCache, a write of the client in db_access drops it by the pub/sub invalidation
+    """
+    def loader():
+        info = get_client_info(client_id)
+        if info["CLIENT_ID"] == {}: return {}
+        return {"PASSWORD": str(info["PASSWORD"][0]), "TYPE": info["TYPE"][0],
+                "EXPIRY": str(info["EXPIRY"][0]), "PERMISSION": str(info["PERMISSION"][0])}
+    row = AccountCache.get(client_id, 2, loader, kind="valclient")
+    return row if row else None
+
+
+def elabor_detail(client_id):
+    row = load_client_row(client_id)
+    if row is not None:
+        return valclient_pb2.Response(
+          client_id=client_id,
+          password = row["PASSWORD"],
+          type = row["TYPE"],
+          expiry = row["EXPIRY"],
+          permission = row["PERMISSION"]
+        )
+    return valclient_pb2.Response(
+      client_id=client_id,
+      password = "",
+      type = 0,
+      expiry = "1900-01-01",
+      permission = "None")
+
+
+class ValClient(valclient_pb2_grpc.ValclientServicer, valclient_batch_pb2_grpc.ValclientBatchServicer):
 
     def ElaborDetail(self, request, context):
-      print("ElaborDetail called by client(%s)" %(request.client_id))
-      info = get_client_info(request.client_id)
-      if(info["CLIENT_ID"]!={}):
-          print("client id %s has registered info" %(request.client_id))
-          response = valclient_pb2.Response(
-            client_id=request.client_id,
-            password = str(info["PASSWORD"][0]),
-            type = info["TYPE"][0],
-            expiry = str(info["EXPIRY"][0]),
-            permission = str(info["PERMISSION"][0])
-          )
-      else:
-          print("client id %s has NO registered info" %(request.client_id))
-          response = valclient_pb2.Response(
-            client_id=request.client_id,
-            password = "",
-            type = 0,
-            expiry = "1900-01-01",
-            permission = "None")
-
-      return response
+      return elabor_detail(request.client_id)
+
+    def ElaborDetailBatch(self, request_iterator, context):
+      for request in request_iterator:
+        yield elabor_detail(request.client_id)
+
+
+class AioValClient(valclient_pb2_grpc.ValclientServicer, valclient_batch_pb2_grpc.ValclientBatchServicer):
+    """
+    grpc.aio servicer, a lookup missing the cache reads the db in a worker thread so the event loop is never blocked
+    """
+
+    async def ElaborDetail(self, request, context):
+      return await asyncio.to_thread(elabor_detail, request.client_id)
+
+    async def ElaborDetailBatch(self, request_iterator, context):
+      async for request in request_iterator:
+        yield await asyncio.to_thread(elabor_detail, request.client_id)
 
 
 def main():
-    server = grpc.server(futures.ThreadPoolExecutor())
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=MAX_WORKERS), maximum_concurrent_rpcs=MAX_CONCURRENT_RPCS)
 
-    valclient_pb2_grpc.add_ValclientServicer_to_server(ValClient(),server)
+    servicer = ValClient()
+    valclient_pb2_grpc.add_ValclientServicer_to_server(servicer,server)
+    valclient_batch_pb2_grpc.add_ValclientBatchServicer_to_server(servicer,server)
 
     server.add_insecure_port(SERVER_ADDRESS)
     print("---------------Start Python Client Auth Server----------------------------------")
@@ -52,5 +92,19 @@ def main():
     server.wait_for_termination()
 
 
+async def main_aio():
+    server = grpc.aio.server(maximum_concurrent_rpcs=MAX_CONCURRENT_RPCS)
+
+    servicer = AioValClient()
+    valclient_pb2_grpc.add_ValclientServicer_to_server(servicer,server)
+    valclient_batch_pb2_grpc.add_ValclientBatchServicer_to_server(servicer,server)
+
+    server.add_insecure_port(SERVER_ADDRESS)
+    print("---------------Start Python Client Auth Server (aio)----------------------------")
+    await server.start()
+    await server.wait_for_termination()
+
+
 if __name__ == '__main__':
-  main()
\ No newline at end of file
+  if SERVER_MODE == "aio" or "--aio" in sys.argv: asyncio.run(main_aio())
+  else: main()
@@ -1,13 +1,18 @@
 from dpam.dbtools.db_connection import DbConnection
+from contextlib import contextmanager
 import dpam.tools.crypto as crypto
 import pandas as pd
 import re
 from dpam.dbtools.sql_buffer import SqlBuffer
+from dpam.dbtools.row_access import fetch_columns
 from dsbase.tools.redis_db import RedisDb
 from dpam.tools.logger import Logger, LogLevel
 from datetime import datetime
 from dpam.grpc_cust import clientapival_client as grpc_client
 from dpam.db_access import insert_account, delete_account, update_account_registry
+from dpam.tools.account_cache import AccountCache
+from dpam.tools.resource_index import ResourceIndex
+from dpam.tools.token_cache import TokenCache
 
 def get_client_info(client_id,type=2):
     sql = '''
@@ -15,10 +20,7 @@ def get_client_info(client_id,type=2):
       FROM ACCOUNT'''
     buf = SqlBuffer(sql).add("CLIENT_ID", client_id)
     buf.add("TYPE", type)
-    cn = DbConnection.default()
-    df = pd.read_sql_query(buf.sql, cn)
-
-    info = df.to_dict()
+    info = fetch_columns(buf)
     
     return info
 
@@ -27,10 +29,8 @@ def get_clients_info(client_ids:list, type=2):
     SELECT CLIENT_ID, PASSWORD, TYPE, EXPIRY, REGISTRY,PERMISSION,OWNER_USER_ID 
       FROM ACCOUNT'''
     buf = SqlBuffer(sql).add_in("CLIENT_ID", client_ids)
-    buf = SqlBuffer(sql).add("TYPE", type)
-    cn = DbConnection.default()
-    df = pd.read_sql_query(buf.sql, cn)
-    info = df.to_dict()
+    buf.add("TYPE", type)
+    info = fetch_columns(buf)
     return info
 
 def get_client_info_grpc(client_id):
@@ -39,6 +39,12 @@ def get_client_info_grpc(client_id):
     
     return info
 
+def get_clients_info_grpc(client_ids:list):
+    
+    infos = grpc_client.get_clientinfos(client_ids)
+    
+    return infos
+
 def get_client_apikey_grpc(client_id,password):
     
     apikey = grpc_client.get_clientapikey(client_id, password)
@@ -86,6 +92,7 @@ def check_client_id_password(client_id, password,rpsw=True):
         token = crypto.get_account_token(client_id)
         redis = RedisDb.default()
         redis.set(token, f"{client_id}:{permission}:{registry}", expiry_hours=24)
+        TokenCache.invalidate(token)
         client_api_key = {"clientid":client_id,"apikey":token,"expiry":24}
         Logger.log(f'{client_id} requestes apikey genereated and cahced at {redis._host}:{redis._port}')
         return client_api_key
@@ -93,19 +100,10 @@ def check_client_id_password(client_id, password,rpsw=True):
     return None
 
 def check_and_log(token=None):
-
-    if token is not None:
-        redis = RedisDb.default()
-        client_info = redis.get(token)
-    if client_info is not None:
-        client_id = client_info.split(":")[0]
-        permission = client_info.split(":")[1]
-        registry = client_info.split(":")[2]
-        if permission:
-            permission_list = permission.split("|")
-            if "QUERY" in permission_list:
-                Logger.log(f'Issue request: @{client_id} {token} {registry}')
-                return client_info
+    record = TokenCache.get(token)
+    if record is not None and record.can_query():
+        Logger.log(f'Issue request: @{record.client_id} {token} {record.registry}')
+        return record.client_info
 
     Logger.log(f'Deny request: {token}')
     return False
@@ -181,18 +179,19 @@ class Account():
     base_resources_id = [res['CLIENT_ID'] for res in base_resources]
     
     @classmethod
-    def cur_switch(cls, cur):
-        """cur 'On' -> Create a connection
-                 None -> commit and close
-        """    
-        if cur:
-            cls.cn = DbConnection.default()
-            cls.cur = cls.cn.cursor()
-        else: 
-            cls.cur.close()
-            cls.cn.commit()
-            cls.cn.close()
-    
+    @contextmanager
+    def cursor(cls):
+        """with cls.cursor() as cur: ... commits (rollback on error), returns the connection to the pool
+           and drops the cached accounts
+        """
+        with DbConnection.connect() as cn:
+            cur = cn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+        AccountCache.invalidate() # DDL / legacy data moved through the raw cursor
+
     @classmethod
     def _convert_account_table(cls,temp_table_ = "account_old",move_legacy_data=True):
         cls.drop_table_if_exists(temp_table_)
@@ -203,52 +202,48 @@ class Account():
     @classmethod
     def alter_table_name(cls, ntable):
         new_table_name = ntable
-        cls.cur_switch('On')
-        cls.cur.execute(f"ALTER TABLE account RENAME TO {new_table_name}")
-        cls.cur_switch(None)
+        with cls.cursor() as cur:
+            cur.execute(f"ALTER TABLE account RENAME TO {new_table_name}")
             
     @classmethod
     def create_table(cls):  
-        cls.cur_switch('On')  
-        cls.cur.execute("""
-                    CREATE TABLE account (
-                        CLIENT_ID TEXT,
-                        PASSWORD TEXT,
-                        TYPE INTEGER,
-                        EXPIRY TEXT,
-                        PERMISSION TEXT,
-                        OBSOLETE INTEGER,
-                        OWNER_USER_ID TEXT,
-                        CREATE_DTTM TEXT,
-                        REGISTRY VARCHAR,
-                        BIND_ROLE TEXT,
-                        BIND_GROUP TEXT,
-                        PRIMARY KEY (CLIENT_ID, OWNER_USER_ID, TYPE));
-                    """)
-        cls.cur_switch(None)
+        with cls.cursor() as cur:
+            cur.execute("""
+                        CREATE TABLE account (
+                            CLIENT_ID TEXT,
+                            PASSWORD TEXT,
+                            TYPE INTEGER,
+                            EXPIRY TEXT,
+                            PERMISSION TEXT,
+                            OBSOLETE INTEGER,
+                            OWNER_USER_ID TEXT,
+                            CREATE_DTTM TEXT,
+                            REGISTRY VARCHAR,
+                            BIND_ROLE TEXT,
+                            BIND_GROUP TEXT,
+                            PRIMARY KEY (CLIENT_ID, OWNER_USER_ID, TYPE));
+                        """)
         
     @classmethod
     def drop_table_if_exists(cls, tablename):
-        cls.cur_switch('On')
-        cls.cur.execute(
-            f"""DROP TABLE IF EXISTS {tablename}"""
-        )
-        cls.cur_switch(None)
+        with cls.cursor() as cur:
+            cur.execute(
+                f"""DROP TABLE IF EXISTS {tablename}"""
+            )
         
     @classmethod    
     def insert_legacy_data(cls, legacy_table='account_old', exclude_system_owner_data=True):
-        cls.cur_switch('On') 
-        if exclude_system_owner_data: OWNER_CRITERION = "system"
-        else:  OWNER_CRITERION = "TBD"
-        cls.cur.execute(f"""
-                    INSERT INTO account (CLIENT_ID, OWNER_USER_ID, TYPE, 
-                    PASSWORD, EXPIRY, PERMISSION, OBSOLETE, CREATE_DTTM,
-                    REGISTRY, BIND_ROLE, BIND_GROUP) SELECT CLIENT_ID, 
-                    OWNER_USER_ID, TYPE, PASSWORD, EXPIRY, PERMISSION,
-                    OBSOLETE, CREATE_DTTM, REGISTRY, BIND_ROLE, BIND_GROUP
-                    from {legacy_table} where OWNER_USER_ID <> "{OWNER_CRITERION}";
-                    """)
-        cls.cur_switch(None)
+        with cls.cursor() as cur:
+            if exclude_system_owner_data: OWNER_CRITERION = "system"
+            else:  OWNER_CRITERION = "TBD"
+            cur.execute(f"""
+                        INSERT INTO account (CLIENT_ID, OWNER_USER_ID, TYPE, 
+                        PASSWORD, EXPIRY, PERMISSION, OBSOLETE, CREATE_DTTM,
+                        REGISTRY, BIND_ROLE, BIND_GROUP) SELECT CLIENT_ID, 
+                        OWNER_USER_ID, TYPE, PASSWORD, EXPIRY, PERMISSION,
+                        OBSOLETE, CREATE_DTTM, REGISTRY, BIND_ROLE, BIND_GROUP
+                        from {legacy_table} where OWNER_USER_ID <> ?;
+                        """, (OWNER_CRITERION,))
     
     @classmethod
     def _create_if_not_exist(cls, client_id, registry, type=1, user_id="system", bind_group=None, bind_role=None):
@@ -343,8 +338,8 @@ class Account():
         SELECT CLIENT_ID, TYPE, EXPIRY, REGISTRY,PERMISSION 
         FROM ACCOUNT'''
         buf = SqlBuffer(sql).add("TYPE", type)
-        cn = DbConnection.default()
-        df = pd.read_sql_query(buf.sql, cn)
+        with DbConnection.connect() as cn:
+            df = pd.read_sql_query(buf.sql, cn, params=buf.params)
         info = df.to_dict()
         cls.rcs = info
         return info
@@ -373,9 +368,7 @@ class Account():
         FROM ACCOUNT'''
         buf = SqlBuffer(sql).add("TYPE", type)
         buf.add("CLIENT_ID",clientid)
-        cn = DbConnection.default()
-        df = pd.read_sql_query(buf.sql, cn)
-        info = df.to_dict()
+        info = fetch_columns(buf)
         cls.rcs = info
         return info
     
@@ -406,9 +399,7 @@ class Account():
         FROM ACCOUNT'''
         buf = SqlBuffer(sql).add("CLIENT_ID", clientId)
         buf.add("TYPE", type)
-        cn = DbConnection.default()
-        df = pd.read_sql_query(buf.sql, cn)
-        info = df.to_dict()
+        info = fetch_columns(buf)
         cls.rcs = info
         return info
     
@@ -465,20 +456,9 @@ class Account():
         """
         If return value is None, there is not the best matched res
         If return value is a tuple with two elements , the firt element is the res and the 2nd element is the reg value
+        The resource clients are looked up in the ResourceIndex trie instead of reading the whole table each time
         """   
-        res_info = Account._get_resource_clients_all_info()
-        candidates = [p for _, p in res_info['CLIENT_ID'].items()]
-                
-        best_match = None
-                
-        best_match_client = cls.__search_best_match(_res, candidates)
-        
-        if best_match_client:
-            _match_ix = next((ix for ix, res_client in res_info['CLIENT_ID'].items() if res_client == best_match_client ), None)
-            if _match_ix: best_match = (best_match_client, res_info['REGISTRY'][_match_ix])
-            else: best_match = (best_match_client,None)          
-                 
-        return best_match
+        return ResourceIndex.best_match(_res)
 
     @classmethod
     def __search_best_match(cls, _res:str, candidates:list):
@@ -521,18 +501,33 @@ class Account():
        
     def set_client_registry(self):
         """
-        set basic related info according to given client
+        set basic related info according to given client.
+        The resolved info is shared through AccountCache, it is rebuilt by _load_client_registry only on a cache miss
         """
-        clientinfo = self._get_client_info()
-        self.clientinfo = clientinfo
-        if clientinfo["status"]:
-            self._registry = clientinfo["clientinfo"]['REGISTRY'][self.client_index]
-            self._bindGrp = clientinfo["clientinfo"]['BIND_GROUP'][self.client_index]
-            self._bindRole = clientinfo["clientinfo"]['BIND_ROLE'][self.client_index]
-            if self._bindGrp != 'None': self._add_group_registry()
-            if self._bindRole != 'None': self._add_role_registry()
-            self._merge_registry() # generate self.registry
+        record = AccountCache.get(self.clientid, self.type, self._load_client_registry)
+        self.clientinfo = record["clientinfo"]
+        if self.clientinfo["status"]:
+            self.client_index = 0
+            self._registry = record["_registry"]
+            self._bindGrp = record["_bindGrp"]
+            self._bindRole = record["_bindRole"]
+            self.registry = list(record["registry"])
         else: return {"status":False,"message": f"Given client {self.clientid} with {self.type} has not the client info"}
+
+    def _load_client_registry(self):
+        """
+        resolve the client info and merge the registry of the bind group and role, return a snapshot for AccountCache
+        """
+        clientinfo = self._get_client_info()
+        if not clientinfo["status"]: return {"clientinfo": clientinfo}
+        self._registry = clientinfo["clientinfo"]['REGISTRY'][self.client_index]
+        self._bindGrp = clientinfo["clientinfo"]['BIND_GROUP'][self.client_index]
+        self._bindRole = clientinfo["clientinfo"]['BIND_ROLE'][self.client_index]
+        if self._bindGrp != 'None': self._add_group_registry()
+        if self._bindRole != 'None': self._add_role_registry()
+        self._merge_registry() # generate self.registry
+        return {"clientinfo": clientinfo, "_registry": self._registry, "_bindGrp": self._bindGrp,
+                "_bindRole": self._bindRole, "registry": list(self.registry)}
     
     def auto_correct_none_resource_client_registry_value(self,log=None):
         """
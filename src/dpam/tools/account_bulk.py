@@ -0,0 +1,219 @@
+import csv
+import io
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from itertools import islice
+from dpam.dbtools.db_connection import DbConnection
+from dpam.dbtools.sql_buffer import SqlBuffer
+from dpam.tools.account_cache import AccountCache
+import dpam.tools.crypto as crypto
+
+#匯出/匯入的欄位，PASSWORD不匯出，匯入時可給明碼PASSWORD
+COLUMNS = ["CLIENT_ID", "TYPE", "EXPIRY", "PERMISSION", "OBSOLETE", "OWNER_USER_ID", "REGISTRY", "BIND_GROUP", "BIND_ROLE"]
+PERMISSIONS = {"QUERY", "DEBUG", "ADMIN"}
+
+
+class BulkRowError(ValueError):
+    pass
+
+
+#region export
+def export_accounts(user_id=None, types=None, chunk_size=1000):
+    """
+    Generator of the account rows (dict of COLUMNS), read by fetchmany in chunks of chunk_size
+    user_id: only the accounts owned by the user, types: only the given account types
+    """
+    buf = SqlBuffer(f"SELECT {', '.join(COLUMNS)} FROM ACCOUNT")
+    if user_id is not None: buf.add_eq("OWNER_USER_ID", user_id)
+    if types: buf.add_in("TYPE", list(types))
+    buf.append_sql("ORDER BY TYPE, CLIENT_ID")
+
+    with DbConnection.connect() as cn:
+        curs = cn.execute(buf.sql, buf.params)
+        while True:
+            rows = curs.fetchmany(chunk_size)
+            if len(rows) == 0: break
+            for row in rows: yield dict(zip(COLUMNS, row))
+        curs.close()
+
+
+def to_ndjson(rows):
+    for row in rows: yield json.dumps(row) + "\n"
+
+
+def to_csv(rows, chunk_size=1000):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    for ix, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if ix % chunk_size == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+#endregion
+
+
+#region import
+def parse_ndjson(lines):
+    """
+    Generator of (line number, row dict or BulkRowError) from NDJSON text lines, blank lines are skipped
+    """
+    for line_no, line in enumerate(lines, 1):
+        if isinstance(line, bytes): line = line.decode("utf-8")
+        if line.strip() == "": continue
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict): raise BulkRowError("Row is not a JSON object")
+            yield line_no, row
+        except ValueError as err:
+            yield line_no, err if isinstance(err, BulkRowError) else BulkRowError(f"Invalid JSON: {err}")
+
+
+def parse_csv(lines):
+    """
+    Generator of (line number, row dict) from CSV text lines with a header line
+    """
+    reader = csv.DictReader(line.decode("utf-8") if isinstance(line, bytes) else line for line in lines)
+    for row in reader:
+        yield reader.line_num, {key.strip(): value for key, value in row.items() if key is not None}
+
+
+def validate_row(row, user_id):
+    """
+    Normalized (CLIENT_ID, TYPE, ...) values of a row to be written, raise BulkRowError when it is not valid
+    """
+    client_id = str(row.get("CLIENT_ID") or "").strip()
+    if client_id == "": raise BulkRowError("CLIENT_ID cannot be blank")
+    try:
+        type = int(row.get("TYPE") or 2)
+    except (TypeError, ValueError):
+        raise BulkRowError(f"TYPE {row.get('TYPE')} is not an integer")
+    if type not in (1, 2, 3, 4): raise BulkRowError(f"TYPE {type} is not one of 1, 2, 3, 4")
+
+    expiry = row.get("EXPIRY") or (datetime.today() + timedelta(365.25*10)).strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(str(expiry)[:10], "%Y-%m-%d")
+    except ValueError:
+        raise BulkRowError(f"EXPIRY {expiry} is not yyyy-mm-dd")
+
+    permission = _text(row, "PERMISSION") or "QUERY"
+    unknown = set(permission.split("|")) - PERMISSIONS
+    if unknown: raise BulkRowError(f"PERMISSION {','.join(sorted(unknown))} is not one of {'|'.join(sorted(PERMISSIONS))}")
+
+    obsolete = row.get("OBSOLETE") or 0
+    if str(obsolete).lower() in ("0", "1", "true", "false"): obsolete = 1 if str(obsolete).lower() in ("1", "true") else 0
+    else: raise BulkRowError(f"OBSOLETE {obsolete} is not 0 or 1")
+
+    return {"CLIENT_ID": client_id, "TYPE": type, "EXPIRY": str(expiry), "PERMISSION": permission, "OBSOLETE": obsolete,
+            "OWNER_USER_ID": _text(row, "OWNER_USER_ID") or user_id, "REGISTRY": _text(row, "REGISTRY") or "",
+            "BIND_GROUP": str(row.get("BIND_GROUP") or None), "BIND_ROLE": str(row.get("BIND_ROLE") or None),
+            "PASSWORD": crypto.crypto_password(type, _text(row, "PASSWORD") or "")}
+
+
+def _text(row, column):
+    """
+    String value of a column, numbers are converted (a JSON PASSWORD 1234), other JSON types raise BulkRowError
+    """
+    value = row.get(column)
+    if value is None or isinstance(value, str): return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool): return str(value)
+    raise BulkRowError(f"{column} must be a string")
+
+
+def import_accounts(parsed_rows, user_id, upsert=False, chunk_size=500):
+    """
+    Write the (line number, row) of parse_ndjson/parse_csv in chunks, each chunk is validated together and written by
+    executemany in one transaction. A bad row is reported in "errors" and the rest of the batch is still written.
+    upsert=False: an existing (CLIENT_ID, TYPE) is an error, upsert=True: it is updated (PASSWORD only if given)
+    """
+    result = {"total": 0, "inserted": 0, "updated": 0, "errors": []}
+    seen = set()
+    parsed_rows = iter(parsed_rows)
+    while True:
+        chunk = list(islice(parsed_rows, chunk_size))
+        if len(chunk) == 0: break
+        result["total"] += len(chunk)
+        _import_chunk(chunk, user_id, upsert, seen, result)
+
+    if result["inserted"] + result["updated"] > 0: AccountCache.invalidate()
+    return result
+
+
+def _import_chunk(chunk, user_id, upsert, seen, result):
+    valid = []
+    for line_no, row in chunk:
+        try:
+            if isinstance(row, Exception): raise row
+            values = validate_row(row, user_id)
+            key = (values["CLIENT_ID"], values["TYPE"])
+            if key in seen: raise BulkRowError(f"CLIENT_ID {key[0]} with TYPE {key[1]} is duplicated in the batch")
+            seen.add(key)
+            values["_has_password"] = bool(row.get("PASSWORD"))
+            valid.append((line_no, values))
+        except BulkRowError as err:
+            result["errors"].append({"line": line_no, "client_id": _client_id_of(row), "error": str(err)})
+        except Exception as err:
+            #非預期的錯誤只算該行失敗，不中斷整批匯入
+            result["errors"].append({"line": line_no, "client_id": _client_id_of(row), "error": f"Invalid row: {err}"})
+    if len(valid) == 0: return
+
+    #同一個chunk已存在的client一次查出來
+    buf = SqlBuffer("SELECT CLIENT_ID, TYPE FROM ACCOUNT").add_in("CLIENT_ID", list({v["CLIENT_ID"] for _, v in valid}))
+    dttm = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+    with DbConnection.connect() as cn:
+        existing = set(cn.execute(buf.sql, buf.params).fetchall())
+        #inserts及updates在同一個transaction，savepoint才不會各自commit
+        if not cn.in_transaction: cn.execute("BEGIN")
+        inserts, updates = [], []
+        for line_no, values in valid:
+            if (values["CLIENT_ID"], values["TYPE"]) not in existing: inserts.append((line_no, values))
+            elif upsert: updates.append((line_no, values))
+            else: result["errors"].append({"line": line_no, "client_id": values["CLIENT_ID"],
+                                           "error": f"CLIENT_ID {values['CLIENT_ID']} with TYPE {values['TYPE']} already exists"})
+
+        insert_sql = '''
+            INSERT INTO ACCOUNT (CLIENT_ID, PASSWORD, TYPE, EXPIRY, PERMISSION, OWNER_USER_ID, OBSOLETE, CREATE_DTTM, REGISTRY, BIND_GROUP, BIND_ROLE)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+        insert_params = lambda v: (v["CLIENT_ID"], v["PASSWORD"], v["TYPE"], v["EXPIRY"], v["PERMISSION"], v["OWNER_USER_ID"],
+                                   v["OBSOLETE"], dttm, v["REGISTRY"], v["BIND_GROUP"], v["BIND_ROLE"])
+        update_sql = '''
+            UPDATE ACCOUNT SET PASSWORD = CASE WHEN ? THEN ? ELSE PASSWORD END, EXPIRY = ?, PERMISSION = ?, OBSOLETE = ?,
+                REGISTRY = ?, BIND_GROUP = ?, BIND_ROLE = ?
+            WHERE CLIENT_ID = ? AND TYPE = ?'''
+        update_params = lambda v: (1 if v["_has_password"] else 0, v["PASSWORD"], v["EXPIRY"], v["PERMISSION"], v["OBSOLETE"],
+                                   v["REGISTRY"], v["BIND_GROUP"], v["BIND_ROLE"], v["CLIENT_ID"], v["TYPE"])
+
+        result["inserted"] += _execute_many(cn, insert_sql, inserts, insert_params, result)
+        result["updated"] += _execute_many(cn, update_sql, updates, update_params, result)
+
+
+def _execute_many(cn, sql, rows, to_params, result):
+    """
+    executemany in a savepoint, if it fails the rows are written one by one so only the failing rows are reported
+    """
+    if len(rows) == 0: return 0
+    cn.execute("SAVEPOINT bulk_rows")
+    try:
+        cn.executemany(sql, [to_params(values) for _, values in rows])
+        cn.execute("RELEASE SAVEPOINT bulk_rows")
+        return len(rows)
+    except sqlite3.Error:
+        cn.execute("ROLLBACK TO SAVEPOINT bulk_rows")
+        cn.execute("RELEASE SAVEPOINT bulk_rows")
+
+    written = 0
+    for line_no, values in rows:
+        try:
+            cn.execute(sql, to_params(values))
+            written += 1
+        except sqlite3.Error as err:
+            result["errors"].append({"line": line_no, "client_id": values["CLIENT_ID"], "error": str(err)})
+    return written
+
+
+def _client_id_of(row):
+    return row.get("CLIENT_ID") if isinstance(row, dict) else None
+#endregion
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+from dsbase.tools.redis_db import RedisDb
+from dpam.tools.config_loader import ConfigLoader
+from dpam.tools.logger import Logger
+from dpam.tools.resource_index import ResourceIndex
+from dpam.tools.ttl_cache import TTLCache
+
+
+class AccountCache:
+    """
+    Read-through cache of resolved accounts (client info plus the registry merged from the bind groups and roles),
+    keyed by (client_id, type).
+    Every write in db_access calls invalidate(), which drops the local entries and publishes the change on a redis
+    pub/sub channel. Each gunicorn worker subscribes to the channel, so all workers drop stale entries right away
+    instead of waiting for the ttl.
+    The optional "account_cache" config has: ttl_seconds, max_entries, channel, enabled
+    """
+    _config = None
+    _cache = None
+    _redis = None
+    _pubsub_thread = None
+    _pid = None
+    _lock = threading.Lock()
+
+    default_config = {"ttl_seconds": 60, "max_entries": 10000, "channel": "account_cache_invalidate", "enabled": True}
+
+    @classmethod
+    def check_cache_config(clz):
+        if clz._config is None:
+            config = dict(clz.default_config)
+            try:
+                config.update(ConfigLoader.config("account_cache"))
+            except KeyError:
+                pass
+            clz._config = config
+            clz._cache = TTLCache(maxsize=int(config["max_entries"]), ttl=float(config["ttl_seconds"]))
+
+    @classmethod
+    def reset_cache_config(clz):
+        clz._config = None
+        clz._cache = None
+
+    @classmethod
+    def get(clz, client_id, type, loader, kind="account"):
+        """
+        Return the cached record of (client_id, type), loader() is called to build it on a miss.
+        kind separates records of different shapes built for the same client (the resolved Account, the raw row, ...)
+        """
+        clz.check_cache_config()
+        if not clz._config["enabled"]: return loader()
+        clz._ensure_listener()
+
+        key = (kind, client_id, int(type))
+        record = clz._cache.get(key)
+        if record is None:
+            record = loader()
+            if record is not None: clz._cache.set(key, record)
+        return record
+
+    @classmethod
+    def invalidate(clz, client_id=None, type=None):
+        """
+        Drop the cached records affected by a change of (client_id, type) in this worker and tell the other workers.
+        client_id None drops everything.
+        """
+        clz.drop(client_id, type)
+        clz._publish({"client_id": client_id, "type": type})
+
+    @classmethod
+    def drop(clz, client_id=None, type=None):
+        """
+        Local only. A user (type 2) change affects only its own record, a resource, group or role change may be merged
+        into any user's registry, so it drops everything. A resource change is also applied to the ResourceIndex.
+        """
+        clz.check_cache_config()
+        if client_id is None: ResourceIndex.reset()
+        elif type is None or int(type) == 1: ResourceIndex.refresh(client_id)
+        if client_id is None or type is None or int(type) != 2:
+            clz._cache.clear()
+        else:
+            clz._cache.pop_matching(lambda key: key[1] == client_id and key[2] == 2)
+
+    @classmethod
+    def stats(clz):
+        clz.check_cache_config()
+        return clz._cache.stats()
+
+    @classmethod
+    def _publish(clz, change):
+        try:
+            redis = clz._get_redis()
+            if redis is not None: redis.redis.publish(clz._config["channel"], json.dumps(change))
+        except Exception as err:
+            # the db write has succeeded, other workers fall back to the ttl
+            Logger.log(f'Account cache invalidation publish failed: {err}')
+
+    @classmethod
+    def _on_message(clz, message):
+        try:
+            change = json.loads(message["data"])
+            clz.drop(change.get("client_id"), change.get("type"))
+        except Exception as err:
+            Logger.log(f'Account cache invalidation message {message} ignored: {err}')
+
+    @classmethod
+    def _get_redis(clz):
+        if clz._redis is None or clz._pid != os.getpid():
+            clz._redis = RedisDb.default()
+            clz._pid = os.getpid()
+            clz._pubsub_thread = None
+        return clz._redis
+
+    @classmethod
+    def _ensure_listener(clz):
+        """
+        Subscribe once per process (after the gunicorn fork), the listener runs in a daemon thread
+        """
+        if clz._pubsub_thread is not None and clz._pid == os.getpid(): return
+        with clz._lock:
+            if clz._pubsub_thread is not None and clz._pid == os.getpid(): return
+            try:
+                redis = clz._get_redis()
+                pubsub = redis.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{clz._config["channel"]: clz._on_message})
+                clz._pubsub_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            except Exception as err:
+                # without the listener the entries still expire by ttl
+                clz._pubsub_thread = False
+                clz._pid = os.getpid()
+                Logger.log(f'Account cache invalidation listener is not started: {err}')
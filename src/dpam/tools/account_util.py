@@ -1,6 +1,7 @@
 from dpam.tools.account import Account
 from dpam.db_access import update_account_registry, delete_account
 from dpam.tools.logger import Logger, LogLevel
+from dpam.tools.registry_validator import RegistryValidator
 from datetime import datetime
 
 def set_log(_key=""):
@@ -53,25 +54,23 @@ def create_system_objects(log=Logger):
     Account._create_typical_user()
     log.log("Create typical user")
 
-def validate_resource_clients(log=Logger):
-    resources = Account._get_resource_clients_all_info()
-    for idx, cid in resources['CLIENT_ID'].items():
-       val_auto_correct_client(log,cid,1)
+def validate_resource_clients(log=Logger, dry_run=False):
+    return RegistryValidator(log=log).run(types=(1,), dry_run=dry_run)
        
-def validate_group_clients(log=Logger):
-    groups = Account._get_group_clients_all_info()
-    for idx, cid in groups['CLIENT_ID'].items():
-        val_auto_correct_client(log, cid, 3)
+def validate_group_clients(log=Logger, dry_run=False):
+    return RegistryValidator(log=log).run(types=(3,), dry_run=dry_run)
 
-def validate_role_clients(log=Logger):
-    roles = Account._get_role_clients_all_info()
-    for idx, cid in roles['CLIENT_ID'].items():
-        val_auto_correct_client(log, cid, type=4)
+def validate_role_clients(log=Logger, dry_run=False):
+    return RegistryValidator(log=log).run(types=(4,), dry_run=dry_run)
 
-def validate_user_clients(log=Logger):
-    users = Account._get_user_clients_all_info()
-    for idx, cid in users['CLIENT_ID'].items():
-        val_auto_correct_client(log, cid, type=2)
+def validate_user_clients(log=Logger, dry_run=False):
+    return RegistryValidator(log=log).run(types=(2,), dry_run=dry_run)
+
+def validate_all_clients(log=Logger, dry_run=False):
+    """
+    groups, roles, users and then resources validated in one scan and written in one transaction
+    """
+    return RegistryValidator(log=log).run(types=(3, 4, 2, 1), dry_run=dry_run)
  
 def validate_base_groups(log=Logger):
     # Validate registry value of base group and role
@@ -140,10 +139,7 @@ def tranform_legacy_table():
     validate_base_groups()
     validate_base_roles()
     validate_typical_users()
-    validate_resource_clients()
-    validate_group_clients()
-    validate_role_clients()
-    validate_user_clients()
+    validate_all_clients()
 
     test_find_best_match_res()
     
@@ -1,6 +1,11 @@
 import os
+import atexit
 import datetime as dt
+import json
 import logging
+import logging.handlers
+import queue
+import threading
 import enum
 from dpam.tools.config_loader import ConfigLoader
 
@@ -15,10 +20,39 @@ class LogLevel(enum.IntEnum):
     NOTSET = 0
 
 
+class JsonLineFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message (and the exception if any)
+    """
+
+    def format(self, record):
+        line = {"time": self.formatTime(record, self.datefmt), "level": record.levelname,
+                "logger": record.name, "message": record.getMessage()}
+        if record.exc_info: line["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False)
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    #同一個process內的queue，record不需要先格式化(pickle)，留給listener thread格式化
+    def prepare(self, record):
+        return record
+
+
 class Logger:
+    """
+    Daily log files named {keyname}_{yyyy-mm-dd}_{level}.log under folder_path.
+    Records are put on a queue by a QueueHandler and written by a QueueListener thread, so a request only pays for
+    the enqueue. The logger of the day is cached, it is rebuilt when the day, the keyname or the process changes.
+    The "log" config has: folder_path, level and the optional
+    async (default true), json (json lines, default false), max_bytes (size rotation, 0 = off), backup_count
+    """
     _level = LogLevel.NOTSET
     _folder_path = ["logs"]
     _keyname = "apiaccount"
+    default_options = {"async": True, "json": False, "max_bytes": 0, "backup_count": 5}
+    _options = dict(default_options)
+    _current = {}       # level -> (key, pid, logger, listener)
+    _lock = threading.Lock()
 
     #取得預設的logger instance
     @classmethod
@@ -34,11 +68,13 @@ class Logger:
             log_config = ConfigLoader.config("log")
             clz._folder_path = log_config["folder_path"]
             clz._level = LogLevel[log_config["level"]]
+            clz._options = {option: log_config.get(option, value) for option, value in clz.default_options.items()}
 
     @classmethod
     def reset_log_config(clz):
         clz._level = LogLevel.NOTSET
         clz._folder_path = "ext"
+        clz.shutdown()
 
 
     #產生logger instance
@@ -46,25 +82,88 @@ class Logger:
     def logger(clz, level, keyname=None):
         clz.check_log_config()
 
-        today = dt.datetime.today()
-        key = f'{clz._keyname}_{today:%Y-%m-%d}_{level.name}'
-        logger = logging.getLogger(key)
-        if len(logger.handlers)==0:
+        key = f'{keyname or clz._keyname}_{dt.date.today():%Y-%m-%d}_{level.name}'
+        current = clz._current.get(level)
+        if current is not None and current[0] == key and current[1] == os.getpid(): return current[2]
+
+        with clz._lock:
+            current = clz._current.get(level)
+            if current is not None and current[0] == key and current[1] == os.getpid(): return current[2]
+            #換日或換keyname時，停止前一個logger的listener並關閉檔案
+            if current is not None: clz._close(current)
+
+            logger = logging.getLogger(key)
             logger.setLevel(level.value)
+            logger.propagate = False
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
 
             filename = os.path.join(*clz._folder_path, f'{key}.log')
             clz._filename = filename
-            handler = logging.FileHandler(filename)
-        
+            handler = clz._file_handler(filename)
+            listener = None
+            if clz._options["async"]:
+                records = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(records, handler, respect_handler_level=False)
+                listener.start()
+                logger.addHandler(_LocalQueueHandler(records))
+            else:
+                logger.addHandler(handler)
+
+            clz._current[level] = (key, os.getpid(), logger, listener)
+            return logger
+
+    @classmethod
+    def _file_handler(clz, filename):
+        if int(clz._options["max_bytes"]) > 0:
+            handler = logging.handlers.RotatingFileHandler(filename, maxBytes=int(clz._options["max_bytes"]),
+                                                           backupCount=int(clz._options["backup_count"]), delay=True)
+        else:
+            handler = logging.FileHandler(filename, delay=True)
+
+        date_format = '%Y-%m-%d %H:%M:%S'
+        if clz._options["json"]:
+            handler.setFormatter(JsonLineFormatter(datefmt=date_format))
+        else:
             log_format = '%(asctime)s %(levelname)s: %(message)s'
-            date_format = '%Y-%m-%d %H:%M:%S'
             handler.setFormatter(logging.Formatter(log_format, date_format))
-            logger.addHandler(handler)
+        return handler
 
-        return logger
+    @classmethod
+    def _close(clz, current):
+        key, pid, logger, listener = current
+        #fork前建立的listener thread不存在於子process
+        if listener is not None and pid == os.getpid(): listener.stop()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        for handler in listener.handlers if listener is not None else []:
+            handler.close()
+
+    @classmethod
+    def shutdown(clz):
+        """
+        Write the queued records and close the log files
+        """
+        with clz._lock:
+            for current in clz._current.values(): clz._close(current)
+            clz._current = {}
+
+    @classmethod
+    def enabled_for(clz, level):
+        clz.check_log_config()
+        return level.value >= clz._level.value
 
-    #方便的log function
+    #方便的log function，有args時以msg % args在寫入時才格式化
     @classmethod
-    def log(clz, msg):
+    def log(clz, msg, *args, level=LogLevel.INFO):
         logger = clz.default()
-        logger.info(msg)
+        logger.log(level.value, msg, *args)
+
+    @classmethod
+    def debug(clz, msg, *args):
+        if clz.enabled_for(LogLevel.DEBUG): clz.log(msg, *args, level=LogLevel.DEBUG)
+
+
+atexit.register(Logger.shutdown)
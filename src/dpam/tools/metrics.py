@@ -0,0 +1,258 @@
+import bisect
+import contextvars
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dpam.tools.config_loader import ConfigLoader
+from dpam.tools.logger import Logger, LogLevel
+
+
+class Histogram:
+    """
+    Prometheus histogram with fixed buckets (seconds), one series per label values
+    """
+
+    def __init__(self, name, help, label_names, buckets):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}       # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+
+    def observe(self, seconds, *label_values):
+        ix = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[ix] += 1
+            series[-1] += seconds
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for label_values, series in sorted(items):
+            labels = _labels(self.label_names, label_values)
+            count = 0
+            for le, n in zip([*map(repr, self.buckets), "+Inf"], series[:-1]):
+                count += n
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {count}')
+            lines.append(f"{self.name}_sum{_braces(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_braces(labels)} {count}")
+        return lines
+
+
+class Metrics:
+    """
+    Request latency by endpoint and time spent in the dependencies (sqlite, redis, http, grpc), exported in the
+    prometheus text format by render() on the /metrics route of init_app.
+    - every request is observed in dpam_request_seconds{endpoint, method, status}
+    - a sampled request (sample_rate) also observes its spans in dpam_span_seconds{span}, with LogLevel.DEBUG the
+      spans of each sampled request are logged
+    - collectors are functions returning [(metric name, {label: value}, value)] read at render time as gauges
+    The optional "metrics" config has: enabled, sample_rate, buckets. Metrics are off unless enabled is set, the
+    /metrics route has no authentication and instrument() wraps the db, redis and http calls of the whole process.
+    """
+    _config = None
+    _request = None
+    _span = None
+    _collectors = []
+    _instrumented = False
+    _lock = threading.Lock()
+    _spans = contextvars.ContextVar("dpam_spans", default=None)    # span list of the sampled request, else None
+
+    default_config = {"enabled": False, "sample_rate": 0.1,
+                      "buckets": [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]}
+
+    @classmethod
+    def check_metrics_config(clz):
+        if clz._config is None:
+            config = dict(clz.default_config)
+            try:
+                config.update(ConfigLoader.config("metrics"))
+            except KeyError:
+                pass
+            clz._request = Histogram("dpam_request_seconds", "Request latency by endpoint",
+                                     ["endpoint", "method", "status"], config["buckets"])
+            clz._span = Histogram("dpam_span_seconds", "Time spent in a dependency by sampled requests",
+                                  ["span"], config["buckets"])
+            clz._config = config
+        return clz._config
+
+    @classmethod
+    def reset_metrics_config(clz):
+        clz._config = None
+
+    @classmethod
+    def enabled(clz):
+        return bool(clz.check_metrics_config()["enabled"])
+
+    #request開始時決定是否取樣，回傳傳給end_request的token
+    @classmethod
+    def begin_request(clz):
+        if not clz.enabled(): return None
+        sampled = random.random() < float(clz._config["sample_rate"])
+        clz._spans.set([] if sampled else None)
+        return time.perf_counter()
+
+    @classmethod
+    def end_request(clz, token, endpoint, method, status):
+        spans = clz._spans.get()
+        clz._spans.set(None)
+        if token is None: return
+        start = token
+        elapsed = time.perf_counter() - start
+        clz._request.observe(elapsed, str(endpoint), method, str(status))
+        if spans and Logger.enabled_for(LogLevel.DEBUG):
+            Logger.debug("request %s %s %s %.4fs spans: %s", method, endpoint, status, elapsed,
+                         ", ".join(f"{name} {seconds:.4f}s" for name, seconds in spans))
+
+    @classmethod
+    def observe_span(clz, name, seconds):
+        spans = clz._spans.get()
+        if spans is not None: spans.append((name, seconds))
+        clz._span.observe(seconds, name)
+
+    @classmethod
+    @contextmanager
+    def span(clz, name):
+        """
+        with Metrics.span("redis"): ... observed only in a sampled request (or sampled by sample_rate outside requests)
+        """
+        if not clz._sampled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            clz.observe_span(name, time.perf_counter() - start)
+
+    @classmethod
+    def _sampled(clz):
+        if clz._config is None or not clz._config["enabled"]: return False
+        if clz._spans.get() is not None: return True
+        #request以外(grpc server、script)的呼叫，以sample_rate取樣
+        return random.random() < float(clz._config["sample_rate"])
+
+    @classmethod
+    def register_collector(clz, collector):
+        clz._collectors.append(collector)
+
+    @classmethod
+    def render(clz):
+        clz.check_metrics_config()
+        lines = clz._request.render() + clz._span.render()
+        gauges = {}
+        for collector in clz._collectors:
+            try:
+                for name, labels, value in collector(): gauges.setdefault(name, []).append((labels, value))
+            except Exception as err:
+                Logger.log(f"metrics collector {collector} failed: {err}")
+        for name, values in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in values:
+                lines.append(f"{name}{_braces(_labels(labels.keys(), labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def init_app(clz, app):
+        """
+        Observe the requests of a flask app and serve render() on /metrics. A request is observed on teardown, so the
+        requests ending with an unhandled exception are counted with status 500 and their spans are reset too.
+        """
+        from flask import Response, request
+
+        @app.before_request
+        def _begin_request():
+            request.environ["dpam.metrics"] = clz.begin_request()
+
+        @app.after_request
+        def _response_status(response):
+            request.environ["dpam.metrics_status"] = response.status_code
+            return response
+
+        @app.teardown_request
+        def _end_request(error):
+            clz.end_request(request.environ.pop("dpam.metrics", None), request.url_rule or "unmatched", request.method,
+                            request.environ.pop("dpam.metrics_status", 500))
+
+        app.add_url_rule("/metrics", "metrics", lambda: Response(clz.render(), mimetype="text/plain; version=0.0.4"))
+
+    @classmethod
+    def instrument(clz):
+        """
+        Wrap the sqlite transactions (DbConnection.connect), RedisDb get/set, requests calls and the gRPC client
+        channels with spans. Called once by create_app.
+        """
+        with clz._lock:
+            if clz._instrumented or not clz.enabled(): return
+            clz._instrumented = True
+
+        import requests
+        from dsbase.tools.redis_db import RedisDb
+        from dpam.dbtools.db_connection import DbConnection
+        from dpam.grpc_cust.clientapival_client import ClientAPIValChannel
+
+        connect = DbConnection.connect.__func__
+        @contextmanager
+        def timed_connect(db_clz, db_id=None):
+            with clz.span("sqlite"):
+                with connect(db_clz, db_id) as cn: yield cn
+        DbConnection.connect = classmethod(timed_connect)
+
+        RedisDb.get = timed("redis")(RedisDb.get)
+        RedisDb.set = timed("redis")(RedisDb.set)
+        requests.Session.request = timed("http")(requests.Session.request)
+        ClientAPIValChannel.interceptors.append(_grpc_interceptor())
+
+
+def timed(name):
+    """
+    decorator observing each call of the function as a span
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Metrics.span(name): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _grpc_interceptor():
+    import grpc
+
+    class GrpcTimingInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.StreamStreamClientInterceptor):
+        #future呼叫時continuation立即回傳，以done callback計算到完成的時間
+        def _timed(self, continuation, details, request):
+            if not Metrics._sampled(): return continuation(details, request)
+            start = time.perf_counter()
+            call = continuation(details, request)
+            call.add_done_callback(lambda _: Metrics.observe_span(f"grpc{details.method}", time.perf_counter() - start))
+            return call
+
+        def intercept_unary_unary(self, continuation, client_call_details, request):
+            return self._timed(continuation, client_call_details, request)
+
+        def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+            return self._timed(continuation, client_call_details, request_iterator)
+
+    return GrpcTimingInterceptor()
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _braces(labels):
+    return f"{{{labels}}}" if labels else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
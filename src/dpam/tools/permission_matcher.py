@@ -0,0 +1,117 @@
+"""
+Compiled registry permissions of dsbase validate_permission. The entries of a registry are kept per service type
+as a flat list of (owner, allow, matcher), the matcher is the literal serviceName compared with startswith or, when
+the name has regex characters, the dsbase regex ('*' is '.+') compared with match. A check scans the entries of the
+request's service type, the registry is compiled once per value instead of once per request.
+"""
+import re
+from functools import lru_cache
+from dsbase.tools.request_handler import cate_service
+
+_regex_chars = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+def ds_service(_url):
+    """
+    Single service type variant of cate_service used by validate_ds_permission_local: the request is compared from
+    its first '/ds' on (the part before it is dropped, the same as the former local validation)
+    """
+    return {"serviceType": "ds", "serviceName": _url.partition("/ds")[2]}
+
+
+def ds_entry(reg):
+    """
+    Registry entry counterpart of ds_service, the leading '/ds' of the entry is removed
+    """
+    return {"serviceType": "ds", "serviceName": reg.removeprefix("/ds")}
+
+
+class PermissionIndex:
+    """
+    Registry entries of one or many owners compiled once and grouped by service type.
+    - registries: {owner: registry} or [(owner, registry)], a registry is the comma separated REGISTRY value
+    - categorize: splits an url into serviceType/serviceName, cate_service by default
+    - categorize_entry: the same for the registry entries, categorize when None
+    - empty_matches: whether an entry with an empty serviceName ('/ds' for cate_service) matches every request
+
+    The rules are those of dsbase validate_permission: an entry matches a request of the same service type when its
+    serviceName, with '*' standing for '.+', matches the start of the request serviceName (a string prefix, so
+    '/ds/carux/apds' covers '/ds/carux/apds_v2' and '/ds/*/apds' covers '/ds/a/b/apds'). '-' marks a negative entry.
+    An owner is permitted when at least one entry matches and no negative entry matches.
+    """
+
+    def __init__(self, registries, categorize=cate_service, categorize_entry=None, empty_matches=False):
+        self._categorize = categorize
+        self._categorize_entry = categorize_entry or categorize
+        self._empty_matches = empty_matches
+        self._entries = {}   # serviceType -> [(owner, allow, literal prefix or compiled pattern)]
+        self.owners = []
+        items = registries.items() if isinstance(registries, dict) else registries
+        for owner, registry in items:
+            self.owners.append(owner)
+            if registry is None: continue
+            for reg in registry.split(","):
+                self._add(owner, reg.strip())
+
+
+    def _add(self, owner, reg):
+        allow = not reg.startswith("-")
+        reg = reg.lstrip("-")
+        #空白的registry值不授權任何服務
+        if len(reg) == 0: return
+        service = self._categorize_entry(reg)
+        name = service["serviceName"]
+        if len(name) == 0 and not self._empty_matches: return
+        #沒有regex字元的entry以字串前綴比對，其餘與dsbase相同以'*'為'.+'的regex比對
+        matcher = re.compile(name.replace("*", ".+")) if _regex_chars.search(name) else name
+        self._entries.setdefault(service["serviceType"], []).append((owner, allow, matcher))
+
+
+    def matches(self, url):
+        """
+        {owner: [allow, ...]} of all the registry entries matching the url
+        """
+        service = self._categorize(url)
+        name = service["serviceName"]
+        matched = {}
+        for owner, allow, matcher in self._entries.get(service["serviceType"], ()):
+            if name.startswith(matcher) if isinstance(matcher, str) else matcher.match(name) is not None:
+                matched.setdefault(owner, []).append(allow)
+        return matched
+
+
+    def permitted(self, url):
+        """
+        owners permitted to access the url, in the order they were given
+        """
+        matched = self.matches(url)
+        return [owner for owner in self.owners if owner in matched and all(matched[owner])]
+
+
+class PermissionMatcher(PermissionIndex):
+    """
+    PermissionIndex of a single registry, use compile_registry() to get a cached instance
+    """
+
+    def __init__(self, registry, categorize=cate_service, categorize_entry=None, empty_matches=False):
+        PermissionIndex.__init__(self, [(None, registry)], categorize, categorize_entry, empty_matches)
+
+
+    def permit(self, url):
+        return len(self.permitted(url)) > 0
+
+
+    def validate(self, url):
+        return "Permit" if self.permit(url) else "No Permit"
+
+
+#同一個registry值只編譯一次
+@lru_cache(maxsize=4096)
+def compile_registry(registry, categorize=cate_service, categorize_entry=None, empty_matches=False):
+    return PermissionMatcher(registry, categorize, categorize_entry, empty_matches)
+
+
+#registries為(owner, registry)的tuple，內容相同時共用已編譯的index
+@lru_cache(maxsize=256)
+def compile_registries(registries, categorize=cate_service):
+    return PermissionIndex(registries, categorize)
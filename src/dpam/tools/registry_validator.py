@@ -0,0 +1,149 @@
+from dpam.dbtools.sql_buffer import SqlBuffer
+from dpam.dbtools.row_access import fetch_all
+from dpam.db_access import apply_registry_corrections, consolidate_registry_value
+from dpam.tools.account import Account
+from dpam.tools.resource_index import ResourceTrie
+from dpam.tools.logger import Logger
+
+
+class RegistryValidator:
+    """
+    Bulk version of Account.auto_correct_none_resource_client_registry_value and
+    Account.validate_resource_client_reg_value for the whole account table.
+    All the clients (TYPE 1-4) are read in one scan, best matched resources are resolved in a ResourceTrie in memory
+    and the corrections are written by executemany in one transaction at the end.
+    run(dry_run=True) returns the same report without writing anything, see diff_lines() for a readable diff.
+    progress(checked, total) is called after each client, the progress is also logged every progress_every clients.
+    """
+
+    def __init__(self, log=Logger, progress=None, progress_every=1000):
+        self.log = log
+        self.progress = progress
+        self.progress_every = progress_every
+        self.checked = 0
+        self.total = 0
+
+
+    def run(self, types=(3, 4, 2, 1), dry_run=False):
+        """
+        Validate the clients of the given types in the given order (groups and roles before the users bound to them)
+        """
+        self._load()
+        clients = [key for key in self._accounts if key[1] in types]
+        clients.sort(key=lambda key: types.index(key[1]))
+        self.checked = 0
+        self.total = len(clients)
+        self.log.log(f"Validate registry of {self.total} clients with types {list(types)}, dry_run={dry_run}")
+
+        for client_id, type in clients:
+            if type == 1: self._validate_resource(client_id)
+            else: self._validate_none_resource(client_id, type)
+            self.checked += 1
+            if self.progress: self.progress(self.checked, self.total)
+            if self.checked % self.progress_every == 0: self.log.log(f"Validated {self.checked}/{self.total} clients")
+
+        report = self.report(dry_run)
+        if not dry_run and (len(report["inserts"]) > 0 or len(report["updates"]) > 0):
+            apply_registry_corrections([(r["client_id"], r["type"], r["registry"]) for r in report["inserts"]],
+                                       [(r["client_id"], r["type"], r["after"]) for r in report["updates"]])
+        self.log.log(f"Validated {self.checked}/{self.total} clients, {len(report['inserts'])} created, "
+                     f"{len(report['updates'])} updated, {len(report['invalid'])} with invalid registry, dry_run={dry_run}")
+        return report
+
+
+    def report(self, dry_run=False):
+        inserts = [{"client_id": key[0], "type": key[1], "registry": self._accounts[key]}
+                   for key in self._inserted]
+        updates = [{"client_id": key[0], "type": key[1], "before": before, "after": self._accounts[key]}
+                   for key, before in self._original.items()
+                   if key not in self._inserted and self._accounts[key] != before]
+        invalid = [{"client_id": key[0], "type": key[1], "invalid": regs} for key, regs in self._invalid.items()]
+        return {"status": True, "dry_run": dry_run, "checked": self.checked, "total": self.total,
+                "inserts": inserts, "updates": updates, "invalid": invalid}
+
+
+    @staticmethod
+    def diff_lines(report):
+        lines = [f"+ {r['client_id']} ({r['type']}): {r['registry']}" for r in report["inserts"]]
+        lines += [f"~ {r['client_id']} ({r['type']}): {r['before']} -> {r['after']}" for r in report["updates"]]
+        lines += [f"! {r['client_id']} ({r['type']}): {','.join(r['invalid'])}" for r in report["invalid"]]
+        return lines
+
+
+    def _load(self):
+        sql = "SELECT CLIENT_ID, TYPE, REGISTRY, BIND_GROUP, BIND_ROLE FROM ACCOUNT"
+        rows = fetch_all(SqlBuffer(sql).add_in("TYPE", [1, 2, 3, 4]))
+        self._accounts = {}     # (CLIENT_ID, TYPE) -> REGISTRY, corrected in place
+        self._binds = {}        # (CLIENT_ID, TYPE) -> (BIND_GROUP, BIND_ROLE)
+        self._original = {}     # (CLIENT_ID, TYPE) -> REGISTRY before the first correction
+        self._inserted = []     # (CLIENT_ID, 1) of the created resources
+        self._invalid = {}      # (CLIENT_ID, TYPE) -> registry entries without any matched resource
+        for row in rows:
+            key = (row["CLIENT_ID"], row["TYPE"])
+            self._accounts[key] = row["REGISTRY"]
+            self._binds[key] = (row["BIND_GROUP"], row["BIND_ROLE"])
+        self._trie = ResourceTrie({"CLIENT_ID": key[0], "REGISTRY": reg} for key, reg in self._accounts.items() if key[1] == 1)
+
+
+    def _entries(self, registry):
+        if registry is None or registry == 'None': return []
+        return [reg.strip() for reg in registry.split(",") if reg.strip() != ""]
+
+
+    def _merged_registry(self, client_id, type):
+        """
+        the client's registry merged with the registry of its bind groups and roles, the same as Account.registry
+        """
+        regs = self._entries(self._accounts[(client_id, type)])
+        bind_group, bind_role = self._binds.get((client_id, type), (None, None))
+        for binds, bind_type in [(bind_group, 3), (bind_role, 4)]:
+            for bind in self._entries(binds):
+                regs += self._entries(self._accounts.get((bind, bind_type)))
+        return list(dict.fromkeys(regs))
+
+
+    def _validate_none_resource(self, client_id, type):
+        pass_res = []
+        invalid_res = []
+        for res in self._merged_registry(client_id, type):
+            if (res, 1) in self._accounts:
+                pass_res.append(res)
+                continue
+            _bm_res = self._trie.best_match(res)
+            if _bm_res is None:
+                invalid_res.append(res)
+                continue
+            #與validate_none_resource_client_registry_value相同: 建立res，並把res加到最佳匹配resource的registry
+            self._create_resource(res)
+            _reg = Account._resource_clientid_reg_value(_bm_res[0], res)[1]
+            bm_registry = self._accounts[(_bm_res[0], 1)]
+            self._set_registry(_bm_res[0], 1, f"{bm_registry},{_reg}" if bm_registry else _reg)
+            pass_res.append(res)
+
+        if len(pass_res) > 0: self._set_registry(client_id, type, ",".join(pass_res))
+        if len(invalid_res) > 0: self._invalid[(client_id, type)] = invalid_res
+
+
+    def _validate_resource(self, client_id):
+        registry = self._accounts[(client_id, 1)]
+        if registry == '*': return
+        #負向(-)及非路徑的registry值不代表子resource，不建立
+        for reg in self._entries(registry):
+            if not reg.startswith("/"): continue
+            _sub_resource_id = f"{client_id.rstrip('/*')}{reg}"
+            if (_sub_resource_id, 1) not in self._accounts: self._create_resource(_sub_resource_id)
+
+
+    def _create_resource(self, client_id, registry='*'):
+        key = (client_id, 1)
+        self._accounts[key] = registry
+        self._inserted.append(key)
+        self._trie.put(client_id, registry)
+
+
+    def _set_registry(self, client_id, type, registry):
+        key = (client_id, type)
+        registry = consolidate_registry_value(registry)
+        if key not in self._original: self._original[key] = self._accounts[key]
+        self._accounts[key] = registry
+        if type == 1: self._trie.put(client_id, registry)
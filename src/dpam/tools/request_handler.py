@@ -7,8 +7,8 @@ import dpam.tools.reset_config as reset_config
 from dpam.tools.cache_key import get_cache_key
 import dpam.tools.account as account
 from dpam.tools.error_handler import JSNError
-from dsbase.tools.request_handler import validate_request_reg_permit
-import re
+from dpam.tools.permission_matcher import compile_registry, ds_service, ds_entry
+from dpam.tools.token_cache import TokenCache
 
 #繼承Response，預設status code:200，預設mimetype:application/json
 class JSNResponse(Response):
@@ -31,17 +31,10 @@ def check_and_log(ignore_token=False, token=None):
     if request.args.get('token'):
         token = request.args.get('token')
 
-    if token is not None:
-        redis = RedisDb.default()
-        client_info = redis.get(token)
-    if client_info is not None:
-        client_id = client_info[0:client_info.index(":")]
-        permission = client_info[client_info.index(":")+1:]
-        if permission:
-            permission_list = permission.split("|")
-            if "QUERY" in permission_list:
-                Logger.log(f'Issue request: @{client_id} {request.method} {request.url}')
-                return True
+    record = TokenCache.get(token)
+    if record is not None and record.can_query():
+        Logger.log(f'Issue request: @{record.client_id} {request.method} {request.url}')
+        return True
 
     Logger.log(f'Deny request: {request.method} {request.url}')
     return False
@@ -101,33 +94,18 @@ def get_cache_expiry_hours():
     return None
 
 def validate_ds_permission(registry, url):
-    return validate_request_reg_permit(url, registry)
+    """
+        Same rules as dsbase validate_request_reg_permit ('*' is '.+', entries are prefixes of the service name),
+        the registry is compiled once by compile_registry
+    """
+    if registry is None: return "No Permit"
+    return compile_registry(registry).validate(url)
 
 def validate_ds_permission_local(registry, url):
     """
         The validation function will consider the wild card in the reg string
         A registry may be empty or one to several reg string seperated in "," such as "/eng/ispec/define/F8,/eng/ispec/spec/F8"
+        The request is compared from its first '/ds', the leading '/ds' of the entries is ignored and there is no service type
     """
-    print(f"request api name {url}")
-    nde =url.partition("/ds")[2]
-    permit = []
-    # case registry value is empty
-    if len(registry.strip())==0:  return "No Permit"
-    # case registry is not empty and contains one or several regs
-    for reg in registry.split(","): 
-        if reg.startswith("-"): 
-            reg_type = False
-            reg_pat = reg.lstrip("-")
-        else: 
-            reg_type = True
-            reg_pat = reg
-        pat_match = re.search(reg_pat.removeprefix('/ds').replace("*",".+"),nde)    
-        #else: pat_match = re.search(reg_pat.replace("*",".+"),nde) 
-        print(f"reg_type: {reg_type}/ reg_pat:{reg_pat}")
-        print(f"pat_match: {pat_match}")
-        if pat_match is not None and pat_match.start() == 0: permit.append(reg_type)
-
-    if permit.__len__() == 0 or permit.__contains__(False):
-        return "No Permit"
-    else :
-        return "Permit"       
\ No newline at end of file
+    if registry is None: return "No Permit"
+    return compile_registry(registry, ds_service, ds_entry, True).validate(url)
@@ -0,0 +1,121 @@
+import threading
+from dpam.dbtools.sql_buffer import SqlBuffer
+from dpam.dbtools.row_access import fetch_all
+
+
+class _Node:
+    __slots__ = ("children", "resource")
+
+    def __init__(self):
+        self.children = {}       # segment -> _Node, '*' is kept as a normal key
+        self.resource = None     # (CLIENT_ID, REGISTRY) of the resource client ending here
+
+
+class ResourceTrie:
+    """
+    Segment trie of resource client ids, each id is stored with its REGISTRY value
+    """
+
+    def __init__(self, rows=()):
+        self._root = _Node()
+        for row in rows: self.put(row["CLIENT_ID"], row["REGISTRY"])
+
+
+    def best_match(self, _res):
+        """
+        (CLIENT_ID, REGISTRY) of the resource sharing the most leading segments with _res, None if there is not any.
+        A '*' segment of a resource matches any segment, an exact segment is preferred to '*' on a tie.
+        """
+        best = [0, None]
+        self._search(self._root, _segments(_res), 0, best)
+        return best[1]
+
+
+    def _search(self, node, segments, depth, best):
+        #深度優先，先走完全相同的segment，只有更深的結果才取代，所以同深度時完全相同的segment優先
+        if node.resource is not None and depth > best[0]:
+            best[0] = depth
+            best[1] = node.resource
+        if depth == len(segments): return
+        seg = segments[depth]
+        child = node.children.get(seg)
+        if child is not None: self._search(child, segments, depth + 1, best)
+        child = node.children.get("*")
+        if child is not None and seg != "*": self._search(child, segments, depth + 1, best)
+
+
+    def put(self, client_id, registry):
+        node = self._root
+        for seg in _segments(client_id):
+            node = node.children.setdefault(seg, _Node())
+        node.resource = (client_id, registry)
+
+
+    def remove(self, client_id):
+        segments = _segments(client_id)
+        path = [self._root]
+        for seg in segments:
+            node = path[-1].children.get(seg)
+            if node is None: return
+            path.append(node)
+        if path[-1].resource is None or path[-1].resource[0] != client_id: return
+        path[-1].resource = None
+        #移除不再有resource的空節點
+        for depth in range(len(segments), 0, -1):
+            node = path[depth]
+            if node.resource is not None or len(node.children) > 0: break
+            del path[depth - 1].children[segments[depth - 1]]
+
+
+class ResourceIndex:
+    """
+    ResourceTrie of the resource clients (TYPE=1) in the account table, used to resolve the best matched resource of a path.
+    It is loaded from the account table on first use and then kept up to date one resource at a time:
+    AccountCache.drop() calls refresh(client_id) for every resource write, in this worker and, through the
+    pub/sub message, in the other workers.
+    """
+    _trie = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def best_match(clz, _res):
+        return clz._get_trie().best_match(_res)
+
+    @classmethod
+    def refresh(clz, client_id):
+        """
+        Re-read one resource client after it is inserted, updated or deleted
+        """
+        with clz._lock:
+            if clz._trie is None: return
+            try:
+                rows = fetch_all(SqlBuffer("SELECT CLIENT_ID, REGISTRY FROM ACCOUNT").add_eq("CLIENT_ID", client_id).add_eq("TYPE", 1))
+            except Exception:
+                #讀取失敗時下次使用再整個重建
+                clz._trie = None
+                raise
+            if len(rows) > 0:
+                clz._trie.put(rows[0]["CLIENT_ID"], rows[0]["REGISTRY"])
+            else:
+                clz._trie.remove(client_id)
+
+    @classmethod
+    def reset(clz):
+        """
+        The index is rebuilt from the account table on next use
+        """
+        with clz._lock:
+            clz._trie = None
+
+    @classmethod
+    def _get_trie(clz):
+        trie = clz._trie
+        if trie is not None: return trie
+        with clz._lock:
+            if clz._trie is None:
+                clz._trie = ResourceTrie(fetch_all(SqlBuffer("SELECT CLIENT_ID, REGISTRY FROM ACCOUNT").add_eq("TYPE", 1)))
+            return clz._trie
+
+
+def _segments(path):
+    return path.strip("/").split("/")
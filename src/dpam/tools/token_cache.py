@@ -0,0 +1,143 @@
+import os
+import threading
+from dsbase.tools.redis_db import RedisDb
+from dpam.tools.config_loader import ConfigLoader
+from dpam.tools.logger import Logger
+from dpam.tools.permission_matcher import compile_registry
+from dpam.tools.ttl_cache import TTLCache
+
+
+class ApiKeyRecord:
+    """
+    Parsed "client_id:permission:registry" value of an apikey in redis
+    """
+    __slots__ = ("client_info", "client_id", "permissions", "registry", "matcher")
+
+    def __init__(self, client_info):
+        parts = client_info.split(":", 2)
+        self.client_info = client_info
+        self.client_id = parts[0]
+        self.permissions = frozenset(parts[1].split("|")) if len(parts) > 1 and parts[1] else frozenset()
+        self.registry = parts[2] if len(parts) > 2 else ""
+        self.matcher = compile_registry(self.registry)
+
+    def can_query(self):
+        return "QUERY" in self.permissions
+
+
+class TokenCache:
+    """
+    In-process cache of the apikeys verified by check_and_log, in front of the redis key written by
+    check_client_id_password (24 hours expiry). A record is kept ttl_seconds at most.
+    An apikey issued again (the same token for the same client on the same day) is dropped in all workers through a
+    redis pub/sub message. With keyevents enabled (off by default) the del/expired/set keyevent notifications of
+    redis are also followed, they need notify-keyspace-events to be set on the redis server (ex: "Eg$x"). The apikeys
+    have no key prefix to subscribe to, so every worker then receives the notifications of all the keys of the server.
+    The optional "token_cache" config has: ttl_seconds, max_entries, channel, keyevents, enabled
+    """
+    _config = None
+    _cache = None
+    _redis = None
+    _pubsub_thread = None
+    _pid = None
+    _lock = threading.Lock()
+
+    default_config = {"ttl_seconds": 300, "max_entries": 10000, "channel": "apikey_invalidate", "keyevents": False, "enabled": True}
+    keyevents = ("del", "expired", "set")
+
+    @classmethod
+    def check_cache_config(clz):
+        if clz._config is None:
+            config = dict(clz.default_config)
+            try:
+                config.update(ConfigLoader.config("token_cache"))
+            except KeyError:
+                pass
+            clz._config = config
+            clz._cache = TTLCache(maxsize=int(config["max_entries"]), ttl=float(config["ttl_seconds"]))
+
+    @classmethod
+    def reset_cache_config(clz):
+        clz._config = None
+        clz._cache = None
+
+    @classmethod
+    def get(clz, token):
+        """
+        ApiKeyRecord of the token, None if the token is not (or no longer) in redis
+        """
+        clz.check_cache_config()
+        if token is None: return None
+        if not clz._config["enabled"]: return clz._load(token)
+        clz._ensure_listener()
+
+        record = clz._cache.get(token)
+        if record is None:
+            record = clz._load(token)
+            if record is not None: clz._cache.set(token, record)
+        return record
+
+    @classmethod
+    def invalidate(clz, token):
+        """
+        Drop the token in this worker and tell the other workers
+        """
+        clz.drop(token)
+        try:
+            redis = clz._get_redis()
+            redis.redis.publish(clz._config["channel"], token)
+        except Exception as err:
+            # 其他worker會在ttl後過期
+            Logger.log(f'Token cache invalidation publish failed: {err}')
+
+    @classmethod
+    def drop(clz, token=None):
+        clz.check_cache_config()
+        if token is None: clz._cache.clear()
+        else: clz._cache.pop(token)
+
+    @classmethod
+    def stats(clz):
+        clz.check_cache_config()
+        return clz._cache.stats()
+
+    @classmethod
+    def _load(clz, token):
+        client_info = clz._get_redis().get(token)
+        if client_info is None: return None
+        return ApiKeyRecord(client_info)
+
+    @classmethod
+    def _on_message(clz, message):
+        # channel的訊息及keyevent的訊息，data都是token
+        clz.drop(message["data"])
+
+    @classmethod
+    def _get_redis(clz):
+        clz.check_cache_config()
+        if clz._redis is None or clz._pid != os.getpid():
+            clz._redis = RedisDb.default()
+            clz._pid = os.getpid()
+            clz._pubsub_thread = None
+        return clz._redis
+
+    @classmethod
+    def _ensure_listener(clz):
+        """
+        Subscribe once per process (after the gunicorn fork), the listener runs in a daemon thread
+        """
+        if clz._pubsub_thread is not None and clz._pid == os.getpid(): return
+        with clz._lock:
+            if clz._pubsub_thread is not None and clz._pid == os.getpid(): return
+            try:
+                redis = clz._get_redis()
+                pubsub = redis.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{clz._config["channel"]: clz._on_message})
+                if clz._config["keyevents"]:
+                    pubsub.psubscribe(**{f"__keyevent@*__:{event}": clz._on_message for event in clz.keyevents})
+                clz._pubsub_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            except Exception as err:
+                # 沒有listener時，record仍會在ttl後過期
+                clz._pubsub_thread = False
+                clz._pid = os.getpid()
+                Logger.log(f'Token cache invalidation listener is not started: {err}')
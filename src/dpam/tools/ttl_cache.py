@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache bounded by entry count (LRU) and age (ttl seconds).
+    ttl <= 0 or None keeps entries until they are evicted by size.
+    hits/misses/evictions/expirations are kept for sizing, see stats().
+    """
+    _missing = object()
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()      # key -> (value, expire_at)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._missing)
+            if item is self._missing:
+                self.misses += 1
+                return default
+            value, expire_at = item
+            if expire_at is not None and expire_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = time.monotonic() + ttl if ttl and ttl > 0 else None
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, self._missing)
+        return default if item is self._missing else item[0]
+
+
+    #刪除符合條件的key，回傳刪除的筆數
+    def pop_matching(self, predicate):
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys: del self._data[key]
+        return len(keys)
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+    def __contains__(self, key):
+        return self.get(key, self._missing) is not self._missing
+
+
+    def __len__(self):
+        return len(self._data)
+
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations}
@@ -1,14 +1,20 @@
 from flask import request, make_response, redirect, url_for
 import requests
+from requests.adapters import HTTPAdapter
+import hashlib
+import threading
 import urllib.parse as urltool
 from dpam.tools.config_loader import ConfigLoader
-from dpam.tools.logger import Logger
+from dpam.tools.logger import Logger, LogLevel
 from dsbase.tools.redis_db import RedisDb
+from redis.exceptions import ResponseError
 import json
+import math
 import os
 from datetime import datetime
 import re
 from dpam.tools.get_env import env
+from dpam.tools.ttl_cache import TTLCache
 
 """
     The environment variable 'api_account_env' has 'tst'|'prd' values. The'validate_user' function detects the value for seperating used sso server.
@@ -36,9 +42,9 @@ def resp_check():
     for srv_, url_ in _api.items():
         response = None
         if re.match(r'^v4.*vtt$',srv_):
-            response = requests.post(url=url_, json=v4_data, headers=v4_headers)
+            response = SsoTokenCache.session().post(url=url_, json=v4_data, headers=v4_headers, timeout=SsoTokenCache.timeout())
         if re.match(r'^v3.*vtt$',srv_):
-            response = requests.get(url_ + "?ticket=" +  urltool.quote_plus(token))
+            response = SsoTokenCache.session().get(url_ + "?ticket=" +  urltool.quote_plus(token), timeout=SsoTokenCache.timeout())
         if (response is not None) and (response.status_code in [200, 400, 401]):
             os.environ[srv_] = f"ok@{datetime.now().strftime('%Y/%m/%d:%H:%M:%S')}"
         else:
@@ -72,7 +78,7 @@ def  validate_user(token_required=False,token=None):
     recognize it is valid, ssov4 will redirect the user's page to where the validate_user has designated.
     Or it will let user keying the id and password for authenticating.  
     """
-    if env != 'prd': log_request_header()
+    if env != 'prd' and Logger.enabled_for(LogLevel.DEBUG): log_request_header()
     
     if token_required and token is not None: 
         Logger.log(f"step 00: token_required:{token_required} with given token {token}")
@@ -104,6 +110,9 @@ def  validate_user(token_required=False,token=None):
         return redirect_to_login()
 
 def log_request_header():
+    """
+    Logged at DEBUG level only, formatting the whole environ is not cheap
+    """
     request_detail = f"accept_charsets: {request.accept_charsets} \n accept_encodings: {request.accept_encodings} \n"
     request_detail += f"accept_languages: {request.accept_languages} \n accept_mimetypes: {request.accept_mimetypes} \n"
     request_detail += f"access_control_request_headers :{request.access_control_request_headers} \n" 
@@ -120,7 +129,7 @@ def log_request_header():
     request_detail += f"endpoint:{request.endpoint}\n"
     request_detail += f"cookies :{request.cookies}\n"
     request_detail += f"content_encoding:{request.content_encoding}\n"
-    Logger.log(request_detail)
+    Logger.log(request_detail, level=LogLevel.DEBUG)
 
 def validate_user_ssov4(user_id=None, sess_key=None, token=None):
     """
@@ -128,47 +137,23 @@ def validate_user_ssov4(user_id=None, sess_key=None, token=None):
     1. user_id exist in UserSessions and the sess_key is match with Token
     2. user_id exist in UserSessions (_sesses or redis cache), but the sess_key is not match with Token
     3. user_id does not exist in UserSessions
+    The token is verified through SsoTokenCache, sso is asked only when the token is not cached
     """
-    ask_sso = False
-    
-    if user_id is None and token is not None:
-        Logger.log(f"Use sso v4/cert_key: {token}")
-        verify_url = _api[f"v4_{env}_vtt"]
-        data = {
-            "Token": token,
-            "IsCheckIP": False,
-            "SysID": "datastudio"
-        }
-        headers= {"Content-Type":"application/json"}
-        url = verify_url
-        response = requests.post(url=url, json=data, headers=headers)
-        ask_sso = True
-        Logger.log(f"validate_user use ssov4 step 0: 'Token' is given - user_id:{user_id} \n sess_key: {sess_key} \n cert_key:{token}\n")
-
-    if user_id is None and "Token" in request.args:
+    if user_id is None and token is None and "Token" in request.args:
         token = request.args["Token"]
-        Logger.log(f"Use sso v4/cert_key: {token}")
-        verify_url = _api[f"v4_{env}_vtt"]
-        data = {
-            "Token": token,
-            "IsCheckIP": False,
-            "SysID": "datastudio"
-        }
-        headers= {"Content-Type":"application/json"}
-        url = verify_url
-        response = requests.post(url=url, json=data, headers=headers)
-        ask_sso = True
         Logger.log(f"validate_user use ssov4 step 1: 'Token' exist in request.args - user_id:{user_id} \n sess_key: {sess_key} \n cert_key:{token}\n")
-    
-    if ask_sso and response.status_code == 200:
-        sess_key = token[-25:-5]
-        ticket = response.json()
-        Logger.log(f"response ticket: {ticket}")
-        user_id = ticket["AD"]
-        UserSessions.add_login_user(sess_key, user_id, ticket["MemID"])
-        Logger.log(f"validate_user step 2: token:{token}\n url: {url} \n user_id:{user_id} \n sess_key: {sess_key} ")
-    
-    elif ask_sso and response.status_code != 200: Logger.log(f"validate_user step 2: status_code: {response.status_code} \n response_text: {response.text} \n cert_key:{token}\n url: {url} \n user_id:{user_id} \n sess_key: {sess_key} ")
+    elif user_id is None and token is not None:
+        Logger.log(f"validate_user use ssov4 step 0: 'Token' is given - user_id:{user_id} \n sess_key: {sess_key} \n cert_key:{token}\n")
+
+    if user_id is None and token is not None:
+        ticket = SsoTokenCache.verify(token)
+        if ticket is not None:
+            sess_key = token[-25:-5]
+            user_id = ticket["AD"]
+            # 同一個token再次驗證時session已存在，不用再寫一次redis
+            if UserSessions.get_login_user(sess_key) != user_id: UserSessions.add_login_user(sess_key, user_id, ticket["MemID"])
+            Logger.log(f"validate_user step 2: token:{token}\n user_id:{user_id} \n sess_key: {sess_key} ")
+        else: Logger.log(f"validate_user step 2: token is not verified \n cert_key:{token}\n")
     Logger.log(f"End of validate user: user_id: {user_id} / sess_key:{sess_key}")
     return (user_id, sess_key)
 
@@ -187,7 +172,7 @@ def validate_user_ssov3():
         cert_key = request.args["CertificateKey"]
         verify_url = _api["v3_prd_vtt"]
         url = verify_url + "?ticket=" + urltool.quote_plus(cert_key)
-        response = requests.get(url)
+        response = SsoTokenCache.session().get(url, timeout=SsoTokenCache.timeout())
         if response.status_code == 200:
             sess_key = cert_key[-25:-5]
             ticket = response.json()
@@ -211,6 +196,9 @@ def get_session_key():
     return request.cookies.get(name)
 
 #用來記錄/accounts_for_owner或/accounts_for_admin或/group_role_for_admin
+def set_list_page(sess_key, list_page):
+    UserSessions.update_session(sess_key, list_page=list_page)
+
 def get_list_page():
     sess = UserSessions.get_session()
     return sess["list_page"] if sess is not None and "list_page" in sess else url_for('acct_bp.get_index_page')
@@ -220,6 +208,149 @@ def is_admin(user_id):
     admin = ConfigLoader.config("system")["admin"]
     return user_id in admin
 
+class SsoTokenCache:
+    """
+    Verified sso tokens, so a Bearer token is sent to sso VerifyToken once per ttl instead of on every api call.
+    - a token is keyed by its sha256, only the ticket's AD and MemID are kept
+    - a local TTLCache in front of redis (shared by the workers), both expire after ttl_seconds
+    - a token refused by sso (4xx) is cached for negative_ttl_seconds, an sso failure (5xx, timeout) is not cached
+    - concurrent verifications of the same token wait for one sso call
+    - the sso calls share one requests.Session (keep-alive connection pool) with a timeout
+    The optional "sso_cache" config has: ttl_seconds, negative_ttl_seconds, max_entries, connect_timeout, read_timeout, pool_maxsize
+    """
+    _config = None
+    _cache = None
+    _session = None
+    _redis = None
+    _pid = None
+    _inflight = {}
+    _lock = threading.Lock()
+    redis_key_prefix = "sso_token"
+
+    default_config = {"ttl_seconds": 300, "negative_ttl_seconds": 30, "max_entries": 10000,
+                      "connect_timeout": 3, "read_timeout": 10, "pool_maxsize": 10}
+
+    @classmethod
+    def check_cache_config(clz):
+        if clz._config is None:
+            config = dict(clz.default_config)
+            try:
+                config.update(ConfigLoader.config("sso_cache"))
+            except KeyError:
+                pass
+            clz._config = config
+            clz._cache = TTLCache(maxsize=int(config["max_entries"]), ttl=float(config["ttl_seconds"]))
+        return clz._config
+
+    @classmethod
+    def timeout(clz):
+        config = clz.check_cache_config()
+        return (float(config["connect_timeout"]), float(config["read_timeout"]))
+
+    @classmethod
+    def session(clz):
+        if clz._session is None or clz._pid != os.getpid():
+            with clz._lock:
+                if clz._session is None or clz._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=int(clz.check_cache_config()["pool_maxsize"]))
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    clz._session = session
+                    clz._redis = None
+                    clz._pid = os.getpid()
+        return clz._session
+
+    @classmethod
+    def verify(clz, token):
+        """
+        the ticket {"AD", "MemID"} of a valid token, None if sso refuses it or cannot be reached
+        """
+        clz.check_cache_config()
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        entry = clz._cache.get(key)
+        if entry is None: entry = clz._get_redis_entry(key)
+        if entry is None: entry = clz._single_flight(key, lambda: clz._ask_sso(key, token))
+        return entry.get("ticket") if entry else None
+
+    @classmethod
+    def _single_flight(clz, key, ask):
+        with clz._lock:
+            call = clz._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "entry": None}
+                clz._inflight[key] = call
+        if not leader:
+            call["done"].wait(sum(clz.timeout()))
+            return call["entry"]
+        try:
+            call["entry"] = ask()
+        finally:
+            with clz._lock: clz._inflight.pop(key, None)
+            call["done"].set()
+        return call["entry"]
+
+    @classmethod
+    def _ask_sso(clz, key, token):
+        config = clz.check_cache_config()
+        data = {"Token": token, "IsCheckIP": False, "SysID": "datastudio"}
+        url = _api[f"v4_{env}_vtt"]
+        try:
+            response = clz.session().post(url=url, json=data, headers={"Content-Type":"application/json"}, timeout=clz.timeout())
+        except requests.RequestException as err:
+            Logger.log(f"sso verify token failed: {err} \n url: {url}")
+            return None
+
+        if response.status_code == 200:
+            ticket = response.json()
+            Logger.log(f"response ticket: {ticket}")
+            entry = {"ticket": {"AD": ticket["AD"], "MemID": ticket["MemID"]}}
+            ttl = float(config["ttl_seconds"])
+        elif 400 <= response.status_code < 500:
+            Logger.log(f"sso refused token: status_code: {response.status_code} \n response_text: {response.text} \n url: {url}")
+            entry = {"ticket": None}
+            ttl = float(config["negative_ttl_seconds"])
+        else:
+            Logger.log(f"sso verify token failed: status_code: {response.status_code} \n response_text: {response.text} \n url: {url}")
+            return None
+
+        clz._cache.set(key, entry, ttl=ttl)
+        clz._set_redis_entry(key, entry, ttl)
+        return entry
+
+    @classmethod
+    def _get_redis(clz):
+        clz.session()
+        if clz._redis is None: clz._redis = RedisDb.default()
+        return clz._redis
+
+    @classmethod
+    def _get_redis_entry(clz, key):
+        try:
+            text = clz._get_redis().redis.get(f"{clz.redis_key_prefix}@{key}")
+            if text is None: return None
+            entry = json.loads(text)
+            # 本地只保留到redis剩下的時間
+            ttl = clz._get_redis().redis.ttl(f"{clz.redis_key_prefix}@{key}")
+            if ttl is not None and ttl > 0: clz._cache.set(key, entry, ttl=ttl)
+            return entry
+        except Exception as err:
+            Logger.log(f"sso token cache read failed: {err}")
+            return None
+
+    @classmethod
+    def _set_redis_entry(clz, key, entry, ttl):
+        try:
+            clz._get_redis().redis.set(f"{clz.redis_key_prefix}@{key}", json.dumps(entry), ex=max(1, int(ttl)))
+        except Exception as err:
+            Logger.log(f"sso token cache write failed: {err}")
+
+    @classmethod
+    def stats(clz):
+        clz.check_cache_config()
+        return clz._cache.stats()
+
 class UserSessions:
     """"
     user's info is stored in UserSessions. UserSessions use redis for caching data and has two keys:
@@ -232,31 +363,74 @@ class UserSessions:
     if 'configpath' not in os.environ: os.environ['configpath'] = os.path.join(os.getcwd(),'config') 
     redis = RedisDb.default()
     redis_key_prefix = "session_api_account"
-        
-    _sessions = {}
+
+    # 本地只保留最近使用的session，過期後從redis重新讀取，redis已過期的session就不再使用
+    _config = None
+    _sessions = None
+    default_config = {"max_entries": 10000, "ttl_seconds": 300, "redis_expiry_hours": None}
+
+    @classmethod
+    def check_cache_config(clz):
+        """
+        The optional "user_sessions" config has: max_entries, ttl_seconds (local copy), redis_expiry_hours
+        (None uses the RedisDb default)
+        """
+        if clz._config is None:
+            config = dict(clz.default_config)
+            try:
+                config.update(ConfigLoader.config("user_sessions"))
+            except KeyError:
+                pass
+            clz._config = config
+            clz._sessions = TTLCache(maxsize=int(config["max_entries"]), ttl=float(config["ttl_seconds"]))
+        return clz._config
+
+    @classmethod
+    def stats(clz):
+        clz.check_cache_config()
+        return clz._sessions.stats()
 
     @classmethod
     def add_session(clz, sess_key):
-        clz._sessions[sess_key] = {}
-        return clz._sessions[sess_key]
+        clz.check_cache_config()
+        sess = {}
+        clz._sessions.set(sess_key, sess)
+        return sess
 
     @classmethod
     def get_session(clz, sess_key=None):
+        clz.check_cache_config()
         if sess_key is None: sess_key = get_session_key()
-        if sess_key in clz._sessions: return clz._sessions[sess_key] 
-        else:
-            sess = clz._get_session_from_redis(sess_key)
-            Logger.log(f"get session data from redis: sess_key {sess_key}, sess:{sess}")
-            if sess is not None: 
-                clz._sessions[sess_key] = sess
-                Logger.log(f"set session data from redis: sess_key {sess_key}, clz._sessions:{sess}")
-            return sess 
-        
+        sess = clz._sessions.get(sess_key)
+        if sess is not None: return sess
+        sess = clz._get_session_from_redis(sess_key)
+        Logger.log(f"get session data from redis: sess_key {sess_key}, sess:{sess}")
+        if sess is not None:
+            clz._sessions.set(sess_key, sess)
+            Logger.log(f"set session data from redis: sess_key {sess_key}, clz._sessions:{sess}")
+        return sess
+
     @classmethod
     def clear_session(clz, sess_key=None):
+        clz.check_cache_config()
         if sess_key is None: sess_key = get_session_key()
-        if sess_key in clz._sessions: return clz._sessions.pop(sess_key)
+        sess = clz._sessions.pop(sess_key)
+        # redis也要刪除，否則下次get_session會從redis讀回來
         clz._del_session_from_redis(sess_key)
+        return sess
+
+    @classmethod
+    def update_session(clz, sess_key=None, **kwargs):
+        """
+        Set values of a session in the local copy and in its redis hash, they are read back from redis after the
+        local copy is evicted or on another worker
+        """
+        if sess_key is None: sess_key = get_session_key()
+        sess = clz.get_session(sess_key) if sess_key is not None else None
+        if sess is None: return None
+        sess.update(kwargs)
+        clz._update_hash(sess_key, kwargs)
+        return sess
 
     @classmethod
     def add_login_user(clz, sess_key, user_id, emp_id):
@@ -273,38 +447,35 @@ class UserSessions:
     
     @classmethod
     def add_login_user_redis(clz, sess_key, user_id, emp_id):
-        clz.redis.set(sess_key, json.dumps({"user_id":user_id,"emp_id":emp_id}))
+        """
+        Both keys are redis hashes (one field per value), rewritten with their expiry in one MULTI/EXEC round trip
+        """
         key = f"{clz.redis_key_prefix}@{user_id}"
-        update_content = {"sess_key":sess_key,"emp_id":emp_id}
-        origin_content = clz.redis.get(key)
-        if origin_content is None or 'null' : content = update_content
-        else: 
-            content = json.loads(origin_content)
-            content.update(update_content)
-        clz.redis.set(key,json.dumps(content))
+        expiry_secs = clz._expiry_seconds()
+        pipe = clz.redis.redis.pipeline(transaction=True)
+        for _key, fields in [(sess_key, {"user_id":user_id, "emp_id":emp_id}), (key, {"sess_key":sess_key, "emp_id":emp_id})]:
+            pipe.delete(_key)
+            pipe.hset(_key, mapping=clz._encode_fields(fields))
+            if expiry_secs > 0: pipe.expire(_key, expiry_secs)
+        pipe.execute()
 
     @classmethod
     def update_login_user_redis(clz, user_id, **kwargs):
-        key = f"{clz.redis_key_prefix}@{user_id}"
-        origin_text = clz.redis.get(key)
-        if origin_text is None : origin_content = {}
-        else: origin_content = json.loads(origin_text)
-        origin_content.update(kwargs)
-        update_content = origin_content
-        clz.redis.set(key,json.dumps(update_content))
-                      
+        if len(kwargs) == 0: return
+        # hset與expire一起送出，不會留下沒有期限的key
+        clz._update_hash(f"{clz.redis_key_prefix}@{user_id}", kwargs)
+
     @classmethod
     def get_login_user_redis(clz, user_id,kws=[]):
         key = f"{clz.redis_key_prefix}@{user_id}"
-        origin_content = clz.redis.get(key)
-        if origin_content is None : return {}
-        else: content = json.loads(origin_content)
-        if kws == []: return content
-        response_content = {}
-        for kw in kws:
-            if kw in content.keys(): response_content[kw] = content[kw]
-        return response_content
-    
+        if kws == []: return clz._get_hash(key) or {}
+        try:
+            values = clz.redis.redis.hmget(key, kws)
+        except ResponseError:
+            content = clz._get_legacy_json(key) or {}
+            return {kw: content[kw] for kw in kws if kw in content}
+        return {kw: json.loads(value) for kw, value in zip(kws, values) if value is not None}
+
     @classmethod
     def _get_session_from_redis(clz,sess_key=None):
         """"
@@ -312,10 +483,57 @@ class UserSessions:
           Alwayse return None if a new sess_key still not cached
         """
         if sess_key is None: sess_key = get_session_key()
-        sess = clz.redis.get(sess_key)
-        if sess is not None: return json.loads(sess)
-        return None
-    
+        return clz._get_hash(sess_key)
+
+    @classmethod
+    def _get_hash(clz, key):
+        """
+        the decoded fields of a hash key, None if the key does not exist. Keys written before the hash layout
+        (a json string) are still read until they are rewritten or expire.
+        """
+        try:
+            fields = clz.redis.redis.hgetall(key)
+        except ResponseError:
+            return clz._get_legacy_json(key)
+        if len(fields) == 0: return None
+        return {field: json.loads(value) for field, value in fields.items()}
+
+    @classmethod
+    def _get_legacy_json(clz, key):
+        text = clz.redis.get(key)
+        return json.loads(text) if text is not None else None
+
+    @classmethod
+    def _update_hash(clz, key, fields):
+        """
+        Set fields of a hash key and renew its expiry in one MULTI/EXEC round trip
+        """
+        expiry_secs = clz._expiry_seconds()
+        try:
+            pipe = clz.redis.redis.pipeline(transaction=True)
+            pipe.hset(key, mapping=clz._encode_fields(fields))
+            if expiry_secs > 0: pipe.expire(key, expiry_secs)
+            pipe.execute()
+        except ResponseError:
+            # 舊格式(json字串)的key，轉成hash後再更新
+            content = clz._get_legacy_json(key) or {}
+            content.update(fields)
+            pipe = clz.redis.redis.pipeline(transaction=True)
+            pipe.delete(key)
+            pipe.hset(key, mapping=clz._encode_fields(content))
+            if expiry_secs > 0: pipe.expire(key, expiry_secs)
+            pipe.execute()
+
+    @staticmethod
+    def _encode_fields(fields):
+        return {field: json.dumps(value) for field, value in fields.items()}
+
+    @classmethod
+    def _expiry_seconds(clz):
+        expiry_hours = clz.check_cache_config()["redis_expiry_hours"]
+        if expiry_hours is None: expiry_hours = RedisDb._expiry_hours
+        return math.ceil(float(expiry_hours) * 60 * 60)
+
     @classmethod
     def _del_session_from_redis(clz,sess_key=None):
         """"
@@ -1,13 +1,19 @@
-from flask import Flask,request, json
-from flask_restx import Api, Resource, fields, reqparse
+from flask import Flask,request, json, Response, stream_with_context
+from flask_restx import Api, Resource, fields, reqparse, inputs
 from flask_sqlalchemy import SQLAlchemy 
+from sqlalchemy import text, tuple_, select, func, case, desc, literal_column, union_all
+import base64
 from dsbase.tools.logger import Logger
 from dsbase.tools.config_loader import ConfigLoader
-from datetime import datetime
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from dateutil.parser import parse as parse_datetime
 import os
 from flask_cors import CORS
+import uuid
+from jsonschema import Draft4Validator, RefResolver
+from dpem.event_writer import EventWriter
+from dpem.event_partitions import EventPartitions, epoch_us
+from dpam.tools.ttl_cache import TTLCache
 
 if "PYTHONPATH" not in os.environ.keys(): instance_path = os.path.join(os.getcwd(), "instance")
 else:  instance_path = os.path.join(os.environ["PYTHONPATH"], "instance")
@@ -39,6 +45,8 @@ class UnifiedEvent(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.String, nullable=False)
+    # epoch microseconds of timestamp, the time filters and the ordering use it (the text mixes utc offsets)
+    ts_us = db.Column(db.BigInteger)
     event_type = db.Column(db.String, nullable=False)
     actor = db.Column(db.Text)
     target = db.Column(db.Text)
@@ -61,6 +69,43 @@ class UnifiedEvent(db.Model):
     # Feedback
     related_event_id = db.Column(db.Integer)
     comment = db.Column(db.Text)     
+
+    # Promoted from the actor/target JSON, set by build_event_row and backfilled by migrate_db
+    actor_user_ad = db.Column(db.String)
+    actor_clientid = db.Column(db.String)
+    target_service = db.Column(db.String)
+    target_resource = db.Column(db.String)
+
+    __table_args__ = (
+        db.Index("ix_events_actor_user_ad", "actor_user_ad", "timestamp"),
+        db.Index("ix_events_actor_clientid", "actor_clientid"),
+        db.Index("ix_events_target_service", "target_service"),
+        db.Index("ix_events_target_resource", "target_resource"),
+        db.Index("ix_events_ts_us_id", "ts_us", "id"),
+    )
+
+
+class EventRollup(db.Model):
+    """
+    hourly counters of the log events removed by the retention job (dpem.event_maintenance)
+    """
+    __tablename__ = 'event_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # epoch microseconds of the start of the hour
+    hour_us = db.Column(db.BigInteger, nullable=False)
+    actor_user_ad = db.Column(db.String, nullable=False, default="")
+    target_service = db.Column(db.String, nullable=False, default="")
+    action = db.Column(db.String, nullable=False, default="")
+    outcome = db.Column(db.String, nullable=False, default="")
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("hour_us", "actor_user_ad", "target_service", "action", "outcome", name="uq_event_rollups_key"),
+    )
+
+# monthly partitions of the events table and the router of the time-bounded queries
+event_partitions = EventPartitions(db, UnifiedEvent, tz)
         
 # JSON models for documentation
 actor_model = event_api.model('Actor', {
@@ -116,55 +161,302 @@ feedback_event_model = event_api.inherit("FeedbackEvent", log_event_model, {
 parser = reqparse.RequestParser()
 parser.add_argument('event_type', type=str, required=False)
 parser.add_argument('user_ad', type=str, required=False, help='User AD in actor.user_ad')
+parser.add_argument('clientid', type=str, required=False, help='Client id in actor.clientid')
+parser.add_argument('service', type=str, required=False, help='Service in target.service')
+parser.add_argument('resource', type=str, required=False, help='Resource in target.resource')
 parser.add_argument('start', type=str, required=False, help='Start timestamp (inclusive)')
 parser.add_argument('end', type=str, required=False, help='End timestamp (inclusive)')
+parser.add_argument('limit', type=int, required=False, help='Page size, the events are ordered by time and id and next_cursor is returned')
+parser.add_argument('cursor', type=str, required=False, help='next_cursor of the previous page')
+parser.add_argument('format', type=str, required=False, choices=('json', 'ndjson'), default='json',
+                    help='ndjson streams one event per line')
 
 @event_api.route('/events')
 class EventList(Resource):
     @event_api.expect(parser)
     def get(self):
         """
-        Retrieve events with optional filtering by event_type, user_ad, timestamp duration
+        Retrieve events with optional filtering by event_type, user_ad, clientid, service, resource, timestamp duration.
+        With limit (or cursor) a page ordered by (ts_us, id) and the next_cursor are returned, the monthly
+        partitions overlapping start/end are queried with the events table.
+        format=ndjson streams the events without building the whole response.
         """
         args = parser.parse_args()
-        query = UnifiedEvent.query
+        try:
+            start_us = epoch_us(args['start'], tz)
+            end_us = epoch_us(args['end'], tz)
+        except (ValueError, OverflowError) as e:
+            return {"error": f"Invalid start/end : {str(e)}"}, 400
+        source = event_partitions.source(start_us, end_us)
+        query = db.session.query(source)
         
         if args['event_type']:
-            query = query.filter_by(event_type=args['event_type'])
+            query = query.filter(source.event_type == args['event_type'])
         if args['user_ad']:
-            query = query.filter(UnifiedEvent.actor.like(f'%"user_ad": "{args["user_ad"]}"%'))
-        if args['start']:
-            start_dt = parse_datetime(args['start'])
-            query = query.filter(UnifiedEvent.timestamp >= start_dt)
-        if args['end']:
-            end_dt = parse_datetime(args['end'])
-            query = query.filter(UnifiedEvent.timestamp <= end_dt)
-        
-        # events = UnifiedEvent.query.all()
+            query = query.filter(source.actor_user_ad == args['user_ad'])
+        if args['clientid']:
+            query = query.filter(source.actor_clientid == args['clientid'])
+        if args['service']:
+            query = query.filter(source.target_service == args['service'])
+        if args['resource']:
+            query = query.filter(source.target_resource == args['resource'])
+        if start_us is not None:
+            query = query.filter(source.ts_us >= start_us)
+        if end_us is not None:
+            query = query.filter(source.ts_us <= end_us)
+
+        paged = args['limit'] is not None or args['cursor'] is not None
+        if paged or args['format'] == 'ndjson':
+            try:
+                query = keyset_page(query, source, args['cursor'], args['limit'])
+            except ValueError as e:
+                return {"error": str(e)}, 400
+
+        if args['format'] == 'ndjson':
+            return Response(stream_with_context(json.dumps(event_to_dict(e), ensure_ascii=False) + "\n"
+                                                for e in query.yield_per(1000)),
+                            mimetype="application/x-ndjson")
+
         events = query.all()
-        return {
-            "events":
-            [
-                {
-                    'id': e.id,
-                    'event_type': e.event_type,
-                    'timestamp': e.timestamp,
-                    'actor': json.loads(e.actor or "{}"),
-                    'target': json.loads(e.target or "{}"),
-                    'action': e.action,
-                    'outcome': e.outcome,
-                    'context': json.loads(e.context or "{}"),
-                    'metadata': json.loads(e._metadata or "{}"),
-                    'log_level': e.log_level,
-                    'severity': e.severity,
-                    'critical': e.critical,
-                    'status': e.status,
-                    'related_issue_id': e.related_issue_id,
-                    'related_alert_id': e.related_alert_id,
-                    'comment': e.comment,
-                    'related_event_id': e.related_event_id
-                } for e in events
-            ]}, 200
+        response = {"events": [event_to_dict(e) for e in events]}
+        if paged: response["next_cursor"] = encode_cursor(events[-1]) if args['limit'] and len(events) == args['limit'] else None
+        return response, 200
+
+
+def event_to_dict(e):
+    return {
+        'id': e.id,
+        'event_type': e.event_type,
+        'timestamp': e.timestamp,
+        'actor': json.loads(e.actor or "{}"),
+        'target': json.loads(e.target or "{}"),
+        'action': e.action,
+        'outcome': e.outcome,
+        'context': json.loads(e.context or "{}"),
+        'metadata': json.loads(e._metadata or "{}"),
+        'log_level': e.log_level,
+        'severity': e.severity,
+        'critical': e.critical,
+        'status': e.status,
+        'related_issue_id': e.related_issue_id,
+        'related_alert_id': e.related_alert_id,
+        'comment': e.comment,
+        'related_event_id': e.related_event_id
+    }
+
+
+def encode_cursor(event):
+    return base64.urlsafe_b64encode(json.dumps([event.ts_us, event.id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        ts_us, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return int(ts_us), int(id)
+    except Exception:
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def keyset_page(query, source=UnifiedEvent, cursor=None, limit=None):
+    """
+    Events after the cursor ordered by (ts_us, id), served by the ix_events_ts_us_id index (of each partition)
+    """
+    if cursor:
+        ts_us, id = decode_cursor(cursor)
+        query = query.filter(tuple_(source.ts_us, source.id) > tuple_(ts_us, id))
+    query = query.order_by(source.ts_us, source.id)
+    if limit is not None:
+        if limit <= 0: raise ValueError(f"Invalid limit {limit}")
+        query = query.limit(limit)
+    return query
+
+
+# Aggregations, computed in sql over the events (hot table and the partitions of the time range) and the
+# event_rollups of the expired log events
+stats_columns = ("event_type", "action", "outcome", "actor_user_ad", "actor_clientid", "target_service",
+                 "target_resource", "log_level", "severity")
+rollup_columns = ("actor_user_ad", "target_service", "action", "outcome")
+stats_buckets = {"hour": 3600 * 1000000, "day": 86400 * 1000000}
+stats_filters = {"event_type": "event_type", "user_ad": "actor_user_ad", "clientid": "actor_clientid",
+                 "service": "target_service", "resource": "target_resource"}
+
+stats_parser = reqparse.RequestParser()
+for name in stats_filters:
+    stats_parser.add_argument(name, type=str, required=False)
+stats_parser.add_argument('start', type=str, required=False, help='Start timestamp (inclusive)')
+stats_parser.add_argument('end', type=str, required=False, help='End timestamp (inclusive)')
+stats_parser.add_argument('rollups', type=inputs.boolean, default=True,
+                          help='Add the hourly counters of the expired log events when the filters and groups allow it')
+
+counts_parser = stats_parser.copy()
+counts_parser.add_argument('group_by', type=str, required=True, help=f'Comma separated columns of {", ".join(stats_columns)}')
+histogram_parser = stats_parser.copy()
+histogram_parser.add_argument('bucket', type=str, choices=tuple(stats_buckets), default='hour')
+error_rate_parser = counts_parser.copy()
+error_rate_parser.add_argument('error_outcome', type=str, default='failure', help='Outcome counted as an error')
+top_parser = stats_parser.copy()
+top_parser.add_argument('by', type=str, choices=stats_columns, default='actor_user_ad')
+top_parser.add_argument('n', type=int, default=10)
+
+_stats_cache = TTLCache(int(app.config.get("EVENT_STATS_CACHE_SIZE", 1024)), int(app.config.get("EVENT_STATS_LIVE_TTL", 30)))
+
+
+def cached_stats(kind, args, compute):
+    """
+    Result of compute(args) cached by the query, a range that has ended keeps its result EVENT_STATS_CLOSED_TTL
+    seconds and an open one (no end, or end in the future) EVENT_STATS_LIVE_TTL seconds.
+    start/end are first widened to the boundaries of snap_range, the key and the query use the same range.
+    """
+    try:
+        args, end_us = snap_range(args)
+    except (ValueError, OverflowError) as e:
+        return {"error": f"Invalid start/end : {str(e)}"}, 400
+    key = (kind,) + tuple(sorted((name, value) for name, value in args.items() if value is not None))
+    result = _stats_cache.get(key)
+    if result is not None: return result, 200
+    try:
+        result = compute(args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    closed = end_us is not None and end_us < epoch_us(datetime.now(tz))
+    _stats_cache.set(key, result, int(app.config.get("EVENT_STATS_CLOSED_TTL", 3600)) if closed else None)
+    return result, 200
+
+
+def snap_range(args):
+    """
+    (args, end_us) with start floored and the inclusive end ceiled to the bucket of a histogram, or to
+    EVENT_STATS_SNAP_SECONDS, so the requests of a rolling range (start=now-24h) within a step get the same key
+    """
+    bucket = args.get("bucket")
+    size = stats_buckets[bucket] if bucket in stats_buckets else int(app.config.get("EVENT_STATS_SNAP_SECONDS", 60)) * 1000000
+    offset = bucket_offset(bucket)
+    start_us, end_us = epoch_us(args.get("start"), tz), epoch_us(args.get("end"), tz)
+    args = dict(args)
+    if size > 0 and start_us is not None:
+        args["start"] = _epoch_us_isoformat((start_us + offset) // size * size - offset)
+    if size > 0 and end_us is not None:
+        end_us = -(-(end_us + offset + 1) // size) * size - offset - 1
+        args["end"] = _epoch_us_isoformat(end_us)
+    return args, end_us
+
+
+def bucket_offset(bucket):
+    # 以tz的時差對齊日界
+    return epoch_us(datetime(1970, 1, 1)) - epoch_us(datetime(1970, 1, 1), tz) if bucket == "day" else 0
+
+
+def _epoch_us_isoformat(value):
+    return (datetime.fromtimestamp(0, tz) + timedelta(microseconds=value)).isoformat()
+
+
+def event_stats(args, keys, error_outcome=None, top=None):
+    """
+    Rows of the keys (label -> function(columns, ts) of the group expression) with count, and failures when
+    error_outcome is given, ordered by the keys or by the count when top is given
+    """
+    start_us, end_us = epoch_us(args.get("start"), tz), epoch_us(args.get("end"), tz)
+    filters = {stats_filters[name]: args[name] for name in stats_filters if args.get(name)}
+    source = event_partitions.source(start_us, end_us)
+    columns = {name: getattr(source, name) for name in stats_columns}
+    parts = [_stats_select(columns, source.ts_us, literal_column("1"), keys, filters, start_us, end_us, error_outcome)]
+
+    # 過期的log事件只剩event_rollups的小時計數，條件與分組都在其欄位內時才併入
+    rollup_filters = dict(filters)
+    if rollup_filters.get("event_type") == "log": del rollup_filters["event_type"]
+    if args.get("rollups", True) and set(rollup_filters) <= set(rollup_columns) and set(keys) <= set(rollup_columns) | {"bucket"}:
+        table = EventRollup.__table__
+        parts.append(_stats_select({name: table.c[name] for name in rollup_columns}, table.c.hour_us, table.c.count,
+                                   keys, rollup_filters, start_us, end_us, error_outcome))
+
+    if len(parts) == 1:
+        query = parts[0]
+        labels = [literal_column(label) for label in keys]
+    else:
+        union = union_all(*parts).subquery()
+        labels = [union.c[label] for label in keys]
+        aggregates = [func.sum(union.c.n).label("n")] + ([func.sum(union.c.failures).label("failures")] if error_outcome else [])
+        query = select(*labels, *aggregates).group_by(*labels)
+    query = query.order_by(desc("n")).limit(top) if top else query.order_by(*labels)
+    return [dict(row) for row in db.session.execute(query).mappings()]
+
+
+def _stats_select(columns, ts, weight, keys, filters, start_us, end_us, error_outcome):
+    groups = [key(columns, ts).label(label) for label, key in keys.items()]
+    conditions = [columns[name] == value for name, value in filters.items()]
+    if start_us is not None: conditions.append(ts >= start_us)
+    if end_us is not None: conditions.append(ts <= end_us)
+    aggregates = [func.sum(weight).label("n")]
+    if error_outcome: aggregates.append(func.sum(case((columns["outcome"] == error_outcome, weight), else_=0)).label("failures"))
+    return select(*groups, *aggregates).where(*conditions).group_by(*groups)
+
+
+def group_keys(group_by):
+    names = [name.strip() for name in (group_by or "").split(",") if name.strip()]
+    invalid = [name for name in names if name not in stats_columns]
+    if len(names) == 0 or invalid:
+        raise ValueError(f"Invalid group_by {group_by}, valid columns are: {list(stats_columns)}")
+    return {name: (lambda columns, ts, name=name: columns[name]) for name in names}
+
+
+def stats_counts(args):
+    rows = event_stats(args, group_keys(args["group_by"]))
+    return {"rows": [dict(row, count=row.pop("n")) for row in rows]}
+
+
+def stats_histogram(args):
+    size = stats_buckets[args["bucket"]]
+    offset = bucket_offset(args["bucket"])
+    rows = event_stats(args, {"bucket": lambda columns, ts: (ts + offset) // size * size - offset})
+    return {"bucket": args["bucket"],
+            "rows": [{"bucket_start": datetime.fromtimestamp(row["bucket"] / 1000000, tz).isoformat(), "ts_us": row["bucket"],
+                      "count": row["n"]} for row in rows]}
+
+
+def stats_error_rate(args):
+    rows = event_stats(args, group_keys(args["group_by"]), error_outcome=args["error_outcome"])
+    for row in rows:
+        row["count"], row["failures"] = row.pop("n"), row["failures"] or 0
+        row["error_rate"] = row["failures"] / row["count"] if row["count"] else None
+    return {"error_outcome": args["error_outcome"], "rows": rows}
+
+
+def stats_top(args):
+    if args["n"] <= 0: raise ValueError(f"Invalid n {args['n']}")
+    rows = event_stats(args, group_keys(args["by"]), top=args["n"])
+    return {"by": args["by"], "rows": [dict(row, count=row.pop("n")) for row in rows]}
+
+
+@event_api.route('/events/stats/counts')
+class EventStatsCounts(Resource):
+    @event_api.expect(counts_parser)
+    def get(self):
+        """Event counts grouped by the group_by columns"""
+        return cached_stats("counts", counts_parser.parse_args(), stats_counts)
+
+
+@event_api.route('/events/stats/histogram')
+class EventStatsHistogram(Resource):
+    @event_api.expect(histogram_parser)
+    def get(self):
+        """Event counts per hour or day (days of the api timezone)"""
+        return cached_stats("histogram", histogram_parser.parse_args(), stats_histogram)
+
+
+@event_api.route('/events/stats/error_rate')
+class EventStatsErrorRate(Resource):
+    @event_api.expect(error_rate_parser)
+    def get(self):
+        """Share of the events with the error_outcome, grouped by the group_by columns"""
+        return cached_stats("error_rate", error_rate_parser.parse_args(), stats_error_rate)
+
+
+@event_api.route('/events/stats/top')
+class EventStatsTop(Resource):
+    @event_api.expect(top_parser)
+    def get(self):
+        """The n values of a column with the most events, actors by default"""
+        return cached_stats("top", top_parser.parse_args(), stats_top)
 
 
 @event_api.route('/log')
@@ -207,50 +499,181 @@ class FeedbackEvent(Resource):
         return save_event(request.json, "feedback")
 
     
+@event_api.route('/events/batch')
+class EventBatch(Resource):
+    @event_api.doc(description="NDJSON (one event per line) or a JSON array of events of any type, each event is "
+                               "validated against the model of its event_type and the valid ones are inserted in one transaction")
+    def post(self):
+        """Log many structured events in one request"""
+        items = parse_event_batch(request.get_data(as_text=True), request.mimetype)
+        if len(items) == 0:
+            return {"error": "The batch has no events"}, 400
+        max_items = int(app.config.get("EVENT_BATCH_MAX_ITEMS", 10000))
+        if len(items) > max_items:
+            return {"error": f"A batch has at most {max_items} events, {len(items)} are given"}, 413
+        return save_events(items)
+
+
+event_models = {"log": log_event_model, "issue": issue_event_model, "alert": alert_event_model,
+                "incident": incident_event_model, "feedback": feedback_event_model}
+_event_validators = {}
+
+def event_validator(event_type):
+    """
+    jsonschema validator of the flask_restx model of the event type, the $ref of nested and inherited models are
+    resolved against all the models of event_api
+    """
+    if event_type not in _event_validators:
+        definitions = {"definitions": {name: model.__schema__ for name, model in event_api.models.items()}}
+        _event_validators[event_type] = Draft4Validator(event_models[event_type].__schema__,
+                                                        resolver=RefResolver.from_schema(definitions))
+    return _event_validators[event_type]
+
+
+def parse_event_batch(text, mimetype=None):
+    """
+    [(item, error)] of a JSON array or NDJSON body, error is None when the item is parsed
+    """
+    stripped = text.lstrip()
+    if stripped.startswith("[") and mimetype != "application/x-ndjson":
+        try:
+            items = json.loads(stripped)
+        except ValueError as e:
+            return [(None, f"Invalid JSON array: {e}")]
+        return [(item, None) for item in items]
+
+    items = []
+    for line in text.splitlines():
+        if line.strip() == "": continue
+        try:
+            items.append((json.loads(line), None))
+        except ValueError as e:
+            items.append((None, f"Invalid JSON: {e}"))
+    return items
+
+
+def validate_event(item):
+    """
+    (event_type, None) of a valid event or (event_type, error message)
+    """
+    if not isinstance(item, dict): return None, "Event is not a JSON object"
+    event_type = item.get("event_type") or "log"
+    if event_type not in event_models:
+        return event_type, f"Invalid event_type {event_type}, valid types are: {list(event_models)}"
+    errors = [f"{'.'.join(str(p) for p in e.path) or 'event'}: {e.message}" for e in event_validator(event_type).iter_errors(dict(item, event_type=event_type))]
+    return event_type, "; ".join(errors) if errors else None
+
+
+def save_events(items):
+    """
+    Insert the valid events of [(item, parse error)] by bulk_insert_mappings in one transaction,
+    the result has the id and uid (or the error) of each item in the given order
+    """
+    results = []
+    rows = []
+    for index, (item, error) in enumerate(items):
+        event_type = None
+        if error is None: event_type, error = validate_event(item)
+        if error is None:
+            uid = uuid.uuid4().hex
+            try:
+                rows.append(build_event_row(item, event_type, uid))
+                results.append({"index": index, "event_type": event_type, "uid": uid})
+                continue
+            except ValueError as e:
+                error = str(e)
+        results.append({"index": index, "event_type": event_type, "error": error})
+
+    if len(rows) > 0:
+        try:
+            db.session.bulk_insert_mappings(UnifiedEvent, rows, return_defaults=True)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            Logger.log(f"Event batch of {len(rows)} events failed: {e}")
+            return {"error": str(e), "inserted": 0, "results": results}, 500
+        ids = iter(row["id"] for row in rows)
+        for result in results:
+            if "error" not in result: result["id"] = next(ids)
+
+    inserted = len(rows)
+    status = 201 if inserted == len(results) else 207 if inserted > 0 else 400
+    return {"inserted": inserted, "errors": len(results) - inserted, "results": results}, status
+
+
+def build_event_row(data, event_type, uid=None):
+    """
+    Column values of an event, the nested fields are serialized once here. ValueError if a field cannot be serialized.
+    uid is kept in _metadata.event_uid, it identifies an event before its row id is known (buffered mode)
+    """
+    row = {}
+    for field in ("actor", "target", "context", "_metadata"):
+        value = data.get(field) or {}
+        if field == "_metadata" and uid is not None and isinstance(value, dict): value = dict(value, event_uid=uid)
+        try:
+            row[field] = json.dumps(value, ensure_ascii=False)
+        except Exception as e:
+            Logger.log(f"Failed to serialize {field}")
+            raise ValueError(f"Invalid {field} field : {str(e)}")
+
+    now = datetime.now(tz)
+    actor = data.get("actor") if isinstance(data.get("actor"), dict) else {}
+    target = data.get("target") if isinstance(data.get("target"), dict) else {}
+    row.update(
+        actor_user_ad = actor.get("user_ad"),
+        actor_clientid = actor.get("clientid"),
+        target_service = target.get("service"),
+        target_resource = target.get("resource"),
+        event_type = event_type,
+        timestamp = now.isoformat(),
+        ts_us = epoch_us(now),
+        action = data.get("action"),
+        outcome = data.get("outcome"),
+        log_level = data.get("log_level"),
+        severity = data.get("severity"),
+        critical = data.get("critical"),
+        status = data.get("status"),
+        related_issue_id = data.get("related_issue_id"),
+        related_alert_id = data.get("related_alert_id"),
+        comment = data.get("comment"),
+        related_event_id = data.get("related_event_id"))
+    return row
+
+
+_event_writer = None
+
+def get_event_writer():
+    """
+    EventWriter of the buffered mode, None unless EVENT_BUFFERED is set in flask.cfg
+    (EVENT_BATCH_SIZE, EVENT_FLUSH_SECONDS and EVENT_QUEUE_SIZE tune it)
+    """
+    global _event_writer
+    if not app.config.get("EVENT_BUFFERED", False): return None
+    if _event_writer is None:
+        _event_writer = EventWriter(app, db, UnifiedEvent.__table__,
+                                    batch_size=int(app.config.get("EVENT_BATCH_SIZE", 200)),
+                                    flush_seconds=float(app.config.get("EVENT_FLUSH_SECONDS", 0.5)),
+                                    queue_size=int(app.config.get("EVENT_QUEUE_SIZE", 10000)))
+    return _event_writer
+
+
 def save_event(data, event_type):
+    uid = uuid.uuid4().hex
     try:
-        actor =  json.dumps(data.get("actor", {}), ensure_ascii=False)
-    except Exception as e:
-        Logger.log("Failed to serialize actor")
-        return {"error": f"Invalid actor field : {str(e)}"}, 400
-    try:
-        target =  json.dumps(data.get("target", {}), ensure_ascii=False)
-    except Exception as e:
-        Logger.log("Failed to serialize target")
-        return {"error": f"Invalid target field : {str(e)}"}, 400    
-    try:
-        context =  json.dumps(data.get("context", {}), ensure_ascii=False)
-    except Exception as e:
-        Logger.log("Failed to serialize context")
-        return {"error": f"Invalid context field : {str(e)}"}, 400   
-    try:
-        _metadat =  json.dumps(data.get("_metadata", {}), ensure_ascii=False)
-    except Exception as e:
-        Logger.log("Failed to serialize _metadata")
-        return {"error": f"Invalid _metadata field : {str(e)}"}, 400
-    
+        row = build_event_row(data, event_type, uid)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # buffered mode: the event is written by the EventWriter thread, a full queue falls back to a direct write
+    writer = get_event_writer()
+    if writer is not None and writer.put(row):
+        return {"message":f"{event_type.capitalize()} event accepted", "uid": uid}, 202
+
     try:
-        event = UnifiedEvent(
-            event_type = event_type,
-            timestamp = datetime.now(tz).isoformat(),
-            actor = actor,
-            target = target,
-            action = data.get("action"),
-            outcome = data.get("outcome"),
-            context = context,
-            _metadata = _metadat,
-            log_level = data.get("log_level"),
-            severity = data.get("severity"),
-            critical = data.get("critical"),
-            status = data.get("status"),
-            related_issue_id = data.get("related_issue_id"),
-            related_alert_id = data.get("related_alert_id"),
-            comment = data.get("comment"),
-            related_event_id = data.get("related_event_id")
-        )
+        event = UnifiedEvent(**row)
         db.session.add(event)
         db.session.commit()
-        return {"message":f"{event_type.capitalize()} event logged", "id": event.id}, 201
+        return {"message":f"{event_type.capitalize()} event logged", "id": event.id, "uid": uid}, 201
     except Exception as e:
         db.session.rollback()
         return {"error": str(e)}, 400
@@ -258,6 +681,65 @@ def save_event(data, event_type):
 def create_db():
     with app.app_context():
         db.create_all()
+    migrate_db()
+
+
+# column -> (JSON column, path) of the promoted columns
+promoted_columns = {"actor_user_ad": ("actor", "$.user_ad"), "actor_clientid": ("actor", "$.clientid"),
+                    "target_service": ("target", "$.service"), "target_resource": ("target", "$.resource")}
+
+def migrate_db(backfill=None, batch_size=5000):
+    """
+    Add the promoted actor/target columns, ts_us and the indexes to an existing events table and backfill the
+    columns from the JSON text and the timestamp in batches of rows. backfill=None backfills only when a column
+    has just been added.
+    """
+    with app.app_context():
+        existing = {row[1] for row in db.session.execute(text("PRAGMA table_info(events)"))}
+        added = [column for column in promoted_columns if column not in existing]
+        for column in added:
+            db.session.execute(text(f"ALTER TABLE events ADD COLUMN {column} VARCHAR"))
+        if "ts_us" not in existing:
+            db.session.execute(text("ALTER TABLE events ADD COLUMN ts_us BIGINT"))
+            added.append("ts_us")
+        for index in UnifiedEvent.__table__.indexes:
+            index.create(bind=db.session.connection(), checkfirst=True)
+        db.session.commit()
+        if backfill is None: backfill = len(added) > 0
+        if not backfill: return 0
+
+        # json_valid避免一筆格式錯誤的資料讓整批update失敗
+        assignments = ", ".join(f"{column} = CASE WHEN json_valid({source}) THEN json_extract({source}, '{path}') END"
+                                for column, (source, path) in promoted_columns.items())
+        max_id = db.session.execute(text("SELECT MAX(id) FROM events")).scalar() or 0
+        for start in range(0, max_id, batch_size):
+            db.session.execute(text(f"UPDATE events SET {assignments} WHERE id > :start AND id <= :end"),
+                               {"start": start, "end": start + batch_size})
+            db.session.commit()
+        backfill_ts_us(batch_size)
+        Logger.log(f"events backfilled {', '.join(promoted_columns)}, ts_us up to id {max_id}")
+        return max_id
+
+
+def backfill_ts_us(batch_size=5000):
+    """
+    ts_us of the rows written before the column existed, the offset in the timestamp text is honoured
+    and a timestamp without one is taken in the api timezone
+    """
+    last_id = 0
+    while True:
+        rows = db.session.execute(text("SELECT id, timestamp FROM events WHERE id > :last_id AND ts_us IS NULL ORDER BY id LIMIT :limit"),
+                                  {"last_id": last_id, "limit": batch_size}).fetchall()
+        if len(rows) == 0: break
+        values = []
+        for id, timestamp in rows:
+            try:
+                values.append({"id": id, "ts_us": epoch_us(timestamp, tz)})
+            except (ValueError, OverflowError):
+                Logger.log(f"event {id} has an invalid timestamp {timestamp}")
+        if len(values) > 0: db.session.execute(text("UPDATE events SET ts_us = :ts_us WHERE id = :id"), values)
+        db.session.commit()
+        last_id = rows[-1][0]
 
 if __name__ == '__main__':    
     app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,194 @@
+"""
+Retention job of the events database, to be scheduled (cron / CronJob) next to the api:
+
+    python -m dpem.event_maintenance --days 90 --archive-folder /app/ext/event_archive
+
+The log events older than --days are written to a compressed archive (parquet when pyarrow is installed, else
+ndjson.gz), counted into the hourly event_rollups and deleted, --batch-size rows per transaction so the api
+writers only wait for one batch. Emptied partitions are dropped and the freed pages are returned to the file
+system by an incremental vacuum.
+"""
+import gzip
+import importlib.util
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.dialects.sqlite import insert
+from dsbase.tools.logger import Logger
+from dpem.event_api import app, db, tz, UnifiedEvent, EventRollup, event_partitions, create_db
+from dpem.event_partitions import epoch_us
+
+_hour_us = 3600 * 1000000
+
+
+class NdjsonArchive:
+    """
+    gzip compressed NDJSON, one event row per line
+    """
+    suffix = ".ndjson.gz"
+
+    def __init__(self, path, columns):
+        self.path = path
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, rows):
+        for row in rows: self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetArchive:
+    """
+    zstd compressed parquet, one row group per batch, the schema follows the column types of the events table
+    """
+    suffix = ".parquet"
+
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        types = {"INTEGER": pa.int64(), "BIGINT": pa.int64(), "BOOLEAN": pa.bool_()}
+        self.path = path
+        self._pa = pa
+        self._schema = pa.schema([(c.name, types.get(str(c.type), pa.string())) for c in columns])
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, rows):
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def open_archive(folder, cutoff_us, archive_format="auto"):
+    """
+    Archive writer of a run, archive_format is parquet, ndjson or auto (parquet when pyarrow is installed)
+    """
+    if archive_format == "auto":
+        # pyarrow.parquet的find_spec會匯入pyarrow，先確認pyarrow已安裝
+        found = importlib.util.find_spec("pyarrow") is not None and importlib.util.find_spec("pyarrow.parquet") is not None
+        archive_format = "parquet" if found else "ndjson"
+    archive_class = {"parquet": ParquetArchive, "ndjson": NdjsonArchive}[archive_format]
+    os.makedirs(folder, exist_ok=True)
+    cutoff = datetime.fromtimestamp(cutoff_us / 1000000, tz).strftime("%Y%m%d")
+    name = f"events_before_{cutoff}_{datetime.now(tz).strftime('%Y%m%d%H%M%S')}{archive_class.suffix}"
+    return archive_class(os.path.join(folder, name), UnifiedEvent.__table__.columns)
+
+
+def rollup(rows):
+    """
+    Add the rows to the hourly counters
+    """
+    counts = Counter(((row["ts_us"] // _hour_us) * _hour_us, row["actor_user_ad"] or "", row["target_service"] or "",
+                      row["action"] or "", row["outcome"] or "") for row in rows)
+    values = [{"hour_us": key[0], "actor_user_ad": key[1], "target_service": key[2], "action": key[3],
+               "outcome": key[4], "count": count} for key, count in counts.items()]
+    statement = insert(EventRollup.__table__)
+    db.session.execute(statement.on_conflict_do_update(index_elements=["hour_us", "actor_user_ad", "target_service", "action", "outcome"],
+                                                       set_={"count": EventRollup.__table__.c.count + statement.excluded.count}), values)
+
+
+def expire_table(table, cutoff_us, archive=None, batch_size=2000, pause_seconds=0.05, keep_max_id=False):
+    """
+    Archive, roll up and delete the log events of table older than cutoff_us, batch_size rows per transaction.
+    keep_max_id keeps the row of the highest id (the hot table, sqlite would otherwise give its id again).
+    """
+    condition = (table.c.event_type == "log") & (table.c.ts_us < cutoff_us)
+    if keep_max_id:
+        max_id = db.session.execute(select(db.func.max(table.c.id))).scalar() or 0
+        condition = condition & (table.c.id < max_id)
+    removed = 0
+    while True:
+        rows = [dict(row) for row in db.session.execute(select(table).where(condition).order_by(table.c.id).limit(batch_size)).mappings()]
+        if len(rows) == 0: break
+        if archive is not None: archive.write(rows)
+        rollup(rows)
+        db.session.execute(delete(table).where(table.c.id.in_(bindparam("ids", expanding=True))), {"ids": [row["id"] for row in rows]})
+        db.session.commit()
+        removed += len(rows)
+        # 每批之間釋放write lock讓api寫入
+        if pause_seconds: time.sleep(pause_seconds)
+    return removed
+
+
+def incremental_vacuum(pages=None, enable=False):
+    """
+    Return up to pages free pages (all when None) to the file system. auto_vacuum=INCREMENTAL is a property of the
+    file, enable=True converts a database created without it by a full VACUUM (blocks the writers while it runs).
+    """
+    with db.engine.connect() as connection:
+        mode = connection.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        if mode != 2:
+            if not enable:
+                Logger.log("events.db is not in auto_vacuum=INCREMENTAL mode, run with --enable-incremental-vacuum once")
+                return 0
+            connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.exec_driver_sql("VACUUM")
+        free = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        connection.commit()
+        # incremental_vacuum每執行一步只釋放一頁，executescript才會把pragma執行完
+        connection.connection.driver_connection.executescript(
+            "PRAGMA incremental_vacuum;" if pages is None else f"PRAGMA incremental_vacuum({int(pages)});")
+        freed = free - connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        connection.commit()
+    return freed
+
+
+def run(days=None, batch_size=None, archive_folder=None, archive_format="auto", archive=True, vacuum_pages=None,
+        enable_incremental_vacuum=False, pause_seconds=0.05, now=None):
+    """
+    One retention run over the hot table and the partitions, the defaults come from flask.cfg
+    (EVENT_RETENTION_DAYS, EVENT_MAINTENANCE_BATCH_SIZE, EVENT_ARCHIVE_FOLDER). Returns the counts of the run.
+    """
+    days = days if days is not None else int(app.config.get("EVENT_RETENTION_DAYS", 90))
+    batch_size = batch_size or int(app.config.get("EVENT_MAINTENANCE_BATCH_SIZE", 2000))
+    archive_folder = archive_folder or app.config.get("EVENT_ARCHIVE_FOLDER") or os.path.join(app.instance_path, "archive")
+    cutoff_us = epoch_us((now or datetime.now(tz)) - timedelta(days=days))
+    result = {"cutoff_us": cutoff_us, "removed": 0, "dropped_partitions": [], "archive": None}
+
+    with app.app_context():
+        writer = open_archive(archive_folder, cutoff_us, archive_format) if archive else None
+        try:
+            result["removed"] += expire_table(UnifiedEvent.__table__, cutoff_us, writer, batch_size, pause_seconds, keep_max_id=True)
+            for name in event_partitions.select_names(end_us=cutoff_us):
+                table = event_partitions.table(name)
+                result["removed"] += expire_table(table, cutoff_us, writer, batch_size, pause_seconds)
+                if db.session.execute(select(db.func.count()).select_from(table)).scalar() == 0:
+                    table.drop(bind=db.session.connection())
+                    db.session.commit()
+                    result["dropped_partitions"].append(name)
+        finally:
+            if writer is not None: writer.close()
+        if writer is not None:
+            if result["removed"] > 0: result["archive"] = writer.path
+            else: os.remove(writer.path)
+        result["vacuumed_pages"] = incremental_vacuum(vacuum_pages, enable_incremental_vacuum)
+
+    Logger.log(f"event maintenance: {result}")
+    return result
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, help="retention of the raw log events (EVENT_RETENTION_DAYS)")
+    parser.add_argument("--batch-size", type=int, help="rows per transaction (EVENT_MAINTENANCE_BATCH_SIZE)")
+    parser.add_argument("--archive-folder", help="EVENT_ARCHIVE_FOLDER, default <instance>/archive")
+    parser.add_argument("--archive-format", choices=("auto", "parquet", "ndjson"), default="auto")
+    parser.add_argument("--no-archive", action="store_true", help="delete without writing an archive")
+    parser.add_argument("--vacuum-pages", type=int, help="pages returned by the incremental vacuum (default all)")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="convert events.db to auto_vacuum=INCREMENTAL by a full VACUUM (once)")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds between batches")
+    args = parser.parse_args(argv)
+
+    create_db()
+    print(json.dumps(run(args.days, args.batch_size, args.archive_folder, args.archive_format, not args.no_archive,
+                         args.vacuum_pages, args.enable_incremental_vacuum, args.pause)))
+
+
+if __name__ == "__main__":
+    main()
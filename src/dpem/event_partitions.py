@@ -0,0 +1,180 @@
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from dateutil.parser import parse as parse_datetime
+from sqlalchemy import Column, Index, MetaData, Table, bindparam, select, text, union_all
+from sqlalchemy.orm import aliased
+from dsbase.tools.logger import Logger
+
+_epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_partition_name = re.compile(r"^events_(\d{4})(\d{2})$")
+
+
+def epoch_us(value, tz=timezone.utc):
+    """
+    Epoch microseconds of a datetime or an ISO timestamp string, naive values are taken in tz
+    """
+    if value is None: return None
+    if isinstance(value, str): value = parse_datetime(value)
+    if value.tzinfo is None: value = value.replace(tzinfo=tz)
+    return (value - _epoch) // timedelta(microseconds=1)
+
+
+class EventPartitions:
+    """
+    Monthly partitions of the events table. The api writes to the hot table, rotate() moves the months older than
+    keep_months into events_YYYYMM tables (same columns) and archive() moves a partition table to its own sqlite file.
+    source(start_us, end_us) is the router: the model itself when no partition overlaps the time range, otherwise
+    the model aliased to a UNION ALL of the hot table and the overlapping partitions, sqlite pushes the filters
+    down into each of them so the ts_us indexes are used.
+    The months are those of tz, the timezone of the timestamps written by the api.
+    """
+
+    def __init__(self, db, model, tz=timezone.utc):
+        self.db = db
+        self.model = model
+        self.tz = tz
+        self._tables = {}
+
+
+    def names(self):
+        """
+        Partition table names in month order
+        """
+        rows = self.db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'events!_%' ESCAPE '!'"))
+        return sorted(row[0] for row in rows if _partition_name.match(row[0]))
+
+
+    def month_range(self, name):
+        """
+        [start_us, end_us) of a partition
+        """
+        year, month = (int(group) for group in _partition_name.match(name).groups())
+        start = datetime(year, month, 1, tzinfo=self.tz)
+        end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=self.tz)
+        return epoch_us(start), epoch_us(end)
+
+
+    def partition_name(self, ts_us):
+        dt = (_epoch + timedelta(microseconds=ts_us)).astimezone(self.tz)
+        return f"events_{dt.year:04d}{dt.month:02d}"
+
+
+    def table(self, name):
+        """
+        Table of a partition, with the columns of the model and its own ts_us/actor indexes
+        """
+        if name not in self._tables:
+            columns = [Column(c.name, c.type, primary_key=c.primary_key) for c in self.model.__table__.columns]
+            self._tables[name] = Table(name, MetaData(), *columns,
+                                       Index(f"ix_{name}_ts_us_id", "ts_us", "id"),
+                                       Index(f"ix_{name}_actor_user_ad", "actor_user_ad", "ts_us"))
+        return self._tables[name]
+
+
+    def select_names(self, start_us=None, end_us=None):
+        """
+        Partitions overlapping [start_us, end_us]
+        """
+        selected = []
+        for name in self.names():
+            lo, hi = self.month_range(name)
+            if (start_us is None or start_us < hi) and (end_us is None or end_us >= lo): selected.append(name)
+        return selected
+
+
+    def source(self, start_us=None, end_us=None):
+        """
+        Entity to query the events of a time range with, db.session.query(source)
+        """
+        names = self.select_names(start_us, end_us)
+        if len(names) == 0: return self.model
+        columns = [c.name for c in self.model.__table__.columns]
+        tables = [self.model.__table__] + [self.table(name) for name in names]
+        union = union_all(*[select(*[table.c[column] for column in columns]) for table in tables]).subquery("events_union")
+        return aliased(self.model, union, adapt_on_names=True)
+
+
+    def rotate(self, keep_months=1, batch_size=5000, now=None):
+        """
+        Move the hot table rows older than the last keep_months months (the current one included) to their
+        partitions, batch_size rows per transaction. Returns the number of moved rows.
+        """
+        now = (now or datetime.now(self.tz)).astimezone(self.tz)
+        month = now.year * 12 + now.month - 1 - (keep_months - 1)
+        cutoff = epoch_us(datetime(month // 12, month % 12 + 1, 1, tzinfo=self.tz))
+        hot = self.model.__table__.name
+        columns = ", ".join(c.name for c in self.model.__table__.columns)
+        # 保留最大的id在hot table，避免sqlite在table清空後重新使用已搬移的id
+        max_id = self.db.session.execute(text(f"SELECT MAX(id) FROM {hot}")).scalar() or 0
+        moved = 0
+        while True:
+            first = self.db.session.execute(text(f"SELECT MIN(ts_us) FROM {hot} WHERE ts_us < :cutoff AND id < :max_id"),
+                                            {"cutoff": cutoff, "max_id": max_id}).scalar()
+            if first is None: break
+            name = self.partition_name(first)
+            lo, hi = self.month_range(name)
+            self.table(name).create(bind=self.db.session.connection(), checkfirst=True)
+            while True:
+                ids = [row[0] for row in self.db.session.execute(
+                    text(f"SELECT id FROM {hot} WHERE ts_us >= :lo AND ts_us < :hi AND id < :max_id LIMIT :limit"),
+                    {"lo": lo, "hi": hi, "max_id": max_id, "limit": batch_size})]
+                if len(ids) == 0: break
+                params = {"ids": ids}
+                self.db.session.execute(text(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {hot} WHERE id IN :ids")
+                                        .bindparams(bindparam("ids", expanding=True)), params)
+                self.db.session.execute(text(f"DELETE FROM {hot} WHERE id IN :ids")
+                                        .bindparams(bindparam("ids", expanding=True)), params)
+                self.db.session.commit()
+                moved += len(ids)
+            Logger.log(f"events moved to {name}")
+        self.db.session.commit()
+        return moved
+
+
+    def archive(self, name, folder):
+        """
+        Move a partition table to folder/<name>.db (ATTACH it to query the archived month) and drop it
+        """
+        if not _partition_name.match(name): raise ValueError(f"Invalid partition {name}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{name}.db")
+        if os.path.exists(path): raise ValueError(f"{path} already exists")
+        self.db.session.commit()
+        with self.db.engine.connect() as connection:
+            connection.exec_driver_sql("ATTACH DATABASE ? AS archive", (path,))
+            try:
+                connection.exec_driver_sql(f"CREATE TABLE archive.{name} AS SELECT * FROM main.{name}")
+                connection.commit()
+            finally:
+                connection.exec_driver_sql("DETACH DATABASE archive")
+            connection.exec_driver_sql(f"DROP TABLE main.{name}")
+            connection.commit()
+        self._tables.pop(name, None)
+        Logger.log(f"{name} archived to {path}")
+        return path
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Rotate the events table into monthly partitions or archive a partition")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rotate = commands.add_parser("rotate")
+    rotate.add_argument("--keep-months", type=int, default=1)
+    rotate.add_argument("--batch-size", type=int, default=5000)
+    archive = commands.add_parser("archive")
+    archive.add_argument("name", help="events_YYYYMM")
+    archive.add_argument("--folder", default=None, help="default: <instance>/archive")
+    args = parser.parse_args(argv)
+
+    from dpem.event_api import app, event_partitions, migrate_db
+    migrate_db()
+    with app.app_context():
+        if args.command == "rotate":
+            print(f"{event_partitions.rotate(args.keep_months, args.batch_size)} events moved")
+        else:
+            print(event_partitions.archive(args.name, args.folder or os.path.join(app.instance_path, "archive")))
+
+
+if __name__ == "__main__":
+    main()
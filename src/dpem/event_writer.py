@@ -0,0 +1,127 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from dsbase.tools.logger import Logger
+
+
+class EventWriter:
+    """
+    Buffered write path of the event api: the handlers put the event rows on a queue and a background thread
+    inserts them in batched transactions, when batch_size rows are waiting or flush_seconds after the first one.
+    - put(row) returns False when the queue is full, the caller then writes the row itself
+    - the thread is started on first use in each process (after the gunicorn fork)
+    - stop() (registered with atexit) writes the queued rows before the process exits
+    A batch that fails is written again row by row so one bad row does not drop the others.
+    """
+    _stop = object()
+
+    def __init__(self, app, db, table, batch_size=200, flush_seconds=0.5, queue_size=10000):
+        self.app = app
+        self.db = db
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_size = queue_size
+        self.written = 0
+        self.failed = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+
+    def put(self, row):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            return False
+
+
+    def stop(self, timeout=30):
+        """
+        Write the queued rows and stop the thread
+        """
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid(): return
+            thread, self._thread = self._thread, None
+        if not thread.is_alive(): return
+        try:
+            self._queue.put(self._stop, timeout=timeout)
+        except queue.Full:
+            Logger.log(f"Event writer queue is still full after {timeout}s, {self._queue.qsize()} events are not written")
+            return
+        thread.join(timeout)
+
+
+    def stats(self):
+        return {"queued": self._queue.qsize() if self._queue is not None else 0,
+                "written": self.written, "failed": self.failed}
+
+
+    def _ensure_thread(self):
+        if self._running(): return
+        with self._lock:
+            if self._running(): return
+            #fork後父process的queue及thread不能沿用，同一個process的thread意外結束時沿用queue內的event
+            if self._pid != os.getpid() or self._queue is None:
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._pid = os.getpid()
+            elif self._thread is not None:
+                Logger.log("Event writer thread is not alive, started again")
+            self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+            self._thread.start()
+
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+
+    def _run(self):
+        rows = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                row = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                row = None
+            stopping = row is self._stop
+            if row is not None and not stopping:
+                rows.append(row)
+                if deadline is None: deadline = time.monotonic() + self.flush_seconds
+            if rows and (stopping or len(rows) >= self.batch_size or time.monotonic() >= deadline):
+                try:
+                    self._write(rows)
+                except Exception as err:
+                    #thread不能因為一批寫入失敗而結束，否則之後的event都只會堆在queue
+                    self.failed += len(rows)
+                    Logger.log(f"Event batch of {len(rows)} rows is not written: {err}")
+                rows = []
+                deadline = None
+            if stopping: return
+
+
+    def _write(self, rows):
+        with self.app.app_context():
+            try:
+                self.db.session.execute(self.table.insert(), rows)
+                self.db.session.commit()
+                self.written += len(rows)
+                return
+            except Exception as err:
+                self.db.session.rollback()
+                Logger.log(f"Event batch of {len(rows)} rows failed, retried one by one: {err}")
+            for row in rows:
+                try:
+                    self.db.session.execute(self.table.insert(), [row])
+                    self.db.session.commit()
+                    self.written += 1
+                except Exception as err:
+                    self.db.session.rollback()
+                    self.failed += 1
+                    Logger.log(f"Event {row.get('_metadata')} is not written: {err}")
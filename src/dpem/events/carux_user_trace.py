@@ -1,8 +1,10 @@
-from dpem.event_api import app, UnifiedEvent
-from sqlalchemy import or_, and_
+from dpem.event_api import app, db, event_partitions, event_to_dict, tz
+from dpem.event_partitions import epoch_us
 from typing import Union, List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+import itertools
 import json
+import os
 import pandas as pd
 
 def query_events(uad_list: Union[str, List[str]],
@@ -23,86 +25,188 @@ def query_events(uad_list: Union[str, List[str]],
     
     Returns:
         List of events matching the specified criteria
+
+    Only the monthly partitions overlapping the time range are queried with the events table.
     """
     with app.app_context():
-        query = UnifiedEvent.query
-        # Handle both single string and list inputs
-        if isinstance(uad_list, str):
-            uad_list = [uad_list]
-        # Remove empty strings and None values
-        uad_list = [uad for uad in uad_list if uad]
-        if not uad_list:
-            return []
-        # Build OR conditions for each UAD
-        like_conditions = [
-            UnifiedEvent.actor.like(f'%"user_ad": "{uad}"%')
-            for uad in uad_list
-        ]
-        query = query.filter(or_(*like_conditions))
-        
-        # Handle event_type filtering
-        if event_type is not None:
-                # validate event types
-                valid_event_type = ["log", "issue", "alert", "incident","feedback"]
-                
-                if isinstance(event_type, str):
-                    event_type = [event_type]
-                    
-                # validate each event type
-                invalid_types = [et for et in event_type if et not in valid_event_type]
-                if invalid_types:
-                    raise ValueError(f"Invalid event_type(s): {invalid_types},"
-                                     f"Valid types are: {valid_event_type}")
-                # Apply event_type filter
-                if len(event_type) == 1:
-                    query = query.filter(UnifiedEvent.event_type == event_type[0])
-                else:
-                    query = query.filter(UnifiedEvent.event_type.in_(event_type))
-        
-        # Handle timestamp filtering        
-        if timestamp_exact is not None:
-            # Exact timestamp match
-            query = query.filter(UnifiedEvent.timestamp == timestamp_exact)
-        
-        else:
-            # Range-based timestamp filtering
-            if timestamp_start is not None:
-                query = query.filter(UnifiedEvent.timestamp >= timestamp_start)
-            
-            if timestamp_end is not None:
-                query = query.filter(UnifiedEvent.timestamp <= timestamp_end)
-        
-        events = query.all()
+        query = filter_events(uad_list, event_type, timestamp_start, timestamp_end, timestamp_exact)
+        events = query.all() if query is not None else []
     
     return events
 
-def get_log_events_uads(uad_list: Union[str, List[str]],outputfmt='csv'):
-    events = query_events(uad_list=uad_list, event_type=['log'])
-    if events == []: return None
+def iter_events(uad_list: Union[str, List[str]],
+                event_type: Union[str, List[str]] = None,
+                timestamp_start: Optional[datetime] = None,
+                timestamp_end: Optional[datetime] = None,
+                timestamp_exact: Optional[datetime] = None,
+                chunk_size: int = 1000):
+    """
+    Same filters as query_events, the events are yielded in (timestamp, id) order and fetched chunk_size rows
+    at a time from a server-side cursor instead of being loaded all at once
+    """
+    with app.app_context():
+        query = filter_events(uad_list, event_type, timestamp_start, timestamp_end, timestamp_exact, ordered=True)
+        if query is None: return
+        yield from query.yield_per(chunk_size)
+
+def filter_events(uad_list, event_type=None, timestamp_start=None, timestamp_end=None, timestamp_exact=None, ordered=False):
+    """
+    Query of the query_events filters over the partitions of the time range, ordered by (ts_us, id) if ordered,
+    returns None when uad_list has no user_ad
+    """
+    start_us, end_us = epoch_us(timestamp_start, tz), epoch_us(timestamp_end, tz)
+    exact_us = epoch_us(timestamp_exact, tz)
+    if exact_us is not None: start_us = end_us = exact_us
+    source = event_partitions.source(start_us, end_us)
+    query = db.session.query(source)
+    # Handle both single string and list inputs
+    if isinstance(uad_list, str):
+        uad_list = [uad_list]
+    # Remove empty strings and None values
+    uad_list = [uad for uad in uad_list if uad]
+    if not uad_list:
+        return None
+    # actor_user_ad is indexed (see migrate_db)
+    if len(uad_list) == 1:
+        query = query.filter(source.actor_user_ad == uad_list[0])
+    else:
+        query = query.filter(source.actor_user_ad.in_(uad_list))
+    
+    # Handle event_type filtering
+    if event_type is not None:
+            # validate event types
+            valid_event_type = ["log", "issue", "alert", "incident","feedback"]
+            
+            if isinstance(event_type, str):
+                event_type = [event_type]
+                
+            # validate each event type
+            invalid_types = [et for et in event_type if et not in valid_event_type]
+            if invalid_types:
+                raise ValueError(f"Invalid event_type(s): {invalid_types},"
+                                 f"Valid types are: {valid_event_type}")
+            # Apply event_type filter
+            if len(event_type) == 1:
+                query = query.filter(source.event_type == event_type[0])
+            else:
+                query = query.filter(source.event_type.in_(event_type))
+    
+    # Handle timestamp filtering on the epoch microseconds (naive datetimes are in the api timezone)
+    if exact_us is not None:
+        # Exact timestamp match
+        query = query.filter(source.ts_us == exact_us)
+    
     else:
-        data = {
-            "events":
-            [
-                {
-                    'id': e.id,
-                    'event_type': e.event_type,
-                    'timestamp': e.timestamp,
-                    'actor': json.loads(e.actor or "{}"),
-                    'target': json.loads(e.target or "{}"),
-                    'action': e.action,
-                    'outcome': e.outcome,
-                    'context': json.loads(e.context or "{}"),
-                    'metadata': json.loads(e._metadata or "{}"),
-                    'log_level': e.log_level,
-                    'severity': e.severity,
-                    'critical': e.critical,
-                    'status': e.status,
-                    'related_issue_id': e.related_issue_id,
-                    'related_alert_id': e.related_alert_id,
-                    'comment': e.comment,
-                    'related_event_id': e.related_event_id
-                } for e in events
-            ]}
-        df = pd.json_normalize(data['events'])
-        df.to_csv("events.csv", index=False, encoding='utf-8')
-        return df
\ No newline at end of file
+        # Range-based timestamp filtering
+        if start_us is not None:
+            query = query.filter(source.ts_us >= start_us)
+        
+        if end_us is not None:
+            query = query.filter(source.ts_us <= end_us)
+    
+    if ordered: query = query.order_by(source.ts_us, source.id)
+    return query
+
+def get_log_events_uads(uad_list: Union[str, List[str]],outputfmt='csv', path=None, chunk_size=5000):
+    """
+    Write the log events of the users chunk by chunk and return the path (None without events).
+    outputfmt parquet/feather writes a dataset folder (see export_events), csv a file whose columns are those of the
+    first chunk, keys of actor/target/context/metadata only seen in later chunks are dropped
+    """
+    if outputfmt in ("parquet", "feather"):
+        return export_events(uad_list, path or "events_export", outputfmt, event_type=['log'], chunk_size=max(chunk_size, 50000))
+    path = path or "events.csv"
+    events = iter_events(uad_list=uad_list, event_type=['log'], chunk_size=chunk_size)
+    columns = None
+    while True:
+        chunk = [event_to_dict(e) for e in itertools.islice(events, chunk_size)]
+        if len(chunk) == 0: break
+        df = pd.json_normalize(chunk)
+        if columns is None:
+            columns = list(df.columns)
+            df.to_csv(path, index=False, encoding='utf-8')
+        else:
+            df.reindex(columns=columns).to_csv(path, mode='a', header=False, index=False, encoding='utf-8')
+    return path if columns is not None else None
+
+# sub-fields of the JSON columns flattened into their own columns (the api models), other keys go to <field>_extra
+trace_fields = {"actor": ("clientid", "user_ad", "ip"),
+                "target": ("service", "resource"),
+                "context": ("user_agent", "location"),
+                "metadata": ("request_id", "session_id", "custom_tags", "event_uid")}
+trace_columns = ("id", "event_type", "timestamp", "action", "outcome", "log_level", "severity", "critical", "status",
+                 "related_issue_id", "related_alert_id", "related_event_id", "comment")
+
+def trace_schema():
+    import pyarrow as pa
+    types = {"id": pa.int64(), "critical": pa.bool_(), "related_issue_id": pa.int64(),
+             "related_alert_id": pa.int64(), "related_event_id": pa.int64()}
+    columns = [("ts", pa.timestamp("us", tz="UTC"))] + [(name, types.get(name, pa.string())) for name in trace_columns]
+    for field, keys in trace_fields.items():
+        columns += [(f"{field}_{key}", pa.string()) for key in keys] + [(f"{field}_extra", pa.string())]
+    return pa.schema(columns)
+
+def trace_batch(events, schema):
+    """
+    Arrow record batch of the events, the JSON columns are decoded once per row and flattened
+    """
+    import pyarrow as pa
+    data = {name: [] for name in schema.names}
+    for e in events:
+        data["ts"].append(e.ts_us)
+        for name in trace_columns: data[name].append(getattr(e, name))
+        for field, keys in trace_fields.items():
+            try:
+                value = json.loads(getattr(e, "_metadata" if field == "metadata" else field) or "{}")
+            except ValueError:
+                value = {}
+            if not isinstance(value, dict): value = {}
+            for key in keys:
+                item = value.pop(key, None)
+                data[f"{field}_{key}"].append(item if item is None or isinstance(item, str) else json.dumps(item, ensure_ascii=False))
+            data[f"{field}_extra"].append(json.dumps(value, ensure_ascii=False) if value else None)
+    return pa.RecordBatch.from_pydict(data, schema=schema)
+
+def export_events(uad_list: Union[str, List[str]],
+                  folder: str = "events_export",
+                  fmt: str = "parquet",
+                  event_type: Union[str, List[str]] = None,
+                  timestamp_start: Optional[datetime] = None,
+                  timestamp_end: Optional[datetime] = None,
+                  chunk_size: int = 50000):
+    """
+    Stream the events of the users (query_events filters) into a dataset folder partitioned by month,
+    folder/month=YYYY-MM/part-0.parquet (zstd) or .feather (arrow ipc, zstd), written chunk_size rows per
+    record batch so the memory does not depend on the number of events. Returns the folder, None without events.
+    pd.read_parquet(folder) / pyarrow.dataset.dataset(folder, partitioning="hive") read it back.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fmt not in ("parquet", "feather"): raise ValueError(f"Invalid format {fmt}, valid formats are parquet, feather")
+    if os.path.isdir(folder) and os.listdir(folder): raise ValueError(f"{folder} is not empty")
+
+    schema = trace_schema()
+    writers = []
+    def open_writer(month):
+        os.makedirs(os.path.join(folder, f"month={month}"), exist_ok=True)
+        path = os.path.join(folder, f"month={month}", f"part-0.{fmt}")
+        if fmt == "parquet": writers.append(pq.ParquetWriter(path, schema, compression="zstd"))
+        else: writers.append(pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression="zstd")))
+        return writers[-1]
+
+    # iter_events依(ts_us, id)排序，月份改變時換檔
+    writer, month, chunk = None, None, []
+    try:
+        for e in iter_events(uad_list, event_type, timestamp_start, timestamp_end, chunk_size=chunk_size):
+            event_month = datetime.fromtimestamp(e.ts_us / 1000000, timezone.utc).astimezone(tz).strftime("%Y-%m") if e.ts_us is not None else "unknown"
+            if event_month != month or len(chunk) >= chunk_size:
+                if chunk: writer.write_batch(trace_batch(chunk, schema))
+                chunk = []
+                if event_month != month:
+                    if writer is not None: writer.close()
+                    writer, month = open_writer(event_month), event_month
+            chunk.append(e)
+        if chunk: writer.write_batch(trace_batch(chunk, schema))
+    finally:
+        if writer is not None: writer.close()
+    return folder if writers else None
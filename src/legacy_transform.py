@@ -1,4 +1,5 @@
-from dpam.tools.account import Account
+import sys
+from dpam.tools.registry_validator import RegistryValidator
 from dpam.tools.logger import Logger, LogLevel
 
 ## Below code is used for validating and correcting the legacy registy
@@ -10,26 +11,9 @@ Logger.log(f"Begin account legacy data validation and transformation")
 print(f"Logger path {Logger._folder_path[0]}//{Logger._filename}")
 assert Logger._keyname == log_keyname
 
-groups = Account._get_group_clients_all_info()
-for idx, cid in groups['CLIENT_ID'].items():
-  group = Account(cid, type=3)
-  res = group.auto_correct_none_resource_client_registry_value(log=Logger)
-  Logger.log(res)
-
-roles = Account._get_role_clients_all_info()
-for idx, cid in roles['CLIENT_ID'].items():
-  role = Account(cid, type=4)
-  res = role.auto_correct_none_resource_client_registry_value(log=Logger)
-  Logger.log(res)
-
-users = Account._get_user_clients_all_info()
-for idx, cid in users['CLIENT_ID'].items():
-  user = Account(cid, type=2)
-  res = user.auto_correct_none_resource_client_registry_value(log=Logger)
-  Logger.log(res)
-  
-resources = Account._get_resource_clients_all_info()
-for idx, cid in resources['CLIENT_ID'].items():
-  resource = Account(cid, type=1)
-  res = resource.validate_resource_client_reg_value(log=Logger)
-  Logger.log(res)
+# groups, roles, users and then resources are validated in one scan and corrected in one transaction
+# python legacy_transform.py --dry-run only logs the corrections
+dry_run = "--dry-run" in sys.argv
+report = RegistryValidator(log=Logger).run(types=(3, 4, 2, 1), dry_run=dry_run)
+for line in RegistryValidator.diff_lines(report):
+  Logger.log(line)
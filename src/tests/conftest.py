@@ -0,0 +1,87 @@
+import os
+import shutil
+import sqlite3
+import sys
+from datetime import timedelta
+import pytest
+
+_test_cfg = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "flask_test.cfg")
+
+
+@pytest.fixture
+def account_db(tmp_path, monkeypatch):
+    """
+    DbConnection on a new sqlite file with an empty ACCOUNT table, AccountCache.invalidate does nothing.
+    The table is created without DbConnection, its pool is created by the first connect of the test
+    """
+    from dpam.dbtools.db_connection import DbConnection
+    from dpam.tools.account_cache import AccountCache
+    monkeypatch.setattr(AccountCache, "invalidate", classmethod(lambda clz, client_id=None, type=None: None))
+    cn = sqlite3.connect(tmp_path / "account.sqlite")
+    cn.execute('''CREATE TABLE ACCOUNT (CLIENT_ID TEXT, PASSWORD TEXT, TYPE INTEGER, EXPIRY TEXT, PERMISSION TEXT,
+                  OBSOLETE INTEGER, OWNER_USER_ID TEXT, CREATE_DTTM TEXT, REGISTRY VARCHAR, BIND_ROLE TEXT, BIND_GROUP TEXT,
+                  PRIMARY KEY (CLIENT_ID, OWNER_USER_ID, TYPE))''')
+    cn.close()
+    DbConnection.reset_db_config()
+    DbConnection._db_list = [{"type": "sqlite", "connection_string": str(tmp_path / "account.sqlite"), "driver_path": ""}]
+    yield
+    DbConnection.reset_db_config()
+
+
+@pytest.fixture(scope="session")
+def event_api(tmp_path_factory):
+    """
+    dpem.event_api on a temporary instance folder (flask.cfg copied from instance/flask_test.cfg and a new events.db),
+    the module reads its instance path from PYTHONPATH when it is imported
+    """
+    if "dpem.event_api" in sys.modules: pytest.skip("dpem.event_api is already imported with another instance path")
+    root = tmp_path_factory.mktemp("dpem")
+    os.makedirs(root / "instance")
+    shutil.copy(_test_cfg, root / "instance" / "flask.cfg")
+    pythonpath = os.environ.get("PYTHONPATH")
+    os.environ["PYTHONPATH"] = str(root)
+    try:
+        from dpem import event_api
+    finally:
+        if pythonpath is None: os.environ.pop("PYTHONPATH")
+        else: os.environ["PYTHONPATH"] = pythonpath
+    event_api.create_db()
+    return event_api
+
+
+@pytest.fixture
+def client(event_api):
+    """
+    Test client of the event api, every test starts on empty events, partitions and rollups
+    """
+    with event_api.app.app_context():
+        for name in event_api.event_partitions.names():
+            event_api.event_partitions.table(name).drop(bind=event_api.db.session.connection())
+        event_api.db.session.execute(event_api.UnifiedEvent.__table__.delete())
+        event_api.db.session.execute(event_api.EventRollup.__table__.delete())
+        event_api.db.session.commit()
+    event_api._stats_cache.clear()
+    return event_api.app.test_client()
+
+
+@pytest.fixture
+def seed_events(event_api, client):
+    """
+    seed_events(start, count, step=timedelta(minutes=1), **fields) inserts count log events from start, step apart,
+    into the events table and returns their ids
+    """
+    def seed(start, count, step=timedelta(minutes=1), **fields):
+        data = dict({"actor": {"clientid": "eng", "user_ad": "qs.chou", "ip": ""},
+                     "target": {"service": "/ds/carux", "resource": ""},
+                     "action": "login", "outcome": "success", "log_level": "INFO"}, **fields)
+        events = []
+        for ix in range(count):
+            row = event_api.build_event_row(data, data.get("event_type", "log"))
+            ts = start + step * ix
+            row.update(timestamp=ts.isoformat(), ts_us=event_api.epoch_us(ts))
+            events.append(event_api.UnifiedEvent(**row))
+        with event_api.app.app_context():
+            event_api.db.session.add_all(events)
+            event_api.db.session.commit()
+            return [event.id for event in events]
+    return seed
@@ -0,0 +1,19 @@
+import sqlite3
+import pytest
+from dpam.dbtools.db_connection import DbConnection
+from dpam import db_access
+
+
+def test_connections_go_back_to_the_pool(account_db):
+    # a pool of one connection: any call that keeps its connection makes the next one time out
+    DbConnection._pool_config = {"max_size": 1, "wait_timeout": 0.1}
+    db_access.insert_account("c1", "pw", "u1")
+    for _ in range(3):
+        with pytest.raises(sqlite3.IntegrityError):
+            db_access.insert_account("c1", "pw", "u1")
+    for _ in range(3):
+        assert [row["CLIENT_ID"] for row in db_access.select_accounts_for_admin()] == ["c1"]
+        assert db_access.select_accounts_registry_for_owner("u1", resp_type="list") is not None
+    db_access.update_account_registry("c1", "/ds/ml")
+    stats = DbConnection.pool_stats()[0]
+    assert stats["size"] == 1 and stats["idle"] == 1 and stats["leaks"] == 0 and stats["timeouts"] == 0
@@ -0,0 +1,66 @@
+import sqlite3
+import threading
+import pytest
+from dpam.dbtools.connection_pool import ConnectionPool, PooledConnection
+
+
+def make_pool(tmp_path, **kwargs):
+    db_file = str(tmp_path / "pool.sqlite")
+    factory = lambda: sqlite3.connect(db_file, factory=PooledConnection, check_same_thread=False)
+    return ConnectionPool(factory, **kwargs)
+
+
+def test_close_returns_connection_to_pool(tmp_path):
+    pool = make_pool(tmp_path, max_size=2)
+    cn = pool.checkout()
+    cn.execute("CREATE TABLE T (A INTEGER)")
+    cn.commit()
+    cn.close()
+    cn2 = pool.checkout()
+    assert cn2 is cn
+    assert pool.stats()["hits"] == 1 and pool.stats()["misses"] == 1
+    cn2.close()
+    cn2.close()    # double close must not put it twice in the idle list
+    assert pool.stats()["idle"] == 1
+
+
+def test_uncommitted_work_is_rolled_back_on_checkin(tmp_path):
+    pool = make_pool(tmp_path)
+    cn = pool.checkout()
+    cn.execute("CREATE TABLE T (A INTEGER)")
+    cn.commit()
+    cn.execute("INSERT INTO T VALUES (1)")
+    cn.close()
+    cn = pool.checkout()
+    assert cn.execute("SELECT COUNT(*) FROM T").fetchone()[0] == 0
+    cn.close()
+
+
+def test_checkout_waits_then_times_out(tmp_path):
+    pool = make_pool(tmp_path, max_size=1, wait_timeout=0.05)
+    cn = pool.checkout()
+    with pytest.raises(TimeoutError):
+        pool.checkout()
+    threading.Timer(0.01, cn.close).start()
+    pool.wait_timeout = 1
+    assert pool.checkout() is cn
+    assert pool.stats()["waits"] == 2 and pool.stats()["timeouts"] == 1
+
+
+def test_idle_connections_are_evicted(tmp_path):
+    pool = make_pool(tmp_path, idle_timeout=0.001)
+    cn = pool.checkout()
+    cn.close()
+    threading.Event().wait(0.01)
+    cn2 = pool.checkout()
+    assert cn2 is not cn
+    assert pool.stats()["evictions"] == 1
+
+
+def test_connection_dropped_without_close_releases_its_slot(tmp_path):
+    pool = make_pool(tmp_path, max_size=1, wait_timeout=0.05)
+    cn = pool.checkout()
+    del cn
+    cn = pool.checkout()
+    assert pool.stats()["leaks"] == 1
+    cn.close()
@@ -0,0 +1,29 @@
+import pytest
+from dpam.dbtools.db_connection import DbConnection
+from dpam.dbtools.sql_buffer import SqlBuffer
+from dpam.dbtools.row_access import fetch_one, fetch_all, fetch_columns
+
+
+@pytest.fixture
+def accounts(account_db):
+    with DbConnection.connect() as cn:
+        cn.executemany("INSERT INTO ACCOUNT (CLIENT_ID, TYPE, REGISTRY) VALUES (?, ?, ?)", [("mfg", 2, "/mfg"), ("eng", 2, None)])
+
+
+def test_point_lookup_shapes(accounts):
+    buf = SqlBuffer("SELECT CLIENT_ID, TYPE, REGISTRY FROM ACCOUNT").add("CLIENT_ID", "mfg").add("TYPE", 2)
+    assert fetch_one(buf) == {"CLIENT_ID": "mfg", "TYPE": 2, "REGISTRY": "/mfg"}
+    assert fetch_columns(buf) == {"CLIENT_ID": {0: "mfg"}, "TYPE": {0: 2}, "REGISTRY": {0: "/mfg"}}
+
+
+def test_missing_row_shapes(accounts):
+    buf = SqlBuffer("SELECT CLIENT_ID, REGISTRY FROM ACCOUNT").add("CLIENT_ID", "nobody")
+    assert fetch_one(buf) is None
+    assert fetch_all(buf) == []
+    assert fetch_columns(buf) == {"CLIENT_ID": {}, "REGISTRY": {}}
+
+
+def test_records_keep_null_as_none(accounts):
+    buf = SqlBuffer("SELECT CLIENT_ID, REGISTRY FROM ACCOUNT").order_by("CLIENT_ID")
+    assert fetch_all(buf) == [{"CLIENT_ID": "eng", "REGISTRY": None}, {"CLIENT_ID": "mfg", "REGISTRY": "/mfg"}]
+    assert DbConnection.pool_stats()[0]["idle"] == 1
@@ -0,0 +1,25 @@
+import sqlite3
+from dpam.dbtools.sql_buffer import SqlBuffer
+
+
+def test_values_are_bound_not_interpolated():
+    buf = SqlBuffer("SELECT CLIENT_ID FROM ACCOUNT").add("CLIENT_ID", "a'b").add("TYPE", 2)
+    assert "a'b" not in buf.sql
+    assert buf.params == ("a'b", 2)
+    assert SqlBuffer("SELECT CLIENT_ID FROM ACCOUNT").add("CLIENT_ID", "other").add("TYPE", 1).sql == buf.sql
+
+
+def test_wildcard_and_in_list():
+    buf = SqlBuffer("SELECT * FROM T").add("A", "*").add_in("B", ["x", "y"]).add_like("C", "ab")
+    assert buf.query == ("SELECT * FROM T\n\t WHERE B IN (?,?)\n\t   AND C LIKE ?", ("x", "y", "ab%"))
+    assert SqlBuffer("DELETE FROM T").add_eq("A", "*").params == ("*",)
+
+
+def test_executes_on_sqlite():
+    cn = sqlite3.connect(":memory:")
+    cn.execute("CREATE TABLE ACCOUNT (CLIENT_ID TEXT, TYPE INTEGER)")
+    insert = SqlBuffer("INSERT INTO ACCOUNT VALUES (?, ?)", params=["mfg", 2])
+    cn.execute(insert.sql, insert.params)
+    sub = SqlBuffer("SELECT CLIENT_ID FROM ACCOUNT").add("TYPE", 2)
+    buf = SqlBuffer("SELECT COUNT(*) FROM ACCOUNT").add_in_sub("CLIENT_ID", sub).add("TYPE", "2")
+    assert cn.execute(*buf.query).fetchone()[0] == 1
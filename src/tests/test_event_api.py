@@ -1,5 +1,5 @@
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 
 def test_log_event(client):
     payload = {
@@ -10,7 +10,7 @@ def test_log_event(client):
         "outcome": "success",
         "log_level": "INFO"
     }
-    response = client.post("/events/", json=payload)
+    response = client.post("/log", json=payload)
     assert response.status_code == 201 
     
     payload = {
@@ -82,4 +82,149 @@ def test_feedback_event(client):
     }
     response = client.post("/feedback", json=payload)
     assert response.status_code == 201
-    
\ No newline at end of file
+
+def test_event_batch(client, event_api, monkeypatch):
+    event = {"actor": {"clientid": "eng", "user_ad": "qs.chou", "ip": ""},
+             "target": {"service": "/ds/carux", "resource": ""}, "action": "login", "outcome": "success"}
+    lines = [json.dumps(event),
+             "not json",
+             json.dumps(dict(event, event_type="alert", critical=True)),
+             json.dumps(dict(event, event_type="unknown")),
+             json.dumps({"actor": {"user_ad": "qs.chou"}}),
+             "",
+             json.dumps(dict(event, action="logout"))]
+    response = client.post("/events/batch", data="\n".join(lines), content_type="application/x-ndjson")
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body["inserted"] == 3 and body["errors"] == 3
+    results = body["results"]
+    assert [r["index"] for r in results] == list(range(6))
+    assert [r["index"] for r in results if "error" in r] == [1, 3, 4]
+    assert "Invalid JSON" in results[1]["error"] and "event_type" in results[3]["error"] and "clientid" in results[4]["error"]
+    written = {e["id"]: e for e in client.get("/events").get_json()["events"]}
+    assert sorted(written) == sorted(results[i]["id"] for i in (0, 2, 5))
+    assert [(written[results[i]["id"]]["event_type"], written[results[i]["id"]]["action"]) for i in (0, 2, 5)] == \
+        [("log", "login"), ("alert", "login"), ("log", "logout")]
+    assert written[results[0]["id"]]["metadata"]["event_uid"] == results[0]["uid"]
+
+    response = client.post("/events/batch", json=[event, event])
+    assert response.status_code == 201 and response.get_json()["inserted"] == 2
+
+    for body in ("", "\n\n"):
+        response = client.post("/events/batch", data=body, content_type="application/x-ndjson")
+        assert response.status_code == 400
+    response = client.post("/events/batch", json=[])
+    assert response.status_code == 400
+
+    monkeypatch.setitem(event_api.app.config, "EVENT_BATCH_MAX_ITEMS", 2)
+    response = client.post("/events/batch", data="\n".join([json.dumps(event)] * 3), content_type="application/x-ndjson")
+    assert response.status_code == 413
+    assert len(client.get("/events").get_json()["events"]) == 5
+
+def test_events_keyset_pages(client, seed_events, event_api):
+    now = datetime.now(event_api.tz).replace(microsecond=0)
+    # 同一時間的event以id排序，較舊的月份搬到partition後仍在同一個分頁順序內
+    old = seed_events(now - timedelta(days=70), 3)
+    tied = seed_events(now - timedelta(hours=1), 3, step=timedelta(0))
+    latest = seed_events(now - timedelta(days=80), 1) + seed_events(now, 1)
+    with event_api.app.app_context():
+        assert event_api.event_partitions.rotate(keep_months=1, now=now) == 4
+    expected = latest[:1] + old + tied + latest[1:]
+
+    seen = []
+    cursor = None
+    while True:
+        query = {"limit": 3} if cursor is None else {"limit": 3, "cursor": cursor}
+        response = client.get("/events", query_string=query)
+        assert response.status_code == 200
+        events = response.get_json()["events"]
+        assert 0 < len(events) <= 3
+        seen += [e["id"] for e in events]
+        cursor = response.get_json()["next_cursor"]
+        if cursor is None: break
+    assert seen == expected
+
+    response = client.get("/events", query_string={"format": "ndjson"})
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in response.get_data(as_text=True).splitlines()] == expected
+
+    response = client.get("/events", query_string={"limit": 2, "start": (now - timedelta(hours=2)).isoformat()})
+    assert [e["id"] for e in response.get_json()["events"]] == tied[:2]
+
+    response = client.get("/events", query_string={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_events_stats(client, seed_events, event_api):
+    day = datetime(2026, 3, 2, tzinfo=event_api.tz)
+    seed_events(day + timedelta(hours=1), 3)
+    seed_events(day + timedelta(hours=1, minutes=30), 1, outcome="failure")
+    seed_events(day + timedelta(hours=5), 2, action="logout", actor={"clientid": "eng", "user_ad": "am.lin"})
+    seed_events(day + timedelta(days=1, hours=2), 2, event_type="issue", severity="low", outcome="failure")
+    closed = {"start": day.isoformat(), "end": (day + timedelta(days=2)).isoformat()}
+
+    response = client.get("/events/stats/counts", query_string=dict(closed, group_by="event_type"))
+    assert response.status_code == 200
+    assert response.get_json()["rows"] == [{"event_type": "issue", "count": 2}, {"event_type": "log", "count": 6}]
+
+    response = client.get("/events/stats/error_rate", query_string=dict(closed, group_by="action"))
+    assert {row["action"]: (row["count"], row["failures"]) for row in response.get_json()["rows"]} == {"login": (6, 3), "logout": (2, 0)}
+
+    response = client.get("/events/stats/histogram", query_string=dict(closed, bucket="day"))
+    assert [(row["bucket_start"], row["count"]) for row in response.get_json()["rows"]] == \
+        [(day.isoformat(), 6), ((day + timedelta(days=1)).isoformat(), 2)]
+    response = client.get("/events/stats/histogram", query_string=dict(closed, bucket="hour", user_ad="qs.chou"))
+    assert [row["count"] for row in response.get_json()["rows"]] == [4, 2]
+
+    response = client.get("/events/stats/top", query_string=dict(closed, by="actor_user_ad", n=1))
+    assert response.get_json()["rows"] == [{"actor_user_ad": "qs.chou", "count": 6}]
+
+    # start/end在同一分鐘內的查詢共用快取，結果也是以整分鐘的範圍計算
+    query = {"group_by": "action", "start": (day + timedelta(hours=1, seconds=20)).isoformat(),
+             "end": (day + timedelta(hours=4, seconds=10)).isoformat()}
+    assert client.get("/events/stats/counts", query_string=query).get_json()["rows"] == [{"action": "login", "count": 4}]
+    seed_events(day + timedelta(hours=1, minutes=10), 1)
+    query["start"] = (day + timedelta(hours=1, seconds=40)).isoformat()
+    assert client.get("/events/stats/counts", query_string=query).get_json()["rows"] == [{"action": "login", "count": 4}]
+
+    response = client.get("/events/stats/counts", query_string={"group_by": "comment"})
+    assert response.status_code == 400
+    response = client.get("/events/stats/counts", query_string={"group_by": "action", "start": "not a time"})
+    assert response.status_code == 400
+
+def test_migrate_db(client, event_api):
+    from sqlalchemy import Column, MetaData, Table, text
+    events = event_api.UnifiedEvent.__table__
+    added = set(event_api.promoted_columns) | {"ts_us"}
+    # 先前版本的events表，沒有提升的欄位和ts_us
+    old = Table("events", MetaData(), *[Column(column.name, column.type, primary_key=column.primary_key) for column in events.columns if column.name not in added])
+    rows = [{"actor": '{"user_ad": "qs.chou", "clientid": "eng"}', "target": '{"service": "/ds/carux", "resource": "r"}',
+             "timestamp": "2026-03-01T08:00:00+08:00"},
+            {"actor": "{not json", "target": '{"service": "/ds/pam"}', "timestamp": "2026-03-01T08:00:00"},
+            {"actor": '{"user_ad": "kh.lin"}', "target": None, "timestamp": "yesterday"}]
+    with event_api.app.app_context():
+        connection = event_api.db.session.connection()
+        events.drop(bind=connection)
+        old.create(bind=connection)
+        event_api.db.session.execute(old.insert(), [dict(row, event_type="log", action="login") for row in rows])
+        event_api.db.session.commit()
+    try:
+        assert event_api.migrate_db(batch_size=2) == 3
+        with event_api.app.app_context():
+            columns = {row[1] for row in event_api.db.session.execute(text("PRAGMA table_info(events)"))}
+            indexes = {row[1] for row in event_api.db.session.execute(text("PRAGMA index_list(events)"))}
+            migrated = event_api.db.session.execute(text("SELECT actor_user_ad, actor_clientid, target_service, target_resource, ts_us "
+                                                         "FROM events ORDER BY id")).all()
+        assert added <= columns
+        assert {index.name for index in events.indexes} <= indexes
+        ts_us = event_api.epoch_us(datetime.fromisoformat("2026-03-01T08:00:00+08:00"))
+        assert [tuple(row) for row in migrated] == [("qs.chou", "eng", "/ds/carux", "r", ts_us),
+                                                    (None, None, "/ds/pam", None, ts_us),
+                                                    ("kh.lin", None, None, None, None)]
+        # 欄位已存在時不再回填
+        assert event_api.migrate_db() == 0
+    finally:
+        with event_api.app.app_context():
+            connection = event_api.db.session.connection()
+            events.drop(bind=connection)
+            events.create(bind=connection)
+            event_api.db.session.commit()
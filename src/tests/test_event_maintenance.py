@@ -0,0 +1,52 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select
+
+
+@pytest.fixture
+def maintenance(event_api, client):
+    from dpem import event_maintenance
+    return event_maintenance
+
+
+def test_retention_archives_rolls_up_and_deletes(maintenance, event_api, seed_events, tmp_path):
+    now = datetime.now(event_api.tz).replace(microsecond=0)
+    padding = "x" * 2000
+    with event_api.app.app_context():
+        # 先轉成auto_vacuum=INCREMENTAL，刪除後的空頁才由incremental_vacuum釋放
+        maintenance.incremental_vacuum(enable=True)
+    partitioned = seed_events(now - timedelta(days=100), 150, step=timedelta(minutes=10), comment=padding)
+    old = seed_events(now - timedelta(days=40), 100, step=timedelta(minutes=1), action="logout", comment=padding)
+    old_issues = seed_events(now - timedelta(days=40), 5, event_type="issue", severity="low")
+    recent = seed_events(now - timedelta(days=1), 5)
+    with event_api.app.app_context():
+        moved = event_api.event_partitions.rotate(keep_months=1, now=now)
+        partitions = event_api.event_partitions.names()
+    assert moved > 0 and len(partitions) > 0
+
+    result = maintenance.run(days=30, batch_size=40, archive_folder=str(tmp_path), archive_format="ndjson",
+                             pause_seconds=0, now=now)
+
+    expired = partitioned + old
+    assert result["removed"] == len(expired)
+    with gzip.open(result["archive"], "rt", encoding="utf-8") as file:
+        assert sorted(json.loads(line)["id"] for line in file) == sorted(expired)
+    with event_api.app.app_context():
+        rollups = event_api.EventRollup.__table__
+        counts = dict(event_api.db.session.execute(select(rollups.c.action, func.sum(rollups.c.count)).group_by(rollups.c.action)).all())
+        remaining = {row[0] for row in event_api.db.session.execute(select(event_api.UnifiedEvent.id))}
+        for name in event_api.event_partitions.names():
+            remaining |= {row[0] for row in event_api.db.session.execute(select(event_api.event_partitions.table(name).c.id))}
+    assert counts == {"login": len(partitioned), "logout": len(old)}
+    assert remaining == set(old_issues + recent)
+    # 只剩過期log事件的partition被drop，還有issue事件的partition保留
+    kept = {event_api.event_partitions.partition_name(event_api.epoch_us(now - timedelta(days=40)))}
+    assert sorted(result["dropped_partitions"]) == sorted(set(partitions) - kept)
+    with event_api.app.app_context():
+        assert event_api.event_partitions.names() == sorted(kept & set(partitions))
+    assert result["vacuumed_pages"] > 100
+
+    again = maintenance.run(days=30, archive_folder=str(tmp_path), pause_seconds=0, now=now)
+    assert again["removed"] == 0 and again["archive"] is None
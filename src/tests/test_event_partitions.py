@@ -0,0 +1,18 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from dpem.event_partitions import EventPartitions, epoch_us
+
+tz = ZoneInfo("Asia/Taipei")
+
+def test_epoch_us_offsets():
+    assert epoch_us("2026-01-01T08:00:00+08:00") == epoch_us("2026-01-01T00:00:00+00:00") == 1767225600000000
+    assert epoch_us("2026-01-01T08:00:00", tz) == 1767225600000000
+    assert epoch_us(datetime(2026, 1, 1, 8, tzinfo=tz)) + 1 == epoch_us("2026-01-01T08:00:00.000001+08:00")
+    assert epoch_us(None) is None
+
+def test_partition_months():
+    partitions = EventPartitions(None, None, tz)
+    lo, hi = partitions.month_range("events_202612")
+    assert lo == epoch_us("2026-12-01", tz) and hi == epoch_us("2027-01-01", tz)
+    assert partitions.partition_name(lo) == "events_202612"
+    assert partitions.partition_name(lo - 1) == "events_202611"
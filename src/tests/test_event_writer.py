@@ -0,0 +1,71 @@
+import pytest
+from contextlib import nullcontext
+from types import SimpleNamespace
+from dpem import event_writer
+from dpem.event_writer import EventWriter
+
+
+@pytest.fixture(autouse=True)
+def quiet_logger(monkeypatch):
+    monkeypatch.setattr(event_writer.Logger, "log", classmethod(lambda clz, *args, **kwargs: None))
+
+
+class RecordingSession:
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+
+    def execute(self, statement, rows):
+        if self.fail_on is not None and any(row["id"] == self.fail_on for row in rows): raise ValueError("bad row")
+        self.batches.append([row["id"] for row in rows])
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def make_writer(session, **kwargs):
+    app = SimpleNamespace(app_context=nullcontext)
+    table = SimpleNamespace(insert=lambda: "INSERT")
+    return EventWriter(app, SimpleNamespace(session=session), table, **kwargs)
+
+
+def test_rows_are_written_in_batches_and_drained_by_stop():
+    session = RecordingSession(fail_on=7)
+    writer = make_writer(session, batch_size=4, flush_seconds=60)
+    for id in range(10): assert writer.put({"id": id})
+    writer.stop()
+    assert sorted(id for batch in session.batches for id in batch) == [0, 1, 2, 3, 4, 5, 6, 8, 9]
+    assert session.batches[0] == [0, 1, 2, 3]
+    assert writer.stats() == {"queued": 0, "written": 9, "failed": 1}
+
+
+def test_a_dead_thread_is_started_again():
+    session = RecordingSession()
+    writer = make_writer(session, batch_size=1)
+    writer._ensure_thread()
+    queue = writer._queue
+    writer._queue.put(writer._stop)
+    writer._thread.join(5)
+    assert writer.put({"id": 1})
+    assert writer._queue is queue and writer._thread.is_alive()
+    writer.stop()
+    assert session.batches == [[1]]
+
+
+def test_a_failing_write_does_not_end_the_thread(monkeypatch):
+    session = RecordingSession()
+    writer = make_writer(session, batch_size=1)
+    calls = []
+    write = writer._write
+    def failing_write(rows):
+        calls.append(rows)
+        if len(calls) == 1: raise RuntimeError("app context failed")
+        write(rows)
+    monkeypatch.setattr(writer, "_write", failing_write)
+    writer.put({"id": 1})
+    writer.put({"id": 2})
+    writer.stop()
+    assert session.batches == [[2]] and writer.failed == 1
@@ -0,0 +1,64 @@
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def trace(event_api, client):
+    from dpem.events import carux_user_trace
+    return carux_user_trace
+
+
+def test_log_events_csv(trace, event_api, seed_events, tmp_path):
+    start = datetime(2026, 3, 1, 8, tzinfo=event_api.tz)
+    logs = seed_events(start, 3, actor={"clientid": "eng", "user_ad": "qs.chou", "ip": "10.0.0.1"})
+    seed_events(start, 2, actor={"clientid": "eng", "user_ad": "other"})
+    seed_events(start, 1, event_type="issue", severity="low")
+
+    # chunk_size=2，第二個chunk附加在同一個檔案
+    path = trace.get_log_events_uads("qs.chou", path=str(tmp_path / "events.csv"), chunk_size=2)
+    df = pd.read_csv(path)
+    assert list(df["id"]) == logs
+    assert set(df["event_type"]) == {"log"}
+    assert list(df["actor.ip"]) == ["10.0.0.1"] * 3
+    assert trace.get_log_events_uads("nobody", path=str(tmp_path / "none.csv")) is None
+
+
+def test_trace_batch_flattens_json_columns(trace):
+    pytest.importorskip("pyarrow")
+    schema = trace.trace_schema()
+    row = dict.fromkeys(trace.trace_columns)
+    events = [SimpleNamespace(**row, ts_us=1, actor='{"user_ad": "qs.chou", "clientid": 7, "role": "admin"}',
+                              target="not json", context=None, _metadata='["a"]'),
+              SimpleNamespace(**row, ts_us=2, actor="{}", target='{"service": "/ds/carux"}', context="{}",
+                              _metadata='{"custom_tags": ["x"]}')]
+    data = trace.trace_batch(events, schema).to_pydict()
+    assert data["actor_user_ad"] == ["qs.chou", None]
+    assert data["actor_clientid"] == ["7", None]
+    assert [json.loads(v) if v else v for v in data["actor_extra"]] == [{"role": "admin"}, None]
+    assert data["target_service"] == [None, "/ds/carux"]
+    assert data["metadata_custom_tags"] == [None, '["x"]']
+    assert data["metadata_extra"] == [None, None]
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_export_events_by_month(trace, event_api, seed_events, tmp_path, fmt):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.dataset as ds
+    # 1/31 23:00起每30分鐘一筆，前兩筆在一月，後兩筆在二月
+    ids = seed_events(datetime(2026, 1, 31, 23, tzinfo=event_api.tz), 4, step=timedelta(minutes=30))
+    seed_events(datetime(2026, 1, 31, 23, tzinfo=event_api.tz), 1, actor={"user_ad": "other"})
+    folder = tmp_path / "export"
+
+    assert trace.export_events("qs.chou", str(folder), fmt, chunk_size=1) == str(folder)
+    assert sorted(p.name for p in folder.iterdir()) == ["month=2026-01", "month=2026-02"]
+    table = ds.dataset(str(folder), format="parquet" if fmt == "parquet" else "ipc", partitioning="hive").to_table()
+    months = dict(zip(table.column("id").to_pylist(), table.column("month").to_pylist()))
+    assert months == dict(zip(ids, ["2026-01", "2026-01", "2026-02", "2026-02"]))
+    assert table.schema.field("ts").type == pa.timestamp("us", tz="UTC")
+
+    with pytest.raises(ValueError):
+        trace.export_events("qs.chou", str(folder), fmt)
+    assert trace.export_events("nobody", str(tmp_path / "empty"), fmt) is None
@@ -0,0 +1,59 @@
+import asyncio
+from concurrent import futures
+import grpc
+import pytest
+# dsbase registers its own valclient.proto/clientapival.proto, the dpam stubs must load next to them
+import dsbase.grpc_cust.valclient_pb2
+import dsbase.tools.request_handler
+from dpam.grpc_cust import valclient_server
+from dpam.grpc_cust import valclient_pb2, valclient_pb2_grpc, valclient_batch_pb2_grpc
+
+
+@pytest.fixture(autouse=True)
+def client_rows(monkeypatch):
+    rows = {"c1": {"PASSWORD": "pw", "TYPE": 2, "EXPIRY": "2030-01-01", "PERMISSION": "QUERY"}}
+    monkeypatch.setattr(valclient_server, "load_client_row", lambda client_id: rows.get(client_id))
+
+
+@pytest.fixture
+def channel():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    servicer = valclient_server.ValClient()
+    valclient_pb2_grpc.add_ValclientServicer_to_server(servicer, server)
+    valclient_batch_pb2_grpc.add_ValclientBatchServicer_to_server(servicer, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    with grpc.insecure_channel(f"localhost:{port}") as channel:
+        yield channel
+    server.stop(None)
+
+
+def test_elabor_detail_and_batch(channel):
+    response = valclient_pb2_grpc.ValclientStub(channel).ElaborDetail(valclient_pb2.Request(client_id="c1"), timeout=5)
+    assert (response.client_id, response.password, response.type) == ("c1", "pw", 2)
+
+    requests = [valclient_pb2.Request(client_id=client_id) for client_id in ("c1", "nobody", "c1")]
+    responses = list(valclient_batch_pb2_grpc.ValclientBatchStub(channel).ElaborDetailBatch(iter(requests), timeout=5))
+    assert [(r.client_id, r.type, r.permission) for r in responses] == [("c1", 2, "QUERY"), ("nobody", 0, "None"), ("c1", 2, "QUERY")]
+
+
+def test_aio_servicer():
+    async def run():
+        server = grpc.aio.server()
+        servicer = valclient_server.AioValClient()
+        valclient_pb2_grpc.add_ValclientServicer_to_server(servicer, server)
+        valclient_batch_pb2_grpc.add_ValclientBatchServicer_to_server(servicer, server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel(f"localhost:{port}") as channel:
+                response = await valclient_pb2_grpc.ValclientStub(channel).ElaborDetail(valclient_pb2.Request(client_id="c1"), timeout=5)
+                call = valclient_batch_pb2_grpc.ValclientBatchStub(channel).ElaborDetailBatch(
+                    iter([valclient_pb2.Request(client_id="nobody"), valclient_pb2.Request(client_id="c1")]), timeout=5)
+                return response, [r async for r in call]
+        finally:
+            await server.stop(None)
+
+    response, responses = asyncio.run(run())
+    assert response.password == "pw"
+    assert [(r.client_id, r.type) for r in responses] == [("nobody", 0), ("c1", 2)]
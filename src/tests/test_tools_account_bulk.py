@@ -0,0 +1,41 @@
+import pytest
+from dpam.tools.account_bulk import export_accounts, import_accounts, parse_csv, parse_ndjson, to_csv, to_ndjson
+
+
+def test_import_reports_bad_rows_and_writes_the_rest(account_db):
+    lines = ['{"CLIENT_ID": "c1", "REGISTRY": "/ds/ml"}',
+             '{"CLIENT_ID": "", "TYPE": 2}',
+             'not json',
+             '{"CLIENT_ID": "c2", "TYPE": 9}',
+             '{"CLIENT_ID": "c3", "PERMISSION": "QUERY|DEBUG"}',
+             '{"CLIENT_ID": "c1"}']
+    result = import_accounts(parse_ndjson(lines), user_id="admin", chunk_size=2)
+    assert result["total"] == 6 and result["inserted"] == 2
+    assert [e["line"] for e in result["errors"]] == [2, 3, 4, 6]
+
+    result = import_accounts(parse_ndjson(['{"CLIENT_ID": "c1", "REGISTRY": "/ds/retrain"}']), user_id="admin")
+    assert result["inserted"] == 0 and len(result["errors"]) == 1
+    result = import_accounts(parse_ndjson(['{"CLIENT_ID": "c1", "REGISTRY": "/ds/retrain"}']), user_id="admin", upsert=True)
+    assert result["updated"] == 1
+    assert [row["REGISTRY"] for row in export_accounts() if row["CLIENT_ID"] == "c1"] == ["/ds/retrain"]
+
+
+def test_import_reports_rows_of_wrong_json_types(account_db):
+    lines = ['{"CLIENT_ID": "c1", "PERMISSION": 1}',
+             '{"CLIENT_ID": "c2", "PASSWORD": 1234}',
+             '{"CLIENT_ID": "c3", "PERMISSION": ["QUERY"]}',
+             '{"CLIENT_ID": "c4", "PASSWORD": {"a": 1}}',
+             '{"CLIENT_ID": "c5"}']
+    result = import_accounts(parse_ndjson(lines), user_id="admin")
+    assert result["inserted"] == 2
+    assert [e["line"] for e in result["errors"]] == [1, 3, 4]
+    assert sorted(row["CLIENT_ID"] for row in export_accounts()) == ["c2", "c5"]
+
+
+def test_csv_round_trip(account_db):
+    import_accounts(parse_ndjson(['{"CLIENT_ID": "c1", "OWNER_USER_ID": "u1"}', '{"CLIENT_ID": "g1", "TYPE": 3}']), user_id="admin")
+    text = "".join(to_csv(export_accounts(types=[2]), chunk_size=1))
+    assert text.splitlines()[0].startswith("CLIENT_ID,TYPE")
+    rows = list(parse_csv(text.splitlines(True)))
+    assert [(line, row["CLIENT_ID"], row["OWNER_USER_ID"]) for line, row in rows] == [(2, "c1", "u1")]
+    assert len(list(to_ndjson(export_accounts(user_id="admin")))) == 1
@@ -0,0 +1,72 @@
+import pytest
+from flask import Flask
+from dpam.tools.config_loader import ConfigLoader
+from dpam.tools.logger import Logger
+from dpam.tools.metrics import Histogram, Metrics, timed
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = Histogram("t_seconds", "test", ["span"], [0.1, 1])
+    hist.observe(0.05, "a")
+    hist.observe(0.5, "a")
+    hist.observe(5, "a")
+    lines = hist.render()
+    assert 't_seconds_bucket{span="a",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{span="a",le="1"} 2' in lines
+    assert 't_seconds_bucket{span="a",le="+Inf"} 3' in lines
+    assert 't_seconds_count{span="a"} 3' in lines
+
+
+def test_spans_of_sampled_request(monkeypatch):
+    monkeypatch.setattr(ConfigLoader, "config", classmethod(lambda cls, catalog: {"enabled": True, "sample_rate": 1.0}))
+    monkeypatch.setattr(Logger, "enabled_for", classmethod(lambda clz, level: False))
+    Metrics.reset_metrics_config()
+    token = Metrics.begin_request()
+    timed("redis")(lambda: None)()
+    with Metrics.span("sqlite"): pass
+    assert [name for name, _ in Metrics._spans.get()] == ["redis", "sqlite"]
+    Metrics.end_request(token, "/api/vapikey", "POST", 200)
+    assert Metrics._spans.get() is None
+
+    text = Metrics.render()
+    assert 'dpam_request_seconds_count{endpoint="/api/vapikey",method="POST",status="200"} 1' in text
+    assert 'dpam_span_seconds_count{span="sqlite"} 1' in text
+    Metrics.reset_metrics_config()
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.setattr(ConfigLoader, "config", classmethod(lambda cls, catalog: {}))
+    Metrics.reset_metrics_config()
+    assert not Metrics.enabled()
+    assert Metrics.begin_request() is None
+    Metrics.reset_metrics_config()
+
+
+def test_requests_failing_with_500_are_observed(monkeypatch):
+    monkeypatch.setattr(ConfigLoader, "config", classmethod(lambda cls, catalog: {"enabled": True, "sample_rate": 1.0}))
+    monkeypatch.setattr(Logger, "enabled_for", classmethod(lambda clz, level: False))
+    Metrics.reset_metrics_config()
+    app = Flask(__name__)
+    # DEBUG/TESTING propagate the exception, after_request is skipped
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+    Metrics.init_app(app)
+
+    @app.route("/boom")
+    def boom():
+        with Metrics.span("sqlite"): pass
+        raise RuntimeError("boom")
+
+    @app.route("/ok")
+    def ok():
+        return "ok"
+
+    client = app.test_client()
+    assert client.get("/ok").status_code == 200
+    with pytest.raises(RuntimeError):
+        client.get("/boom")
+    assert Metrics._spans.get() is None
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'dpam_request_seconds_count{endpoint="/ok",method="GET",status="200"} 1' in text
+    assert 'dpam_request_seconds_count{endpoint="/boom",method="GET",status="500"} 1' in text
+    Metrics.reset_metrics_config()
@@ -0,0 +1,57 @@
+import pytest
+from dsbase.tools import request_handler as dsbase_request_handler
+from dpam.tools.permission_matcher import compile_registry, compile_registries, ds_service, ds_entry
+
+
+@pytest.fixture
+def dsbase_permit(monkeypatch):
+    monkeypatch.setattr(dsbase_request_handler.Logger, "log", classmethod(lambda clz, *args, **kwargs: None))
+    return dsbase_request_handler.validate_request_reg_permit
+
+
+def test_registry_entries():
+    matcher = compile_registry("/ds/carux/apds,/ds/retrain/*,-/ds/retrain/cds")
+    assert matcher.validate("http://host:80/ds/carux/apds") == "Permit"
+    assert matcher.validate("/ds/carux/apds/query?month=2024-01") == "Permit"
+    assert matcher.validate("/ds/carux/apdsx") == "Permit"
+    assert matcher.validate("/ds/retrain/any/sub") == "Permit"
+    assert matcher.validate("/ds/retrain/cds") == "No Permit"
+    assert matcher.validate("/ds/ml/regression") == "No Permit"
+    assert compile_registry("").validate("/ds/carux/apds") == "No Permit"
+    assert compile_registry("/ds/carux/apds,").validate("/ds/other") == "No Permit"
+
+
+@pytest.mark.parametrize("registry, url", [
+    ("/ds/retrain/*,-/ds/retrain/cds", "/ds/retrain/cds2"),
+    ("/ds/carux/apds", "/ds/carux/apds_v2"),
+    ("/ds/*/apds", "/ds/a/b/apds"),
+    ("/ds/*/apds", "/ds/a/apds"),
+    ("/ds/ml/reg*", "/ds/ml/reg"),
+    ("/ds/ml/reg*", "/ds/ml/regression/v1"),
+    ("/ds", "/ds/anything"),
+    ("/ds/", "/ds/anything"),
+    ("/ds/carux/*,-/ds/carux/apds", "http://host/ds/carux/apds/q?x=1"),
+    ("/ds/carux/*,-/ds/carux/apds", "/ds/carux/other"),
+    ("/ds/mfg/a,/ml/b", "/ds/ml/b/c"),
+    ("/eng/ispec", "/eng/ispec/define"),
+    ("/ds/mfg/f8.v1", "/ds/mfg/f8xv1"),
+])
+def test_same_result_as_dsbase(dsbase_permit, registry, url):
+    assert compile_registry(registry).validate(url) == dsbase_permit(url, registry)
+
+
+def test_local_variant_has_no_service_type():
+    matcher = compile_registry("/ds/retrain,-/ds/retrain/cds", ds_service, ds_entry, True)
+    assert matcher.permit("http://host/ds/retrain/x")
+    assert matcher.permit("/ds/retrain_v2")
+    assert not matcher.permit("/ds/retrain/cds/x")
+    assert not matcher.permit("/ds/retrain/cds2")
+    assert compile_registry("/ds", ds_service, ds_entry, True).permit("/ds/any")
+
+
+def test_index_checks_all_owners():
+    index = compile_registries((("c1", "/ds/carux/apds"), ("c2", "/ds/carux/*,-/ds/carux/apds"),
+                                ("c3", "/ds/carux/*"), ("c4", None)))
+    assert index.permitted("/ds/carux/apds") == ["c1", "c3"]
+    assert index.permitted("/ds/carux/apds_v2") == ["c1", "c3"]
+    assert index.permitted("/ds/carux/other") == ["c2", "c3"]
@@ -0,0 +1,50 @@
+import pytest
+from dpam.dbtools.db_connection import DbConnection
+from dpam.dbtools.row_access import fetch_all
+from dpam.dbtools.sql_buffer import SqlBuffer
+from dpam.tools.registry_validator import RegistryValidator
+
+
+class ListLog:
+    def __init__(self):
+        self.lines = []
+
+    def log(self, msg):
+        self.lines.append(msg)
+
+
+@pytest.fixture
+def accounts(account_db):
+    with DbConnection.connect() as cn:
+        cn.executemany("INSERT INTO ACCOUNT (CLIENT_ID, TYPE, REGISTRY, BIND_GROUP, BIND_ROLE) VALUES (?, ?, ?, ?, ?)",
+                       [("/ds/retrain", 1, "/cds,/*", "None", "None"),
+                        ("/ds/retrain/cds", 1, "*", "None", "None"),
+                        ("/ds/retrain/*", 1, "-/cds", "None", "None"),
+                        ("/ds/ml", 1, "/regression", "None", "None"),
+                        ("retrain", 4, "/ds/retrain/abc", "None", "None"),
+                        ("user1", 2, "/ds/retrain/cds,/unknown", "None", "retrain")])
+
+
+def registry_of(client_id, type):
+    buf = SqlBuffer("SELECT REGISTRY FROM ACCOUNT").add_eq("CLIENT_ID", client_id).add_eq("TYPE", type)
+    return [row["REGISTRY"] for row in fetch_all(buf)]
+
+
+def test_dry_run_reports_without_writing(accounts):
+    report = RegistryValidator(log=ListLog()).run(dry_run=True)
+    assert {"client_id": "/ds/retrain/abc", "type": 1, "registry": "*"} in report["inserts"]
+    assert {"client_id": "/ds/ml/regression", "type": 1, "registry": "*"} in report["inserts"]
+    assert {"client_id": "/ds/retrain/*", "type": 1, "before": "-/cds", "after": "-/cds,/abc"} in report["updates"]
+    assert {"client_id": "user1", "type": 2, "invalid": ["/unknown"]} in report["invalid"]
+    assert report["checked"] == report["total"] == 6
+    assert registry_of("/ds/retrain/abc", 1) == []
+
+
+def test_corrections_are_written(accounts):
+    progress = []
+    RegistryValidator(log=ListLog(), progress=lambda checked, total: progress.append(checked)).run()
+    assert progress == [1, 2, 3, 4, 5, 6]
+    assert registry_of("/ds/retrain/abc", 1) == ["*"]
+    assert registry_of("/ds/retrain/*", 1) == ["-/cds,/abc"]
+    assert registry_of("user1", 2) == ["/ds/retrain/cds,/ds/retrain/abc"]
+    assert RegistryValidator(log=ListLog()).run(dry_run=True)["inserts"] == []
@@ -0,0 +1,32 @@
+import pytest
+from dpam.dbtools.db_connection import DbConnection
+from dpam.tools.resource_index import ResourceIndex
+
+
+@pytest.fixture
+def resource_db(account_db):
+    ResourceIndex.reset()
+    with DbConnection.connect() as cn:
+        cn.executemany("INSERT INTO ACCOUNT (CLIENT_ID, TYPE, REGISTRY) VALUES (?, ?, ?)",
+                       [("/ds/retrain", 1, "/cds,/*"), ("/ds/retrain/cds", 1, "*"), ("/ds/retrain/*", 1, "-/cds"),
+                        ("/ds/ml", 1, "/regression"), ("ml", 4, "/ds/ml")])
+    yield
+    ResourceIndex.reset()
+
+
+def test_best_match(resource_db):
+    assert ResourceIndex.best_match("/ds/retrain/abc") == ("/ds/retrain/*", "-/cds")
+    assert ResourceIndex.best_match("/ds/retrain/cds/abc") == ("/ds/retrain/cds", "*")
+    assert ResourceIndex.best_match("/ds/ml/class") == ("/ds/ml", "/regression")
+    assert ResourceIndex.best_match("/cds/abc") is None
+
+
+def test_refresh_after_write(resource_db):
+    assert ResourceIndex.best_match("/ds/ml/class/v1") == ("/ds/ml", "/regression")
+    with DbConnection.connect() as cn:
+        cn.execute("INSERT INTO ACCOUNT (CLIENT_ID, TYPE, REGISTRY) VALUES ('/ds/ml/class', 1, '*')")
+        cn.execute("DELETE FROM ACCOUNT WHERE CLIENT_ID = '/ds/retrain/*'")
+    ResourceIndex.refresh("/ds/ml/class")
+    ResourceIndex.refresh("/ds/retrain/*")
+    assert ResourceIndex.best_match("/ds/ml/class/v1") == ("/ds/ml/class", "*")
+    assert ResourceIndex.best_match("/ds/retrain/abc") == ("/ds/retrain", "/cds,/*")
@@ -0,0 +1,31 @@
+from dpam.tools.config_loader import ConfigLoader
+from dpam.tools.token_cache import ApiKeyRecord, TokenCache
+
+
+def test_record_is_parsed_once():
+    record = ApiKeyRecord("user1:QUERY|DEBUG:/ds/apds,-/ds/apds/x")
+    assert record.client_id == "user1"
+    assert record.permissions == {"QUERY", "DEBUG"}
+    assert record.can_query()
+    assert record.matcher.permit("/ds/apds/y")
+    assert not record.matcher.permit("/ds/apds/x")
+    assert not ApiKeyRecord("user1:DEBUG:").can_query()
+
+
+def test_token_is_read_from_redis_until_dropped(monkeypatch):
+    loaded = []
+    def load(token):
+        loaded.append(token)
+        return ApiKeyRecord(f"user1:QUERY:/ds/{len(loaded)}")
+    TokenCache.reset_cache_config()
+    monkeypatch.setattr(ConfigLoader, "config", classmethod(lambda cls, catalog: {"keyevents": False}))
+    monkeypatch.setattr(TokenCache, "_ensure_listener", classmethod(lambda clz: None))
+    monkeypatch.setattr(TokenCache, "_load", classmethod(lambda clz, token: load(token)))
+
+    assert TokenCache.get("t1").registry == "/ds/1"
+    assert TokenCache.get("t1").registry == "/ds/1"
+    TokenCache._on_message({"data": "t1"})
+    assert TokenCache.get("t1").registry == "/ds/2"
+    assert TokenCache.get(None) is None
+    assert loaded == ["t1", "t1"]
+    TokenCache.reset_cache_config()
@@ -0,0 +1,30 @@
+import threading
+from dpam.tools.ttl_cache import TTLCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=0)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entry_expires_after_ttl():
+    cache = TTLCache(ttl=0.001)
+    cache.set("a", 1)
+    threading.Event().wait(0.01)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_pop_matching():
+    cache = TTLCache()
+    cache.set(("u1", 2), 1)
+    cache.set(("u2", 2), 2)
+    cache.set(("r1", 1), 3)
+    assert cache.pop_matching(lambda key: key[1] == 2) == 2
+    assert len(cache) == 1